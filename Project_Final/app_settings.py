@@ -3,3 +3,30 @@ class AppSettings:  # Set defaults, primarily for organization for time and simi
         self.time_samples = 2000
         self.max_time = 126.1e6
         self.anim_speed = 1.0
+
+        # Which force kernel to use, see differential.FORCE_BACKENDS.
+        self.force_backend = "direct"
+        self.opening_angle = 0.5  # Barnes-Hut only. Smaller is more exact but slower, 0 is the same as direct.
+        self.force_processes = 0  # Parallel only, processes to share the forces between. 0 for one per core.
+
+        # Which integrator to use, see integrators.INTEGRATORS.
+        self.integrator = "odeint"
+        self.steps_per_sample = 4  # Fixed-step integrators, steps between two time samples (regularized: at the start).
+        self.block_eta = 0.02  # Block time steps only, each body steps at about eta * |acceleration| / |jerk|.
+
+        # Plummer softening length in meters, keeps close encounters from grinding the step size down to nothing.
+        self.softening_length = 0.0
+        # Merge bodies that touch (see the radius of each body), conserving mass and momentum.
+        self.merge_collisions = False
+
+        # Number type for the whole run, see precision.PRECISIONS. float32 for previews, extended for long chaotic runs.
+        self.precision = "float64"
+
+        # Finished runs are cached on disk (result_cache.py) up to this size. 0 turns the cache off.
+        self.cache_size_mb = 1024.0
+
+        # Start animating straight away while the simulation is still running.
+        self.stream_animation = False
+
+        # How the bodies are drawn, see body_renderers.RENDERERS. "auto" uses one collection for big scenes.
+        self.renderer = "auto"
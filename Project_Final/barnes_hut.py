@@ -0,0 +1,236 @@
+# Barnes-Hut tree gravity, an approximate but O(N log N) alternative to differential.DirectSumKernel.
+# In 2D the tree is a quadtree and in 3D an octree, both are built the same way (2^n_dimensions children per cell).
+import numpy as np
+
+
+# Bits per axis for the Morton keys, chosen so that all the interleaved bits fit in one uint64.
+MORTON_BITS = {2: 31, 3: 21}
+
+
+# Interleaves the bits of the integer grid coordinates, so that sorting by the key sorts bodies cell by cell.
+def morton_keys(grid_coords, n_dimensions, bits):
+    keys = np.zeros(len(grid_coords), dtype=np.uint64)
+    for bit in range(bits):
+        for dimension in range(n_dimensions):
+            axis_bit = (grid_coords[:, dimension] >> np.uint64(bit)) & np.uint64(1)
+            keys |= axis_bit << np.uint64(bit * n_dimensions + dimension)
+    return keys
+
+
+# Stores the tree as flat arrays, one entry per cell. Bodies are kept sorted so every cell is a contiguous range.
+class BarnesHutTree:
+    def __init__(self, positions, masses, leaf_size=8):
+        n_bodies, n_dimensions = positions.shape
+        bits = MORTON_BITS[n_dimensions]
+        shift_per_level = np.uint64(n_dimensions)
+
+        # Root cell is the smallest cube (or square) containing everything.
+        lower_corner = positions.min(axis=0)
+        root_width = float(np.max(positions.max(axis=0) - lower_corner))
+        if root_width <= 0.0:
+            root_width = 1.0  # Every body on the same spot, any width will do.
+        root_width *= 1.0 + 1e-9  # So the furthest body does not land exactly on the outer edge.
+
+        grid_coords = np.floor((positions - lower_corner) / root_width * 2.0 ** bits)
+        grid_coords = np.clip(grid_coords, 0, 2 ** bits - 1).astype(np.uint64)
+        keys = morton_keys(grid_coords, n_dimensions, bits)
+
+        self.order = np.argsort(keys, kind="stable")  # Sorted index -> original body index.
+        keys = keys[self.order]
+        self.positions = positions[self.order]
+        self.masses = masses[self.order]
+
+        # Per-cell arrays, filled one level at a time.
+        starts = [np.array([0])]
+        counts = [np.array([n_bodies])]
+        widths = [np.array([root_width])]
+        cell_masses = [np.array([self.masses.sum()])]
+        centres = [self.centre_of_mass(np.arange(n_bodies), np.array([0]), cell_masses[0])]
+        leaves = [np.array([n_bodies <= leaf_size])]
+        child_starts = []
+        child_counts = []
+
+        n_cells = 1
+        level = 0
+        while True:
+            open_cells = np.flatnonzero(~leaves[-1])
+            if len(open_cells) == 0:
+                child_starts.append(np.zeros(len(leaves[-1]), dtype=np.int64))
+                child_counts.append(np.zeros(len(leaves[-1]), dtype=np.int64))
+                break
+
+            # All the bodies that live in a cell we are about to split, in sorted order.
+            parent_starts = starts[-1][open_cells]
+            parent_counts = counts[-1][open_cells]
+            body_index = np.repeat(parent_starts - np.cumsum(parent_counts) + parent_counts, parent_counts) + \
+                np.arange(parent_counts.sum())
+
+            # A child begins wherever the key prefix one level down changes, or where a new parent range begins.
+            prefixes = keys[body_index] >> (shift_per_level * np.uint64(bits - level - 1))
+            new_child = np.ones(len(body_index), dtype=bool)
+            new_child[1:] = (prefixes[1:] != prefixes[:-1]) | (body_index[1:] != body_index[:-1] + 1)
+            first_in_child = np.flatnonzero(new_child)
+
+            level_starts = body_index[first_in_child]
+            level_counts = np.diff(np.append(first_in_child, len(body_index)))
+            level_masses = np.add.reduceat(self.masses[body_index], first_in_child)
+            level_centres = self.centre_of_mass(body_index, first_in_child, level_masses)
+
+            # Hook the children up to their parents. Children of one parent are next to each other.
+            parent_of_child = np.searchsorted(parent_starts, level_starts, side="right") - 1
+            parent_child_counts = np.bincount(parent_of_child, minlength=len(open_cells))
+            parent_child_starts = n_cells + np.cumsum(parent_child_counts) - parent_child_counts
+
+            level_child_starts = np.zeros(len(leaves[-1]), dtype=np.int64)
+            level_child_counts = np.zeros(len(leaves[-1]), dtype=np.int64)
+            level_child_starts[open_cells] = parent_child_starts
+            level_child_counts[open_cells] = parent_child_counts
+            child_starts.append(level_child_starts)
+            child_counts.append(level_child_counts)
+
+            level += 1
+            n_cells += len(level_starts)
+
+            starts.append(level_starts)
+            counts.append(level_counts)
+            widths.append(np.full(len(level_starts), root_width / 2.0 ** level))
+            cell_masses.append(level_masses)
+            centres.append(level_centres)
+            # Out of key bits means the bodies are (numerically) on top of each other, so stop splitting.
+            leaves.append((level_counts <= leaf_size) | (level == bits))
+
+        self.starts = np.concatenate(starts)
+        self.counts = np.concatenate(counts)
+        self.widths = np.concatenate(widths)
+        self.cell_masses = np.concatenate(cell_masses)
+        self.centres = np.concatenate(centres)
+        self.leaves = np.concatenate(leaves)
+        self.child_starts = np.concatenate(child_starts)
+        self.child_counts = np.concatenate(child_counts)
+
+    # Centre of mass for consecutive groups of bodies, falls back to the plain centre for massless groups.
+    def centre_of_mass(self, body_index, first_in_group, group_masses):
+        group_positions = self.positions[body_index]
+        weighted = np.add.reduceat(group_positions * self.masses[body_index, np.newaxis], first_in_group)
+        plain = np.add.reduceat(group_positions, first_in_group)
+        group_counts = np.diff(np.append(first_in_group, len(body_index)))
+
+        safe_masses = np.where(group_masses > 0.0, group_masses, 1.0)
+        return np.where(
+            (group_masses > 0.0)[:, np.newaxis],
+            weighted / safe_masses[:, np.newaxis],
+            plain / group_counts[:, np.newaxis]
+        )
+
+
+# Expands (body, cell) pairs into (body, item) pairs, where each cell owns `item_counts` consecutive items.
+def expand_pairs(bodies, item_starts, item_counts):
+    repeat_index = np.repeat(np.arange(len(bodies)), item_counts)
+    offsets = np.arange(len(repeat_index)) - np.repeat(np.cumsum(item_counts) - item_counts, item_counts)
+    return bodies[repeat_index], item_starts[repeat_index] + offsets
+
+
+# Same interface as differential.DirectSumKernel, so it can be dropped in wherever that one is used. Massless bodies are
+# test particles here as well: they are left out of the tree, and only walk it to find their own acceleration.
+class BarnesHutKernel:
+    def __init__(self, masses, number_dimensions, G=6.67408e-11, opening_angle=0.5, leaf_size=8, chunk_size=4096,
+                 softening=0.0):
+        if number_dimensions != 2 and number_dimensions != 3:
+            raise ValueError("Bad n_dimensions")
+
+        self.G = G
+        self.number_dimensions = number_dimensions
+        self.masses = np.asarray(masses, dtype=np.float64)
+        self.n_bodies = len(self.masses)
+        self.opening_angle = opening_angle
+        self.leaf_size = leaf_size
+        self.chunk_size = chunk_size  # Bodies walked at once, keeps the pair lists from eating all the memory.
+        self.softening_sq = softening ** 2  # Plummer softening, see differential.DirectSumKernel
+        self.sources = np.flatnonzero(self.masses != 0.0)
+
+    def accelerations(self, pos_vector_bodies):
+        """
+        Calculate the approximate gravitational acceleration on every body
+
+        :param pos_vector_bodies: Positions, shape (n_bodies, n_dimensions)
+        :return: Accelerations, same shape as the positions
+        """
+
+        pos_vector_bodies = np.asarray(pos_vector_bodies, dtype=np.float64)
+        if len(self.sources) == 0:
+            return np.zeros((self.n_bodies, self.number_dimensions))  # Nothing to pull on anything.
+
+        if len(self.sources) == self.n_bodies:
+            # Bodies walk the tree in tree order, so the ones walked together are close and look at the same cells.
+            tree = BarnesHutTree(pos_vector_bodies, self.masses, self.leaf_size)
+            target_positions = tree.positions
+            target_of_member = np.arange(self.n_bodies)  # Which of the walking bodies each body in the tree is
+        else:
+            tree = BarnesHutTree(pos_vector_bodies[self.sources], self.masses[self.sources], self.leaf_size)
+            target_positions = pos_vector_bodies
+            target_of_member = self.sources[tree.order]
+        theta_sq = self.opening_angle ** 2
+
+        dveldt_sorted = np.zeros((self.n_bodies, self.number_dimensions))
+
+        for chunk_begin in range(0, self.n_bodies, self.chunk_size):
+            # Every body in the chunk starts off looking at the root cell.
+            bodies = np.arange(chunk_begin, min(chunk_begin + self.chunk_size, self.n_bodies))
+            cells = np.zeros(len(bodies), dtype=np.int64)
+
+            while len(bodies) > 0:
+                distance_direction = tree.centres[cells] - target_positions[bodies]
+                distance_tot_sq = np.einsum("pd,pd->p", distance_direction, distance_direction)
+
+                # Far enough away (width / distance < theta), so treat the whole cell as one point mass.
+                far_enough = tree.widths[cells] ** 2 < theta_sq * distance_tot_sq
+                self.add_contributions(
+                    dveldt_sorted,
+                    bodies[far_enough],
+                    tree.cell_masses[cells[far_enough]],
+                    distance_direction[far_enough],
+                    distance_tot_sq[far_enough]
+                )
+
+                # Too close, but a leaf, so sum the bodies inside it directly (skipping the body itself).
+                direct = ~far_enough & tree.leaves[cells]
+                direct_bodies, members = expand_pairs(
+                    bodies[direct], tree.starts[cells[direct]], tree.counts[cells[direct]]
+                )
+                not_self = target_of_member[members] != direct_bodies
+                direct_bodies = direct_bodies[not_self]
+                members = members[not_self]
+                member_direction = tree.positions[members] - target_positions[direct_bodies]
+                self.add_contributions(
+                    dveldt_sorted,
+                    direct_bodies,
+                    tree.masses[members],
+                    member_direction,
+                    np.einsum("pd,pd->p", member_direction, member_direction)
+                )
+
+                # Otherwise open the cell up and look at its children next time round.
+                opened = ~far_enough & ~tree.leaves[cells]
+                bodies, cells = expand_pairs(
+                    bodies[opened], tree.child_starts[cells[opened]], tree.child_counts[cells[opened]]
+                )
+
+        if len(self.sources) < self.n_bodies:
+            return dveldt_sorted  # Walked in the order they were given in.
+
+        # Back into the order the bodies were given in.
+        dveldt_n = np.empty_like(dveldt_sorted)
+        dveldt_n[tree.order] = dveldt_sorted
+        return dveldt_n
+
+    # Newtons law of gravity for a list of (body, source) pairs, summed onto each body.
+    def add_contributions(self, dveldt_sorted, bodies, source_masses, distance_direction, distance_tot_sq):
+        if len(bodies) == 0:
+            return
+
+        distance_tot_sq = distance_tot_sq + self.softening_sq
+        strength = self.G * source_masses / (distance_tot_sq * np.sqrt(distance_tot_sq))
+        for dimension in range(self.number_dimensions):
+            dveldt_sorted[:, dimension] += np.bincount(
+                bodies, weights=strength * distance_direction[:, dimension], minlength=self.n_bodies
+            )
@@ -0,0 +1,142 @@
+#############################################################
+#           N_BODY PROBLEM HEADLESS BATCH RUNNER            #
+# Runs scene JSON files (same format as Save / Load) without#
+# the window, PySide2 or matplotlib. Handy on servers.      #
+#                                                           #
+# python batch_runner.py saves/*.json --output-dir results  #
+#############################################################
+
+
+import argparse
+import os
+import sys
+import time
+
+import diagnostics
+import instrumentation
+import scene_io
+import simulation
+import trajectory_store
+from app_settings import AppSettings
+from differential import FORCE_BACKENDS
+from integrators import INTEGRATORS
+from precision import PRECISIONS
+from progress import ConsoleProgress, ProgressObserver
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Simulate N-body scene files without the GUI.")
+    parser.add_argument("scenes", nargs="+", help="Scene files (.json or .nbscene), globs like saves/*.json work too")
+    parser.add_argument("--output-dir", default="results", help="Where to write the .nbtraj trajectories")
+    parser.add_argument("--dimensions", type=int, choices=[2, 3], default=3, help="Number of dimensions")
+    parser.add_argument("--force-backend", choices=FORCE_BACKENDS, help="Override the scene's force backend")
+    parser.add_argument(
+        "--force-processes", type=int, help="Processes for the parallel force backend, 0 for one per core"
+    )
+    parser.add_argument("--integrator", choices=INTEGRATORS, help="Override the scene's integrator")
+    parser.add_argument("--precision", choices=PRECISIONS, help="Override the scene's precision")
+    parser.add_argument("--softening", type=float, help="Override the scene's Plummer softening length (meters)")
+    parser.add_argument(
+        "--merge-radius", type=float,
+        help="Merge bodies that touch, giving every body without a radius this one (meters)"
+    )
+    parser.add_argument("--time-samples", type=int, help="Override the scene's number of time samples")
+    parser.add_argument("--max-time", type=float, help="Override the scene's max time")
+    parser.add_argument("--quiet", action="store_true", help="Only print the timings")
+    parser.add_argument(
+        "--diagnostics", action="store_true",
+        help="Print the relative errors in energy, momentum, angular momentum and centre of mass over each run"
+    )
+    parser.add_argument(
+        "--energy-threshold", type=float,
+        help="Exit with an error if any run's relative energy error goes above this (implies --diagnostics)"
+    )
+    return parser.parse_args(argv)
+
+
+def run_scene(scene_path, args):
+    app_settings = AppSettings()
+
+    load_start = time.perf_counter()
+    bodies = scene_io.load_scene(scene_path, app_settings)
+
+    # Command line wins over whatever the scene had saved.
+    if args.force_backend is not None:
+        app_settings.force_backend = args.force_backend
+    if args.force_processes is not None:
+        app_settings.force_processes = args.force_processes
+    if args.integrator is not None:
+        app_settings.integrator = args.integrator
+    if args.precision is not None:
+        app_settings.precision = args.precision
+    if args.softening is not None:
+        app_settings.softening_length = args.softening
+    if args.merge_radius is not None:
+        app_settings.merge_collisions = True
+        bodies.radii[bodies.radii <= 0.0] = args.merge_radius
+    if args.time_samples is not None:
+        app_settings.time_samples = args.time_samples
+    if args.max_time is not None:
+        app_settings.max_time = args.max_time
+
+    scene_name = os.path.splitext(os.path.basename(scene_path))[0]
+
+    output_path = os.path.join(args.output_dir, f"{scene_name}.nbtraj")
+
+    # Samples go straight to disk as the run goes, see trajectory_store.py for reading them back.
+    report = instrumentation.RunReport()
+    simulate_start = time.perf_counter()
+    total_time, solutions = simulation.run_simulation(
+        bodies,
+        app_settings,
+        args.dimensions,
+        ProgressObserver() if args.quiet else ConsoleProgress(scene_name),
+        output_path,
+        report=report
+    )
+    simulate_end = time.perf_counter()
+    trajectory_store.save_report(output_path, report)  # Timings and solver statistics, next to the trajectory.
+
+    print(
+        f"{scene_name}: {len(bodies)} bodies, {app_settings.time_samples} samples, "
+        f"{app_settings.integrator}/{app_settings.force_backend} | "
+        f"load {simulate_start - load_start:.3f} s, "
+        f"simulate and write {simulate_end - simulate_start:.3f} s -> {output_path}",
+        flush=True
+    )
+    if not args.quiet:
+        print(report.format(), flush=True)
+
+    if not args.diagnostics and args.energy_threshold is None:
+        return True
+
+    result = diagnostics.compute_diagnostics(
+        total_time, solutions, bodies.masses, args.dimensions, softening=app_settings.softening_length
+    )
+    print(diagnostics.format_report(result), flush=True)
+
+    if args.energy_threshold is not None and result.max_errors()["energy"] > args.energy_threshold:
+        print(f"  Energy error above {args.energy_threshold:.1e}!", flush=True)
+        return False
+    return True
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    batch_start = time.perf_counter()
+    scene_paths = scene_io.expand_scene_paths(args.scenes)
+    n_failed = 0
+    for scene_path in scene_paths:
+        if not run_scene(scene_path, args):
+            n_failed += 1
+
+    print(f"Ran {len(scene_paths)} scene(s) in {time.perf_counter() - batch_start:.3f} s")
+    if n_failed > 0:
+        print(f"{n_failed} scene(s) went over the energy error threshold")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
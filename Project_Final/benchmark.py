@@ -0,0 +1,298 @@
+#############################################################
+#           N_BODY PROBLEM BENCHMARKS                       #
+# Times every preset in saves/ and some made up clusters    #
+# through each force kernel and integrator, and saves the   #
+# numbers as JSON so two commits can be compared.           #
+#                                                           #
+# python benchmark.py --output before.json                  #
+# python benchmark.py --compare before.json after.json      #
+#############################################################
+
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+import diagnostics
+import instrumentation
+import scene_io
+import simulation
+from app_settings import AppSettings
+from differential import BodyStore, FORCE_BACKENDS
+from integrators import INTEGRATORS
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_SCENES = os.path.join(SCRIPT_DIR, "saves", "*.json")
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+BENCHMARK_VERSION = 1  # Bump if what gets measured changes, so old files are not compared like for like.
+
+# Made up clusters: bodies spread through a sphere, run for a small fraction of the time it takes to cross it.
+SYNTHETIC_RADIUS = 1.0e12  # m
+SYNTHETIC_MASS = 2.0e30  # kg, about the sun
+SYNTHETIC_TIME_SAMPLES = 11
+SYNTHETIC_CROSSING_FRACTION = 0.01
+
+# Combinations that would take hours or run out of memory, these get recorded as skipped instead.
+ODEINT_MAX_BODIES = 1000  # LSODA can switch to a dense Jacobian, (6N)^2 floats.
+DIRECT_MAX_BODIES = 5000  # Every pair is stored, N^2 / 2 of them.
+BLOCK_HERMITE_MAX_BODIES = 2000  # Jerks are worked out by broadcasting against every body.
+
+# How much worse something has to get before --compare calls it a regression.
+DEFAULT_TOLERANCE = 0.10  # Wall time and memory, as a fraction.
+ENERGY_ERROR_TOLERANCE = 10.0  # Energy error, as a factor.
+MIN_COMPARED_SECONDS = 0.05  # Runs quicker than this are mostly timer noise, their timings are not compared.
+MIN_COMPARED_MB = 1.0  # Same for tiny amounts of memory.
+
+
+def synthetic_scene(n_bodies, seed=0):
+    """
+    A cluster of n_bodies equal masses, uniformly spread through a sphere with random (roughly virial) velocities
+
+    :return: differential.BodyStore, and the AppSettings to run it with
+    """
+
+    random_generator = np.random.default_rng(seed)
+    directions = random_generator.normal(size=(n_bodies, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+    positions = directions * SYNTHETIC_RADIUS * random_generator.random(n_bodies)[:, np.newaxis] ** (1.0 / 3.0)
+
+    velocity_scale = np.sqrt(simulation.G * SYNTHETIC_MASS * n_bodies / SYNTHETIC_RADIUS) * 0.5
+    velocities = random_generator.normal(scale=velocity_scale / np.sqrt(3.0), size=(n_bodies, 3))
+
+    bodies = BodyStore.from_arrays(
+        [f"Body {i_body}" for i_body in range(n_bodies)], np.full(n_bodies, SYNTHETIC_MASS), positions, velocities
+    )
+
+    app_settings = AppSettings()
+    app_settings.time_samples = SYNTHETIC_TIME_SAMPLES
+    app_settings.max_time = SYNTHETIC_CROSSING_FRACTION * SYNTHETIC_RADIUS / velocity_scale
+    return bodies, app_settings
+
+
+def skip_reason(n_bodies, force_backend, integrator):  # None if the combination is worth running.
+    if integrator == "odeint" and n_bodies > ODEINT_MAX_BODIES:
+        return f"odeint above {ODEINT_MAX_BODIES} bodies"
+    if force_backend == "direct" and n_bodies > DIRECT_MAX_BODIES:
+        return f"direct summation above {DIRECT_MAX_BODIES} bodies"
+    if integrator == "block_hermite" and n_bodies > BLOCK_HERMITE_MAX_BODIES:
+        return f"block time steps above {BLOCK_HERMITE_MAX_BODIES} bodies"
+    return None
+
+
+def run_benchmark(bodies, app_settings, number_dimensions, repeat=1, measure_memory=True):
+    """
+    Time one scene with one set of settings
+
+    :param repeat: Runs to time, the fastest one counts
+    :param measure_memory: Also do one more run under tracemalloc for the peak memory (slower, so not timed)
+    :return: Dictionary of the measurements
+    """
+
+    wall_times = []
+    for _ in range(repeat):
+        report = instrumentation.RunReport()  # Counts the RHS evaluations, and what the solver got up to.
+        start = time.perf_counter()
+        total_time, solutions = simulation.run_simulation(bodies, app_settings, number_dimensions, report=report)
+        wall_times.append(time.perf_counter() - start)
+
+    peak_memory_mb = None
+    if measure_memory:
+        tracemalloc.start()  # NumPy reports its array memory to tracemalloc as well.
+        try:
+            simulation.run_simulation(bodies, app_settings, number_dimensions)
+            peak_memory_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+
+    end_errors = diagnostics.compute_diagnostics(
+        total_time[[0, -1]], solutions[[0, -1]], bodies.masses, number_dimensions,
+        softening=app_settings.softening_length
+    ).final_errors()
+
+    return {
+        "wall_time_s": min(wall_times),
+        "rhs_evaluations": report.counters["rhs_evaluations"],
+        "body_evaluations": report.counters["body_evaluations"],
+        "peak_memory_mb": peak_memory_mb,
+        "energy_error": end_errors["energy"],
+        "solver": report.solver,
+    }
+
+
+# Where the numbers came from, so a comparison between machines or library versions does not go unnoticed.
+def environment_info():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "benchmark_version": BENCHMARK_VERSION,
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# Every (scene, force backend, integrator) to run, with its bodies and settings.
+def benchmark_cases(args):
+    cases = []
+    for pattern in args.scenes:
+        for scene_path in sorted(glob.glob(pattern)):
+            app_settings = AppSettings()
+            bodies = scene_io.load_scene(scene_path, app_settings)
+            cases.append((os.path.splitext(os.path.basename(scene_path))[0], bodies, app_settings))
+
+    for n_bodies in args.sizes:
+        bodies, app_settings = synthetic_scene(n_bodies, args.seed)
+        cases.append((f"synthetic_{n_bodies}", bodies, app_settings))
+
+    return cases
+
+
+def run_all(args):
+    results = []
+    for scene_name, bodies, scene_settings in benchmark_cases(args):
+        for force_backend in args.backends:
+            for integrator in args.integrators:
+                result = {
+                    "scene": scene_name,
+                    "n_bodies": len(bodies),
+                    "force_backend": force_backend,
+                    "integrator": integrator,
+                    "time_samples": scene_settings.time_samples,
+                }
+
+                reason = skip_reason(len(bodies), force_backend, integrator)
+                if reason is not None:
+                    result["skipped"] = reason
+                    print(f"{scene_name} {force_backend}/{integrator}: skipped ({reason})", flush=True)
+                    results.append(result)
+                    continue
+
+                app_settings = AppSettings()
+                for name in scene_io.SAVED_SETTINGS:
+                    setattr(app_settings, name, getattr(scene_settings, name))
+                app_settings.force_backend = force_backend
+                app_settings.integrator = integrator
+
+                try:
+                    result.update(run_benchmark(bodies, app_settings, args.dimensions, args.repeat, not args.no_memory))
+                except ValueError as error:  # Combinations that do not go together, EG block steps with Barnes-Hut.
+                    result["skipped"] = str(error)
+                    print(f"{scene_name} {force_backend}/{integrator}: skipped ({error})", flush=True)
+                    results.append(result)
+                    continue
+                results.append(result)
+
+                memory_text = "n/a" if result["peak_memory_mb"] is None else f"{result['peak_memory_mb']:.1f} MB"
+                print(
+                    f"{scene_name} {force_backend}/{integrator}: {result['wall_time_s']:.3f} s, "
+                    f"{result['rhs_evaluations']} RHS, {memory_text}, energy error {result['energy_error']:.2e}",
+                    flush=True
+                )
+
+    return {"environment": environment_info(), "dimensions": args.dimensions, "results": results}
+
+
+def result_key(result):
+    return result["scene"], result["force_backend"], result["integrator"]
+
+
+def compare(base_path, new_path, tolerance=DEFAULT_TOLERANCE):
+    """
+    Print how every run changed between two benchmark files
+
+    :return: Number of regressions (slower or bigger by more than tolerance, or a much bigger energy error)
+    """
+
+    with open(base_path, "r") as f:
+        base = json.load(f)
+    with open(new_path, "r") as f:
+        new = json.load(f)
+
+    print(f"base: {base['environment']['commit']} ({base['environment']['date']})")
+    print(f"new:  {new['environment']['commit']} ({new['environment']['date']})")
+    if base["environment"]["platform"] != new["environment"]["platform"]:
+        print("Warning: different platforms, the timings may not be comparable")
+
+    base_results = {result_key(result): result for result in base["results"] if "skipped" not in result}
+    n_regressions = 0
+    for result in new["results"]:
+        old = base_results.get(result_key(result))
+        if old is None or "skipped" in result:
+            continue
+
+        problems = []
+        time_ratio = result["wall_time_s"] / old["wall_time_s"] if old["wall_time_s"] > 0 else 1.0
+        if time_ratio > 1.0 + tolerance and result["wall_time_s"] > MIN_COMPARED_SECONDS:
+            problems.append("slower")
+        if old["peak_memory_mb"] and result["peak_memory_mb"] and result["peak_memory_mb"] > MIN_COMPARED_MB:
+            memory_ratio = result["peak_memory_mb"] / old["peak_memory_mb"]
+            if memory_ratio > 1.0 + tolerance:
+                problems.append("more memory")
+        if result["energy_error"] > ENERGY_ERROR_TOLERANCE * max(old["energy_error"], 1e-16):
+            problems.append("less accurate")
+
+        print(
+            f"{'REGRESSION' if len(problems) > 0 else 'ok':>10}  {'/'.join(result_key(result))}: "
+            f"time x{time_ratio:.2f}, RHS {old['rhs_evaluations']} -> {result['rhs_evaluations']}, "
+            f"energy error {old['energy_error']:.2e} -> {result['energy_error']:.2e}"
+            + (f" ({', '.join(problems)})" if len(problems) > 0 else "")
+        )
+        n_regressions += len(problems) > 0
+
+    return n_regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the force kernels and integrators.")
+    parser.add_argument("--scenes", nargs="*", default=[DEFAULT_SCENES], help="Scene files (globs work), none to skip")
+    parser.add_argument("--sizes", nargs="*", type=int, default=DEFAULT_SIZES, help="Synthetic cluster sizes")
+    parser.add_argument("--backends", nargs="+", choices=FORCE_BACKENDS, default=FORCE_BACKENDS)
+    parser.add_argument("--integrators", nargs="+", choices=INTEGRATORS, default=INTEGRATORS)
+    parser.add_argument("--dimensions", type=int, choices=[2, 3], default=3, help="Number of dimensions")
+    parser.add_argument("--repeat", type=int, default=1, help="Time each run this many times, the fastest counts")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the (slow) peak memory run")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic clusters")
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the results")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BASE", "NEW"), help="Compare two result files instead of running anything"
+    )
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slow down for --compare")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    if args.compare is not None:
+        n_regressions = compare(args.compare[0], args.compare[1], args.tolerance)
+        print(f"{n_regressions} regression(s)")
+        sys.exit(1 if n_regressions > 0 else 0)
+
+    report = run_all(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(report['results'])} result(s) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from PySide2.QtCore import QAbstractListModel, QModelIndex, Qt
 from PySide2.QtGui import QColor
 
+from differential import BodyStore, as_body_store
+
 
 class BodiesModel(QAbstractListModel):  # A new model for the list
     def __init__(self, parent=None):
@@ -8,7 +10,7 @@ class BodiesModel(QAbstractListModel):  # A new model for the list
 
         # Don't ever touch this directly ok thanks
         # (this is so we can inform the UI whenever we change this)
-        self._body_storage = []
+        self._body_storage = BodyStore()  # Behaves like a list of Ball, see differential.py
 
     def append(self, body):  # To add a body
         index_to_insert = len(self._body_storage)  # Gets body storage length
@@ -23,9 +25,17 @@ class BodiesModel(QAbstractListModel):  # A new model for the list
 
     def clear(self):  # Empties body storage, a clear all button.
         self.beginResetModel()  # Tells Qt to forget everything and re-sync the UI from here
-        self._body_storage = []
+        self._body_storage.clear()
         self.endResetModel()  # The clearing.
 
+    def set_bodies(self, bodies):  # Swaps in a whole scene at once, quicker than appending them one by one.
+        self.beginResetModel()
+        self._body_storage = as_body_store(bodies)
+        self.endResetModel()
+
+    def body_store(self):  # The differential.BodyStore itself, for packing and saving (see as_body_store).
+        return self._body_storage
+
     def rowCount(self, parent):  # This is how many elements we have in a list
         return len(self._body_storage)
 
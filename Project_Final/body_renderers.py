@@ -0,0 +1,104 @@
+# The ways of drawing the bodies and their trails on the graph. MainWindow makes one per run and hands it new data
+# each frame, the renderer only ever moves the data inside artists it made once.
+#
+# "lines" is two artists per body (a trail line and an "o" marker), fine for a handful of bodies.
+# "collection" is one scatter for all the bodies and one LineCollection for all the trails, for thousands of them.
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+
+RENDERERS = ["auto", "lines", "collection"]
+AUTO_COLLECTION_BODIES = 100  # "auto" switches to one collection above this many bodies.
+COLLECTION_TRAIL_POINTS = 200000  # Total trail points over all bodies per frame, for the collection renderer.
+
+
+class BodyLines:  # Stores the matplotlib lines on the graph. This keeps track of them for the animation.
+    def __init__(self, trail_lines, ball_lines):
+        self.trail_lines = trail_lines
+        self.ball_lines = ball_lines
+
+
+class LineRenderer:  # Two artists per body, trails decimated per body so each keeps its own detail.
+    def __init__(self, ball_motion, colors, number_dimensions):
+        self.ball_motion = ball_motion
+        self.number_dimensions = number_dimensions
+        self.line_data = []
+
+        for color in colors:
+            if number_dimensions == 2:
+                trail_lines, = ball_motion.plot([], [], color=color)
+                ball_lines, = ball_motion.plot([], [], "o", color=color)  # This one is for the end sphere!
+            else:
+                trail_lines, = ball_motion.plot3D([], [], [], color=color)
+                ball_lines, = ball_motion.plot3D([], [], [], "o", color=color)
+            self.line_data.append(BodyLines(trail_lines, ball_lines))  # Keep track of line data for animation.
+
+    def artists(self):
+        return [line for body_lines in self.line_data for line in (body_lines.trail_lines, body_lines.ball_lines)]
+
+    # trail_data(i_ball, begin, end, max_points) gives one body's trail as one array per axis.
+    def update(self, ball_n_position, trail_begin, last_sample, max_points, trail_data):
+        for i_ball, body_lines in enumerate(self.line_data):
+            first_column = i_ball * self.number_dimensions
+            ball_data = [
+                ball_n_position[last_sample:last_sample + 1, first_column + axis] for axis in range(self.number_dimensions)
+            ]
+
+            if self.number_dimensions == 2:
+                body_lines.trail_lines.set_data(*trail_data(i_ball, trail_begin, last_sample, max_points))
+                body_lines.ball_lines.set_data(*ball_data)
+            else:
+                body_lines.trail_lines.set_data_3d(*trail_data(i_ball, trail_begin, last_sample, max_points))
+                body_lines.ball_lines.set_data_3d(*ball_data)
+
+
+class CollectionRenderer:  # Two artists in total, whatever the number of bodies.
+    def __init__(self, ball_motion, colors, number_dimensions):
+        self.ball_motion = ball_motion
+        self.number_dimensions = number_dimensions
+        self.n_bodies = len(colors)
+        rgba = to_rgba_array(colors)
+
+        if number_dimensions == 2:
+            self.trail_collection = LineCollection([], colors=rgba)
+            ball_motion.add_collection(self.trail_collection)
+            self.ball_collection = ball_motion.scatter(np.zeros(self.n_bodies), np.zeros(self.n_bodies), c=rgba)
+        else:
+            self.trail_collection = Line3DCollection([], colors=rgba)
+            ball_motion.add_collection3d(self.trail_collection)
+            self.ball_collection = ball_motion.scatter(
+                np.zeros(self.n_bodies), np.zeros(self.n_bodies), np.zeros(self.n_bodies), c=rgba, depthshade=False
+            )
+
+    def artists(self):
+        return [self.trail_collection, self.ball_collection]
+
+    # Trails come from trail_data like LineRenderer's, so each body keeps its own detail (min/max decimation once the
+    # run is finished, see trail_decimation.py), just with fewer points each so the total stays bounded.
+    def update(self, ball_n_position, trail_begin, last_sample, max_points, trail_data):
+        number_dimensions = self.number_dimensions
+
+        trail_points = max(2, min(max_points, COLLECTION_TRAIL_POINTS // max(self.n_bodies, 1)))
+        self.trail_collection.set_segments([
+            np.column_stack(trail_data(i_ball, trail_begin, last_sample, trail_points))
+            for i_ball in range(self.n_bodies)
+        ])
+
+        current = np.asarray(ball_n_position[last_sample]).reshape(self.n_bodies, number_dimensions)
+        self.ball_collection.set_offsets(current[:, :2])
+        if number_dimensions == 3:
+            self.ball_collection.set_3d_properties(current[:, 2], "z")
+
+
+# Which renderer to use for a run, "auto" goes by the number of bodies.
+def make_renderer(renderer, ball_motion, colors, number_dimensions):
+    if renderer == "auto":
+        renderer = "collection" if len(colors) > AUTO_COLLECTION_BODIES else "lines"
+
+    if renderer == "lines":
+        return LineRenderer(ball_motion, colors, number_dimensions)
+    elif renderer == "collection":
+        return CollectionRenderer(ball_motion, colors, number_dimensions)
+
+    raise ValueError(f"Unknown renderer {renderer}, pick one of {RENDERERS}")
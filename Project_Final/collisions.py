@@ -0,0 +1,200 @@
+# Collisions and inelastic mergers. Bodies with a radius that end up overlapping at a sample are merged into one body
+# with their total mass, at their centre of mass and with their total momentum. The integrator is then stopped and
+# started again from there with the smaller set of bodies (see integrators.integrate).
+#
+# Only the output samples get checked, not the integrator's own steps in between, so bodies that fly through each other
+# between two samples are missed. More time samples catch quicker encounters.
+#
+# The solutions keep one column per body from the scene all the way through. A body that got swallowed just follows
+# the one that swallowed it (same position and velocity), so with the original masses the momentum, angular momentum and
+# centre of mass of the whole run still add up. diagnostics.py skips pairs sitting exactly on top of each other.
+import itertools
+
+import numpy as np
+
+# Large primes to mix the integer cell coordinates into one hash, as in Teschner et al. 2003. Two cells that happen to
+# get the same hash just give a few extra pairs to check, the exact distance test below throws those out.
+HASH_PRIMES = np.array([73856093, 19349663, 83492791], dtype=np.int64)
+
+
+def cell_hashes(cells):
+    number_dimensions = cells.shape[1]
+    return np.bitwise_xor.reduce(cells * HASH_PRIMES[:number_dimensions], axis=1)
+
+
+def find_collisions(positions, radii):
+    """
+    Every pair of bodies that touch, using a spatial hash so it stays about O(N)
+
+    :param positions: (n_bodies, n_dimensions)
+    :param radii: (n_bodies,), bodies with a radius of 0 never collide
+    :return: (pairs, 2) array of body indices, first index smaller than the second
+    """
+
+    n_bodies, number_dimensions = positions.shape
+    candidates = np.flatnonzero(radii > 0.0)
+    if len(candidates) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    # Cells as wide as the biggest body, so touching bodies are always in the same or neighbouring cells.
+    cell_size = 2.0 * radii[candidates].max()
+    cells = np.floor(positions[candidates] / cell_size).astype(np.int64)
+
+    # Bodies sorted by the hash of their cell, so each hash is one contiguous range.
+    hashes = cell_hashes(cells)
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    unique_hashes, hash_starts, hash_counts = np.unique(sorted_hashes, return_index=True, return_counts=True)
+
+    pair_chunks = []
+    for offset in itertools.product((-1, 0, 1), repeat=number_dimensions):  # The cell itself and every neighbour.
+        neighbour_hashes = cell_hashes(cells + np.array(offset, dtype=np.int64))
+        found = np.searchsorted(unique_hashes, neighbour_hashes)
+        found = np.minimum(found, len(unique_hashes) - 1)
+        hit = unique_hashes[found] == neighbour_hashes
+
+        # Every body against every body in that neighbouring cell (same trick as barnes_hut.expand_pairs).
+        bodies = np.flatnonzero(hit)
+        counts = hash_counts[found[hit]]
+        repeat_index = np.repeat(np.arange(len(bodies)), counts)
+        member_offsets = np.arange(len(repeat_index)) - np.repeat(np.cumsum(counts) - counts, counts)
+        members = order[hash_starts[found[hit]][repeat_index] + member_offsets]
+        first, second = bodies[repeat_index], members
+        keep = first < second
+        pair_chunks.append(np.column_stack((first[keep], second[keep])))
+
+    pairs = np.unique(np.concatenate(pair_chunks), axis=0)
+    if len(pairs) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    pairs = candidates[pairs]  # Back to body indices.
+    separations = positions[pairs[:, 1]] - positions[pairs[:, 0]]
+    distance_tot_sq = np.einsum("pd,pd->p", separations, separations)
+    touching = distance_tot_sq < (radii[pairs[:, 0]] + radii[pairs[:, 1]]) ** 2
+    return pairs[touching]
+
+
+# Groups of bodies that all have to become one, EG three bodies crashing together at once. Small union-find.
+def merge_groups(pairs, n_bodies):
+    parent = np.arange(n_bodies)
+
+    def root(body):
+        while parent[body] != body:
+            parent[body] = parent[parent[body]]
+            body = parent[body]
+        return body
+
+    for first, second in pairs:
+        parent[root(first)] = root(second)
+
+    groups = {}
+    for body in np.unique(pairs):
+        groups.setdefault(root(body), []).append(body)
+    return list(groups.values())
+
+
+# Keeps track of which bodies are still being integrated, and which body each of the scene's bodies has become.
+class MergeTracker:
+    def __init__(self, masses, radii, number_dimensions, make_kernel):
+        """
+        :param masses: Masses of the scene's bodies
+        :param radii: Their radii, bodies with a radius of 0 never collide
+        :param make_kernel: Called as make_kernel(masses) to get the force kernel for the bodies left after a merger
+        """
+
+        self.masses = np.asarray(masses, dtype=np.float64)
+        self.number_dimensions = number_dimensions
+        self.make_kernel = make_kernel
+
+        self.active = np.arange(len(self.masses))  # Scene indices of the bodies still being integrated
+        self.active_masses = self.masses.copy()
+        self.active_radii = np.asarray(radii, dtype=np.float64).copy()
+        self.column_of = np.arange(len(self.masses))  # Scene index -> which of the active bodies it is now
+        self.merges = []  # (absorbed, into) scene indices, in the order they happened
+
+    def has_mergers(self):  # False if nothing can ever collide, then there is no need to check.
+        return np.count_nonzero(self.active_radii > 0.0) >= 2
+
+    def first_collision(self, active_rows):
+        """
+        The first sample (row) where two of the active bodies touch
+
+        :param active_rows: Sample rows of the active bodies, positions then velocities
+        :return: (row index, colliding pairs), or None if nothing touched
+        """
+
+        n_active = len(self.active)
+        for row_index, row in enumerate(active_rows):
+            positions = np.asarray(row[:n_active * self.number_dimensions], dtype=np.float64).reshape(n_active, -1)
+            pairs = find_collisions(positions, self.active_radii)
+            if len(pairs) > 0:
+                return row_index, pairs
+        return None
+
+    def merge(self, active_row, pairs):
+        """
+        Merge the colliding bodies, conserving mass and momentum
+
+        :param active_row: State of the active bodies at the collision, positions then velocities
+        :return: The state of the bodies that are left, in the same layout
+        """
+
+        n_active = len(self.active)
+        split_index = n_active * self.number_dimensions
+        positions = np.asarray(active_row[:split_index], dtype=np.float64).reshape(n_active, -1).copy()
+        velocities = np.asarray(active_row[split_index:], dtype=np.float64).reshape(n_active, -1).copy()
+
+        keep = np.ones(n_active, dtype=bool)
+        for group in merge_groups(pairs, n_active):
+            group_masses = self.active_masses[group]
+            total_mass = np.sum(group_masses)
+            survivor = group[int(np.argmax(group_masses))]  # The heaviest keeps its name and colour.
+
+            if total_mass > 0.0:
+                positions[survivor] = group_masses @ positions[group] / total_mass  # Centre of mass
+                velocities[survivor] = group_masses @ velocities[group] / total_mass  # Total momentum / total mass
+            self.active_masses[survivor] = total_mass
+            self.active_radii[survivor] = np.cbrt(np.sum(self.active_radii[group] ** 3))  # Same volume
+
+            for absorbed in group:
+                if absorbed != survivor:
+                    keep[absorbed] = False
+                    self.column_of[self.column_of == absorbed] = survivor
+                    self.merges.append((int(self.active[absorbed]), int(self.active[survivor])))
+
+        # Renumber what is left.
+        new_index = np.cumsum(keep) - 1
+        self.column_of = new_index[self.column_of]
+        self.active = self.active[keep]
+        self.active_masses = self.active_masses[keep]
+        self.active_radii = self.active_radii[keep]
+
+        return np.concatenate((positions[keep].ravel(), velocities[keep].ravel()))
+
+    def merge_all(self, active_row, pairs):
+        """
+        Merge the colliding bodies, and then again as long as anything still touches at the same sample. A merged body
+        sits somewhere new with a bigger radius, so it can overlap a body that was not in the first collision.
+
+        :param active_row: State of the active bodies at the collision, positions then velocities
+        :return: The state of the bodies that are left, in the same layout
+        """
+
+        while len(pairs) > 0:
+            active_row = self.merge(active_row, pairs)
+            collision = self.first_collision(active_row[np.newaxis, :])
+            pairs = [] if collision is None else collision[1]
+        return active_row
+
+    def expand(self, active_rows):  # Sample rows of the active bodies -> rows with every body of the scene.
+        if len(self.merges) == 0:
+            return active_rows  # Nothing merged yet, they are the same.
+
+        n_active = len(self.active)
+        rows = np.asarray(active_rows)
+        positions = rows[:, :n_active * self.number_dimensions].reshape(len(rows), n_active, self.number_dimensions)
+        velocities = rows[:, n_active * self.number_dimensions:].reshape(len(rows), n_active, self.number_dimensions)
+        return np.concatenate((
+            positions[:, self.column_of, :].reshape(len(rows), -1),
+            velocities[:, self.column_of, :].reshape(len(rows), -1)
+        ), axis=1)
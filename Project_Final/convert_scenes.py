@@ -0,0 +1,39 @@
+#############################################################
+#           N_BODY PROBLEM SCENE CONVERTER                  #
+# Turns scene JSON files into binary .nbscene files (see    #
+# scene_io.py), which load far quicker for big scenes, and  #
+# .nbscene files back into JSON.                            #
+#                                                           #
+# python convert_scenes.py saves/*.json --output-dir big    #
+#############################################################
+
+
+import argparse
+import os
+import sys
+import time
+
+import scene_io
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Convert scene files between JSON and the binary .nbscene format.")
+    parser.add_argument("scenes", nargs="+", help="Scene files, globs like saves/*.json work too")
+    parser.add_argument("--output-dir", help="Where to write the converted scenes, next to the originals if not given")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    for scene_path in scene_io.expand_scene_paths(args.scenes):
+        start = time.perf_counter()
+        destination_path = scene_io.converted_path(scene_path, args.output_dir)
+        scene_io.convert_scene(scene_path, destination_path)
+        print(f"{scene_path} -> {destination_path} ({time.perf_counter() - start:.3f} s)", flush=True)
+
+
+if __name__ == "__main__":
+    main()
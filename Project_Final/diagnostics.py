@@ -0,0 +1,178 @@
+# Conservation checks along a finished run: total energy, linear momentum, angular momentum and centre of mass drift.
+# None of these should change in a real N-body system, so how far they wander is a good measure of how accurate the
+# integrator and its settings were. No Qt or matplotlib in here, the window and the command line both use it.
+#
+# Everything is worked out for many samples at once, a chunk of rows at a time, so memory-mapped runs with millions
+# of samples never have to be loaded all at once.
+import numpy as np
+
+from simulation import G
+
+CHUNK_ROWS = 4096  # Samples done at once.
+PAIR_CHUNK_ELEMENTS = 4000000  # Max (samples x pairs x dimensions) floats in memory for the potential energy.
+
+DIAGNOSTICS = ["energy", "linear_momentum", "angular_momentum", "com_drift"]
+DIAGNOSTIC_NAMES = {  # For labels and printing.
+    "energy": "Energy",
+    "linear_momentum": "Linear momentum",
+    "angular_momentum": "Angular momentum",
+    "com_drift": "Centre of mass drift",
+}
+
+
+class ConservedQuantities:  # The raw quantities for a chunk of samples, one row per sample.
+    def __init__(self, energy, linear_momentum, angular_momentum, centre_of_mass):
+        self.energy = energy  # (samples,)
+        self.linear_momentum = linear_momentum  # (samples, dimensions)
+        self.angular_momentum = angular_momentum  # (samples, 3) in 3D, (samples, 1) in 2D (only the z part exists)
+        self.centre_of_mass = centre_of_mass  # (samples, dimensions)
+
+
+def potential_energy(positions, masses, G=G, softening=0.0):
+    """
+    Gravitational potential energy for many samples at once
+
+    Pairs sitting exactly on top of each other are bodies that merged (see collisions.py), and are left out. So are
+    massless test particles, they have no potential energy.
+    :param positions: (samples, bodies, dimensions)
+    :param softening: Plummer softening length the run used
+    :return: (samples,)
+    """
+
+    n_samples, n_bodies, number_dimensions = positions.shape
+    massive = np.flatnonzero(np.asarray(masses) != 0.0)
+    massive_i, massive_j = np.triu_indices(len(massive), k=1)
+    pair_i, pair_j = massive[massive_i], massive[massive_j]
+    pair_mass = masses[pair_i] * masses[pair_j]
+
+    energy = np.zeros(n_samples)
+    pair_chunk = max(1, PAIR_CHUNK_ELEMENTS // max(n_samples * number_dimensions, 1))
+    for first_pair in range(0, len(pair_i), pair_chunk):  # Big scenes have too many pairs to do all at once.
+        chunk_i = pair_i[first_pair:first_pair + pair_chunk]
+        chunk_j = pair_j[first_pair:first_pair + pair_chunk]
+        separations = positions[:, chunk_j, :] - positions[:, chunk_i, :]
+        distance_tot_sq = np.einsum("spd,spd->sp", separations, separations)
+        with np.errstate(divide="ignore"):
+            pair_energy = G * pair_mass[first_pair:first_pair + pair_chunk] / np.sqrt(distance_tot_sq + softening ** 2)
+        energy -= np.sum(np.where(distance_tot_sq > 0.0, pair_energy, 0.0), axis=1)
+    return energy
+
+
+def conserved_quantities(solution_rows, masses, number_dimensions, G=G, softening=0.0):
+    n_samples = len(solution_rows)
+    n_bodies = len(masses)
+    split_index = n_bodies * number_dimensions
+
+    solution_rows = np.asarray(solution_rows, dtype=np.float64)
+    positions = solution_rows[:, :split_index].reshape(n_samples, n_bodies, number_dimensions)
+    velocities = solution_rows[:, split_index:].reshape(n_samples, n_bodies, number_dimensions)
+
+    kinetic = 0.5 * np.einsum("b,sbd,sbd->s", masses, velocities, velocities)
+    linear_momentum = np.einsum("b,sbd->sd", masses, velocities)
+    centre_of_mass = np.einsum("b,sbd->sd", masses, positions) / np.sum(masses)
+
+    # About the origin. r x v in 3D, just the z part (x vy - y vx) in 2D.
+    if number_dimensions == 3:
+        angular_momentum = np.einsum("b,sbd->sd", masses, np.cross(positions, velocities))
+    else:
+        z_part = positions[:, :, 0] * velocities[:, :, 1] - positions[:, :, 1] * velocities[:, :, 0]
+        angular_momentum = (z_part @ masses)[:, np.newaxis]
+
+    return ConservedQuantities(
+        kinetic + potential_energy(positions, masses, G, softening),
+        linear_momentum,
+        angular_momentum,
+        centre_of_mass
+    )
+
+
+class Diagnostics:  # Relative error curves along a run, one value per sample.
+    def __init__(self, times, errors, initial):
+        self.times = times
+        self.errors = errors  # Name in DIAGNOSTICS -> (samples,) relative errors
+        self.initial = initial  # The ConservedQuantities of the first sample
+
+    def max_errors(self):
+        return {name: float(np.max(curve)) if len(curve) > 0 else 0.0 for name, curve in self.errors.items()}
+
+    def final_errors(self):
+        return {name: float(curve[-1]) if len(curve) > 0 else 0.0 for name, curve in self.errors.items()}
+
+
+def compute_diagnostics(times, solutions, masses, number_dimensions, G=G, stride=1, chunk_rows=CHUNK_ROWS,
+                        softening=0.0):
+    """
+    Relative errors in the conserved quantities over a whole run
+
+    Momenta and centre of mass drift are usually measured from zero, so they are scaled by the size of the system at
+    the start instead (sum of m|v|, sum of m|r||v|, and the radius of the system). Energy is relative to itself.
+    :param times: Sample times
+    :param solutions: One row per sample, positions then velocities. Can be memory-mapped.
+    :param stride: Only look at every nth sample, for a quick look at very long runs
+    :param softening: Plummer softening length the run used, so the energy is the one that was actually conserved.
+        Mergers lose energy for real, that shows up as a jump.
+    :return: Diagnostics
+    """
+
+    masses = np.asarray(masses, dtype=np.float64)
+    n_bodies = len(masses)
+    split_index = n_bodies * number_dimensions
+    sample_indices = np.arange(0, len(solutions), stride)
+
+    # Everything is measured against the first sample.
+    first_row = np.asarray(solutions[0:1], dtype=np.float64)
+    initial = conserved_quantities(first_row, masses, number_dimensions, G, softening)
+    initial_positions = first_row[0, :split_index].reshape(n_bodies, number_dimensions)
+    initial_velocities = first_row[0, split_index:].reshape(n_bodies, number_dimensions)
+
+    speeds = np.linalg.norm(initial_velocities, axis=1)
+    momentum_scale = np.sum(masses * speeds)
+    angular_scale = np.sum(masses * np.linalg.norm(initial_positions, axis=1) * speeds)
+    radius_scale = np.max(np.linalg.norm(initial_positions - initial.centre_of_mass[0], axis=1))
+    com_velocity = initial.linear_momentum[0] / np.sum(masses)  # The centre of mass should move in a straight line.
+
+    # Something that is zero to start with (EG nothing moving) just gets its absolute error.
+    def safe_scale(scale):
+        return scale if scale > 0.0 else 1.0
+
+    errors = {name: np.zeros(len(sample_indices)) for name in DIAGNOSTICS}
+    for first in range(0, len(sample_indices), chunk_rows):
+        chunk_indices = sample_indices[first:first + chunk_rows]
+        if stride == 1:
+            rows = solutions[chunk_indices[0]:chunk_indices[-1] + 1]  # Slices read memory maps in one go.
+        else:
+            rows = solutions[chunk_indices]
+        quantities = conserved_quantities(rows, masses, number_dimensions, G, softening)
+        chunk_times = np.asarray(times)[chunk_indices] - times[0]
+        output = slice(first, first + len(chunk_indices))
+
+        errors["energy"][output] = np.abs(quantities.energy - initial.energy[0]) / safe_scale(abs(initial.energy[0]))
+        errors["linear_momentum"][output] = np.linalg.norm(
+            quantities.linear_momentum - initial.linear_momentum[0], axis=1
+        ) / safe_scale(momentum_scale)
+        errors["angular_momentum"][output] = np.linalg.norm(
+            quantities.angular_momentum - initial.angular_momentum[0], axis=1
+        ) / safe_scale(angular_scale)
+        expected_centre = initial.centre_of_mass[0] + chunk_times[:, np.newaxis] * com_velocity
+        errors["com_drift"][output] = np.linalg.norm(
+            quantities.centre_of_mass - expected_centre, axis=1
+        ) / safe_scale(radius_scale)
+
+    return Diagnostics(np.asarray(times)[sample_indices], errors, initial)
+
+
+# A few lines of text for the command line: the biggest error of each, and the curves at a handful of times.
+def format_report(diagnostics, n_points=5):
+    lines = []
+    max_errors = diagnostics.max_errors()
+    for name in DIAGNOSTICS:
+        lines.append(f"  {DIAGNOSTIC_NAMES[name]}: max relative error {max_errors[name]:.3e}")
+
+    if len(diagnostics.times) > 1:
+        lines.append("  " + "time".rjust(12) + "".join(name.rjust(18) for name in DIAGNOSTICS))
+        for index in np.linspace(0, len(diagnostics.times) - 1, n_points).astype(int):
+            lines.append(
+                "  " + f"{diagnostics.times[index]:12.4e}" +
+                "".join(f"{diagnostics.errors[name][index]:18.3e}" for name in DIAGNOSTICS)
+            )
+    return "\n".join(lines)
@@ -0,0 +1,46 @@
+from PySide2.QtWidgets import QDialog, QVBoxLayout, QLabel
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+
+import diagnostics
+
+MAX_DIAGNOSTIC_SAMPLES = 20000  # Longer runs only look at every nth sample, the curves are just as readable.
+
+
+# Shows how well energy, momentum, angular momentum and the centre of mass were conserved over the last run.
+class DiagnosticsDialog(QDialog):
+    def __init__(self, total_time, solutions, bodies, number_dimensions, softening=0.0, parent=None):  # Another window...
+        super().__init__(parent)
+        self.setWindowTitle("Conservation diagnostics")
+        self.resize(800, 600)
+
+        v_layout = QVBoxLayout()  # The vertical layout
+        self.setLayout(v_layout)
+
+        stride = max(1, -(-len(solutions) // MAX_DIAGNOSTIC_SAMPLES))
+        result = diagnostics.compute_diagnostics(
+            total_time, solutions, [body.mass for body in bodies], number_dimensions, stride=stride, softening=softening
+        )
+
+        # Biggest error of each, up top.
+        max_errors = result.max_errors()
+        summary_label = QLabel(self)
+        summary_label.setText("\n".join(
+            f"{diagnostics.DIAGNOSTIC_NAMES[name]}: max relative error {max_errors[name]:.3e}"
+            for name in diagnostics.DIAGNOSTICS
+        ))
+        v_layout.addWidget(summary_label)
+
+        # Log scale, errors go from 1e-15 to 1 and everything in between.
+        fig = Figure()
+        canvas = FigureCanvas(fig)
+        error_plot = fig.add_subplot(111)
+        for name in diagnostics.DIAGNOSTICS:
+            # Errors of exactly 0 (the first sample, or things conserved to the last bit) cannot go on a log scale.
+            error_plot.semilogy(result.times, result.errors[name], label=diagnostics.DIAGNOSTIC_NAMES[name], nonpositive="mask")
+        error_plot.set_xlabel("time")
+        error_plot.set_ylabel("relative error")
+        error_plot.legend()
+        fig.tight_layout()
+        v_layout.addWidget(canvas)
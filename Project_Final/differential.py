@@ -1,90 +1,321 @@
 # Newtons law of Gravity
 import numpy as np
 
+import barnes_hut
 
-# Creates a ball class for better organisation.
-class Ball:
-    def __init__(self, name, mass=0.0, pos_x=0.0, vel_x=0.0, pos_y=0.0, vel_y=0.0, pos_z=0.0, vel_z=0.0, color="#FF00FF"):
-        self.name = name
-        self.mass = mass  # In kilograms for object n
-        self.color = color
-
-        # POSITIONS AND VELOCITIES (in meters)
-        self.pos_x = pos_x
-        self.vel_x = vel_x
-        self.pos_y = pos_y
-        self.vel_y = vel_y
-        self.pos_z = pos_z
-        self.vel_z = vel_z
-
-        # AXIS FOR POS AND VEL
-        self.pos_vector = None
-        self.vel_vector = None
-
-    # Sets the pos vector and the vel vector for a specific dimension.
-    def clear_results(self, n_dimension):
-        if n_dimension == 2:
-            self.pos_vector = np.array([self.pos_x, self.pos_y], dtype=np.longdouble)  # Initial x, y position of ball, as well as general position
-            self.vel_vector = np.array([self.vel_x, self.vel_y], dtype=np.longdouble)  # see above but for velocity.
-        elif n_dimension == 3:
-            self.pos_vector = np.array([self.pos_x, self.pos_y, self.pos_z], dtype=np.longdouble)
-            self.vel_vector = np.array([self.vel_x, self.vel_y, self.vel_z], dtype=np.longdouble)
-        else:
+
+DEFAULT_COLOR = "#FF00FF"
+SERIALIZED_ATTRIBUTES = ["name", "mass", "color", "pos_x", "pos_y", "pos_z", "vel_x", "vel_y", "vel_z", "radius"]
+
+
+# Every body of a scene in a few contiguous arrays, one row per body. Packing the initial conditions, copying a scene
+# and saving it are then whole-array operations rather than a loop over objects, which is what counts for scenes with
+# tens of thousands of bodies. Positions and velocities always have x, y and z columns, 2D runs just leave z out.
+#
+# It also behaves like a list of Ball (len, indexing, iterating, append, del), so code that only wants to look at the
+# bodies one at a time does not need to know about the arrays.
+class BodyStore:
+    def __init__(self, n_bodies=0):
+        self.n_bodies = n_bodies
+        # Allocated with spare rows on the end (see grow), the properties below only give the rows in use.
+        self._masses = np.zeros(n_bodies)  # In kilograms
+        self._radii = np.zeros(n_bodies)  # In meters, only for collisions (see collisions.py). 0 never collides.
+        self._positions = np.zeros((n_bodies, 3))  # In meters
+        self._velocities = np.zeros((n_bodies, 3))
+        self.names = [""] * n_bodies
+        self.colors = [DEFAULT_COLOR] * n_bodies
+        self.views = [None] * n_bodies  # The Ball for each row, only made once something asks for it.
+        self.standalone = False  # True for the one-row store of a Ball made on its own, see as_body_store.
+
+    # The rows in use. Writable, but a new array after the store has grown, so do not hang on to them over an append.
+    @property
+    def masses(self):
+        return self._masses[:self.n_bodies]
+
+    @property
+    def radii(self):
+        return self._radii[:self.n_bodies]
+
+    @property
+    def positions(self):
+        return self._positions[:self.n_bodies]
+
+    @property
+    def velocities(self):
+        return self._velocities[:self.n_bodies]
+
+    @staticmethod
+    def from_arrays(names, masses, positions, velocities, colors=None, radii=None):
+        """
+        A store filled in straight from arrays
+
+        :param positions: (n_bodies, 2) or (n_bodies, 3), z is 0 if left out. Same for velocities.
+        :param colors: One per body, or None for the default
+        :param radii: One per body, or None for no collisions
+        """
+
+        positions = np.asarray(positions, dtype=np.float64)
+        velocities = np.asarray(velocities, dtype=np.float64)
+        store = BodyStore(len(names))
+        store.names = list(names)
+        store.masses[:] = masses
+        store.positions[:, :positions.shape[1]] = positions
+        store.velocities[:, :velocities.shape[1]] = velocities
+        if colors is not None:
+            store.colors = list(colors)
+        if radii is not None:
+            store.radii[:] = radii
+        return store
+
+    @staticmethod
+    def from_columns(names, colors, masses, positions, velocities, radii):
+        """
+        A store that uses these arrays as they are, without copying them. EG memory-mapped ones (see scene_io.py),
+        which then only get read as the rows are used. Appending swaps them for ordinary arrays.
+
+        :param positions: (n_bodies, 3) float64, same for velocities
+        """
+
+        store = BodyStore()
+        store.n_bodies = len(masses)
+        store._masses, store._positions, store._velocities, store._radii = masses, positions, velocities, radii
+        store.names = list(names)
+        store.colors = list(colors)
+        store.views = [None] * store.n_bodies
+        return store
+
+    def load_into_memory(self):  # Swaps memory-mapped columns (see from_columns) for ordinary copies, freeing the file.
+        for array_name in ["_masses", "_radii", "_positions", "_velocities"]:
+            array = getattr(self, array_name)
+            if isinstance(array, np.memmap):
+                setattr(self, array_name, np.array(array))
+
+    def column(self, attribute):  # One of Ball's number attributes ("mass", "vel_y"...) for every body, writable.
+        if attribute == "mass":
+            return self.masses
+        elif attribute == "radius":
+            return self.radii
+
+        kind, axis = attribute.split("_")
+        return (self.positions if kind == "pos" else self.velocities)[:, "xyz".index(axis)]
+
+    def take(self, rows):  # A new store with copies of these rows.
+        rows = np.asarray(rows, dtype=np.int64)
+        return BodyStore.from_arrays(
+            [self.names[row] for row in rows], self.masses[rows], self.positions[rows], self.velocities[rows],
+            [self.colors[row] for row in rows], self.radii[rows]
+        )
+
+    def copy(self):  # Snapshot of the whole scene, EG so it can be simulated while the original gets edited.
+        return self.take(np.arange(self.n_bodies))
+
+    # Positions of all bodies first, then all the velocities, flattened to 1D. What the integrators start from.
+    # dtype comes from precision.PACKING_DTYPES.
+    def pack(self, number_dimensions, dtype=np.float64):
+        if number_dimensions != 2 and number_dimensions != 3:
             raise ValueError("Bad number of dimensions")
 
+        return np.concatenate((
+            self.positions[:, :number_dimensions], self.velocities[:, :number_dimensions]
+        )).astype(dtype).ravel()
+
+    def serialize(self):  # To save the balls, one dict per body. Same as Ball.serialize for each of them.
+        columns = [self.names, self.masses.tolist(), self.colors]
+        columns += [self.column(attribute).tolist() for attribute in SERIALIZED_ATTRIBUTES[3:]]
+        return [dict(zip(SERIALIZED_ATTRIBUTES, values)) for values in zip(*columns)]
+
+    @staticmethod
+    def deserialize(body_infos):  # To load the balls, from a list of what serialize gave.
+        store = BodyStore(len(body_infos))
+        store.names = [info["name"] for info in body_infos]
+        store.colors = [info["color"] for info in body_infos]
+        store.masses[:] = [info["mass"] for info in body_infos]
+        store.positions[:] = [[info["pos_x"], info["pos_y"], info["pos_z"]] for info in body_infos]
+        store.velocities[:] = [[info["vel_x"], info["vel_y"], info["vel_z"]] for info in body_infos]
+        store.radii[:] = [info.get("radius", 0.0) for info in body_infos]  # Older saves do not have one.
+        return store
+
+    def grow(self, n_extra):  # Makes room for n_extra more rows. Doubles, so appending one at a time stays cheap.
+        needed = self.n_bodies + n_extra
+        if needed <= len(self._masses):
+            return
+
+        capacity = max(needed, 2 * len(self._masses), 16)
+        for array_name in ["_masses", "_radii", "_positions", "_velocities"]:
+            old = getattr(self, array_name)
+            new = np.zeros((capacity,) + old.shape[1:])
+            new[:self.n_bodies] = old[:self.n_bodies]
+            setattr(self, array_name, new)
+
+    def append(self, body):
+        """
+        Add a body on the end
+
+        :param body: A Ball, which moves into this store: its values are copied into the new row and from then on it
+            reads and writes that row, so editing it edits this store, as with a list. A Ball is only ever a view of
+            one row though, so if it was in another store that one keeps its own copy of the values, and hands out a
+            new Ball for that row from then on.
+        """
+
+        source, source_row = body.store, body.row
+        self.append_copy(body)
+        if source.views[source_row] is body:
+            source.views[source_row] = None
+        body.store, body.row = self, self.n_bodies - 1
+        self.views[-1] = body
+
+    def append_copy(self, body):  # Add a row with the same values as the Ball, leaving the Ball where it is.
+        source, source_row = body.store, body.row
+        self.grow(1)
+        row = self.n_bodies
+        self.n_bodies += 1
+        self._masses[row] = source._masses[source_row]
+        self._radii[row] = source._radii[source_row]
+        self._positions[row] = source._positions[source_row]
+        self._velocities[row] = source._velocities[source_row]
+        self.names.append(source.names[source_row])
+        self.colors.append(source.colors[source_row])
+        self.views.append(None)
+
+    def __delitem__(self, index):
+        row = range(self.n_bodies)[index]  # Negative indices and range checks, as for a list.
+        view = self.views[row]
+        if view is not None:  # Whoever still has it keeps a body with the same values, just not in here any more.
+            view.store, view.row = self.take([row]), 0
+            view.store.views[0] = view
+            view.store.standalone = True
+
+        last = self.n_bodies - 1
+        for array in [self._masses, self._radii, self._positions, self._velocities]:
+            array[row:last] = array[row + 1:last + 1]
+        del self.names[row]
+        del self.colors[row]
+        del self.views[row]
+        self.n_bodies = last
+
+        for moved_row in range(row, self.n_bodies):  # Everything after it moved up one.
+            if self.views[moved_row] is not None:
+                self.views[moved_row].row = moved_row
+
+    def clear(self):
+        # The rows go to a store of their own, so any Ball still held from this one keeps its values.
+        if any(view is not None for view in self.views):
+            old = self.copy()
+            old.views = self.views
+            for view in old.views:
+                if view is not None:
+                    view.store = old
+
+        self.__init__()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[row] for row in range(self.n_bodies)[index]]
+
+        row = range(self.n_bodies)[index]
+        if self.views[row] is None:
+            self.views[row] = Ball.view(self, row)
+        return self.views[row]
+
+    def __iter__(self):
+        for row in range(self.n_bodies):
+            yield self[row]
+
+    def __len__(self):
+        return self.n_bodies
+
+
+# A BodyStore from a list of Ball, a BodiesModel or a BodyStore (given straight back). From a list, Balls made on their
+# own move into the new store, ones that are rows of a scene are copied so they stay views of that scene.
+def as_body_store(bodies):
+    if isinstance(bodies, BodyStore):
+        return bodies
+    elif hasattr(bodies, "body_store"):
+        return bodies.body_store()
+
+    store = BodyStore()
+    store.grow(len(bodies))
+    for body in bodies:
+        if body.store.standalone:
+            store.append(body)
+        else:
+            store.append_copy(body)
+    return store
+
+
+# A property of Ball that reads and writes its row of the store.
+def row_attribute(attribute):
+    def get(ball):
+        return float(ball.store.column(attribute)[ball.row])
+
+    def set_value(ball, value):
+        ball.store.column(attribute)[ball.row] = value
+
+    return property(get, set_value)
+
+
+# Creates a ball class for better organisation. Just a view of one row of a BodyStore, a Ball made on its own gets a
+# one-row store to itself until it is appended to a scene.
+class Ball:
+    __slots__ = ("store", "row")
+
+    def __init__(self, name, mass=0.0, pos_x=0.0, vel_x=0.0, pos_y=0.0, vel_y=0.0, pos_z=0.0, vel_z=0.0,
+                 color=DEFAULT_COLOR, radius=0.0):
+        self.store = BodyStore.from_arrays([name], [mass], [[pos_x, pos_y, pos_z]], [[vel_x, vel_y, vel_z]], [color],
+                                           [radius])
+        self.store.standalone = True
+        self.store.views[0] = self
+        self.row = 0
+
+    @staticmethod
+    def view(store, row):  # Ball for a row that is already in a store.
+        ball = Ball.__new__(Ball)
+        ball.store = store
+        ball.row = row
+        return ball
+
+    @property
+    def name(self):
+        return self.store.names[self.row]
+
+    @name.setter
+    def name(self, value):
+        self.store.names[self.row] = value
+
+    @property
+    def color(self):
+        return self.store.colors[self.row]
+
+    @color.setter
+    def color(self, value):
+        self.store.colors[self.row] = value
+
+    mass = row_attribute("mass")  # In kilograms for object n
+    radius = row_attribute("radius")  # In meters, only for collisions (see collisions.py). 0 never collides.
+
+    # POSITIONS AND VELOCITIES (in meters)
+    pos_x = row_attribute("pos_x")
+    vel_x = row_attribute("vel_x")
+    pos_y = row_attribute("pos_y")
+    vel_y = row_attribute("vel_y")
+    pos_z = row_attribute("pos_z")
+    vel_z = row_attribute("vel_z")
+
     def serialize(self):  # To save the balls. PLEASE make sure the simulation works first before saving pls.
-        return {
-            "name": self.name,
-            "mass": self.mass,
-            "color": self.color,
-            "pos_x": self.pos_x,
-            "pos_y": self.pos_y,
-            "pos_z": self.pos_z,
-            "vel_x": self.vel_x,
-            "vel_y": self.vel_y,
-            "vel_z": self.vel_z,
-        }
+        return {attribute: getattr(self, attribute) for attribute in SERIALIZED_ATTRIBUTES}
 
     def deserialize(self, info):  # To load the balls.
-        self.name = info["name"]
-        self.mass = info["mass"]
-        self.color = info["color"]
-        self.pos_x = info["pos_x"]
-        self.pos_y = info["pos_y"]
-        self.pos_z = info["pos_z"]
-        self.vel_x = info["vel_x"]
-        self.vel_y = info["vel_y"]
-        self.vel_z = info["vel_z"]
-
-
-########################################################################################################################################
-# THIS CODE WAS USED TO CALCULATE THE ENERGY, BUT IT IS NOW OBSOLETE. Kept for historical reasons.
-########################################################################################################################################
-# def r_distance(pos_array_1, pos_array_2):
-#     """
-#     Calculates r distance, not x and y distance for the energy
-#     """
-#
-#     dist_array = np.sqrt((pos_array_1[:, 0] - pos_array_2[:, 0]) ** 2 + (pos_array_1[:, 1] - pos_array_2[:, 1]) ** 2)
-#
-#     return dist_array
-#
-#
-# # Calculating Energy.
-# def calc_energy_2body(ball_n_1, ball_n_2, distance, vel_array_1, vel_array_2, G = 6.67408e-11):
-#
-#     # Extend this for 3D case as well, and multiple ball_n's.
-#     vel_array_1 = np.sqrt(vel_array_1[:, 0] ** 2 + vel_array_1[:, 1] **2 )
-#     vel_array_2 = np.sqrt(vel_array_2[:, 0] ** 2 + vel_array_2[:, 1] ** 2)
-#
-#     # Adding gravitational potential and kinetic energies.
-#     energy = +(G*ball_n_1.mass*ball_n_2.mass / distance) - (0.5)*ball_n_1.mass*(vel_array_1**2) - (0.5)*ball_n_2.mass*(vel_array_2**2)
-#
-#     return energy
-########################################################################################################################################
+        for attribute in SERIALIZED_ATTRIBUTES:
+            if attribute == "radius":
+                self.radius = info.get("radius", 0.0)  # Older saves do not have one.
+            else:
+                setattr(self, attribute, info[attribute])
+
 
+# Energy (and momentum, angular momentum, centre of mass drift) along a whole run are worked out in diagnostics.py.
 
-# Similar to above once again, but for n systems!
+
+# Distance between two bodies, for n systems!
 def distance_n(s1, s2, n_dimensions):
     """
     Calculate the total distance for a 2D object
@@ -120,12 +351,8 @@ def newton_newODE_solver_2(
         size_of_parameters,
         n_bodies,
         number_dimensions,
-        ball_n,
-        prog_dialog,
-        max_time
+        ball_n
 ):
-    prog_dialog.setValue(time / max_time * 100)  # Sets progress bar time value.
-
     if number_dimensions != 2 and number_dimensions != 3:  # No, time does not count as the 4th dimension.
         return ValueError()
 
@@ -196,3 +423,177 @@ def newton_newODE_solver_2(
     final_derivatives_n = np.concatenate((pos_derivatives_n, vel_derivatives_n))
 
     return final_derivatives_n
+
+
+# Test particles: bodies with no mass (EG thousands of asteroids around a couple of stars) feel everything else but pull
+# on nothing, so they are never used as force sources. With N_massive of the N bodies having mass, a force evaluation
+# is then O(N_massive x N) instead of O(N^2).
+def interaction_pairs(massive):
+    """
+    Every pair of bodies where at least one of them has mass, each pair once (i < j)
+
+    :param massive: Bool per body, True if it has mass
+    :return: pair_i, pair_j. With every body massive, the same pairs in the same order as np.triu_indices.
+    """
+
+    sources = np.flatnonzero(massive)
+    test_particles = np.flatnonzero(~massive)
+    source_i, source_j = np.triu_indices(len(sources), k=1)
+    pair_source = np.repeat(sources, len(test_particles))
+    pair_particle = np.tile(test_particles, len(sources))
+    return (
+        np.concatenate((sources[source_i], np.minimum(pair_source, pair_particle))),
+        np.concatenate((sources[source_j], np.maximum(pair_source, pair_particle)))
+    )
+
+
+# All-pairs gravity kernel that works on whole arrays instead of nested Python loops.
+# Everything that does not change between RHS calls (masses, pair indices) is prepared once up front.
+# ensemble_size > 1 stacks that many independent copies of a scene one after another (see ensemble.py),
+# bodies only feel the other bodies in their own copy.
+# dtype is what the accelerations are worked out in, float32 for previews (see precision.py).
+# softening is a Plummer softening length: gravity acts as if every distance r were sqrt(r^2 + softening^2), so close
+# encounters stay finite instead of the steps shrinking to nothing. 0 for plain Newtonian gravity.
+# Massless bodies are test particles, see interaction_pairs.
+class DirectSumKernel:
+    def __init__(self, masses, number_dimensions, G=6.67408e-11, ensemble_size=1, dtype=np.float64, softening=0.0):
+        if number_dimensions != 2 and number_dimensions != 3:
+            raise ValueError("Bad n_dimensions")
+
+        self.G = G
+        self.number_dimensions = number_dimensions
+        self.dtype = np.dtype(dtype)
+        self.softening_sq = softening ** 2
+        self.masses = np.asarray(masses, dtype=np.float64).ravel()  # Mass vector, read once rather than per pair.
+        self.n_bodies = len(self.masses)
+        self.source_strengths = (G * self.masses).astype(self.dtype)  # G m, G times a star mass is too big for float32
+
+        # A body is a source if it has mass in any copy of the scene, where a perturbation left it massless that just
+        # adds a few zeros.
+        scene_size = self.n_bodies // ensemble_size
+        scene_massive = np.any(self.masses.reshape(ensemble_size, scene_size) != 0.0, axis=0)
+        scene_offsets = np.arange(ensemble_size)[:, np.newaxis] * scene_size
+        self.scene_sources = np.flatnonzero(scene_massive)  # Indices within one copy of the scene
+        self.sources = (scene_offsets + self.scene_sources).ravel()
+
+        # Every unordered pair (i < j) exactly once, Newtons 3rd law gives us the other half for free.
+        scene_pair_i, scene_pair_j = interaction_pairs(scene_massive)
+        self.pair_i = (scene_offsets + scene_pair_i).ravel()
+        self.pair_j = (scene_offsets + scene_pair_j).ravel()
+        self.mass_i = self.masses[self.pair_i]
+        self.mass_j = self.masses[self.pair_j]
+        self.strength_i = self.source_strengths[self.pair_i]
+        self.strength_j = self.source_strengths[self.pair_j]
+
+    def accelerations(self, pos_vector_bodies):
+        """
+        Calculate the gravitational acceleration on every body
+
+        :param pos_vector_bodies: Positions, shape (n_bodies, n_dimensions)
+        :return: Accelerations, same shape as the positions
+        """
+
+        # Pairwise separations, pointing from the affected object i to the transmitting object j.
+        pos_vector_bodies = np.asarray(pos_vector_bodies, dtype=self.dtype)
+        distance_direction = pos_vector_bodies[self.pair_j] - pos_vector_bodies[self.pair_i]
+        distance_tot_sq = np.einsum("pd,pd->p", distance_direction, distance_direction) + self.softening_sq
+        # Direction over distance, then over distance squared. Distance cubed on its own does not fit in a float32
+        # past about 1e12 m.
+        inv_distance = 1.0 / np.sqrt(distance_tot_sq)
+        inv_distance_sq = inv_distance * inv_distance
+
+        dveldt_n = np.empty((self.n_bodies, self.number_dimensions), dtype=self.dtype)
+        for dimension in range(self.number_dimensions):  # Only 2 or 3 iterations, the pairs are all done at once.
+            pair_force = distance_direction[:, dimension] * inv_distance * inv_distance_sq
+            # i is pulled towards j, j is pulled equally hard back towards i.
+            dveldt_n[:, dimension] = \
+                np.bincount(self.pair_i, weights=self.strength_j * pair_force, minlength=self.n_bodies) - \
+                np.bincount(self.pair_j, weights=self.strength_i * pair_force, minlength=self.n_bodies)
+
+        return dveldt_n
+
+    def potential_energy(self, pos_vector_bodies):  # Gravitational potential energy of the whole system, in float64.
+        pos_vector_bodies = np.asarray(pos_vector_bodies, dtype=np.float64)
+        distance_direction = pos_vector_bodies[self.pair_j] - pos_vector_bodies[self.pair_i]
+        distance_tot = np.sqrt(np.einsum("pd,pd->p", distance_direction, distance_direction) + self.softening_sq)
+        return -self.G * np.sum(self.mass_i * self.mass_j / distance_tot)
+
+    def accelerations_and_jerks(self, pos_vector_bodies, vel_vector_bodies, targets):
+        """
+        Calculate the acceleration and its time derivative (the jerk) on a subset of bodies
+
+        :param pos_vector_bodies: Positions of all bodies, shape (n_bodies, n_dimensions)
+        :param vel_vector_bodies: Velocities of all bodies, same shape
+        :param targets: Indices of the bodies to calculate for, every massive body still acts as a source
+        :return: Accelerations and jerks, both shape (len(targets), n_dimensions)
+        """
+
+        # Only some rows are needed here, so the pair symmetry trick above does not help. Plain broadcasting instead.
+        targets = np.asarray(targets)
+        pos_vector_bodies = np.asarray(pos_vector_bodies, dtype=self.dtype)
+        vel_vector_bodies = np.asarray(vel_vector_bodies, dtype=self.dtype)
+        distance_direction = pos_vector_bodies[np.newaxis, self.sources, :] - pos_vector_bodies[targets, np.newaxis, :]
+        velocity_direction = vel_vector_bodies[np.newaxis, self.sources, :] - vel_vector_bodies[targets, np.newaxis, :]
+
+        distance_tot_sq = np.einsum("tnd,tnd->tn", distance_direction, distance_direction) + self.softening_sq
+        distance_tot_sq[targets[:, np.newaxis] == self.sources[np.newaxis, :]] = np.inf  # Ignore itself, as it were.
+
+        inv_distance = 1.0 / np.sqrt(distance_tot_sq)
+        strength = self.source_strengths[np.newaxis, self.sources] * inv_distance * inv_distance * inv_distance
+        closing_rate = np.einsum("tnd,tnd->tn", distance_direction, velocity_direction) / distance_tot_sq
+
+        dveldt_n = np.einsum("tn,tnd->td", strength, distance_direction)
+        jerk_n = np.einsum(
+            "tn,tnd->td",
+            strength,
+            velocity_direction - 3.0 * closing_rate[:, :, np.newaxis] * distance_direction
+        )
+
+        return dveldt_n, jerk_n
+
+
+# Same equations as newton_newODE_solver_2, but the accelerations come from a prepared force kernel.
+def newton_vectorized_ODE_solver(
+        time,
+        vectors,
+        n_bodies,
+        number_dimensions,
+        force_kernel
+):
+    split_index = n_bodies * number_dimensions  # Positions first, then velocities, same as the initial conditions.
+    pos_vector_bodies = np.reshape(vectors[:split_index], (n_bodies, number_dimensions))
+
+    dveldt_n = force_kernel.accelerations(pos_vector_bodies)
+
+    # Derivative of the positions is just the velocities, so they are passed straight through.
+    return np.concatenate((vectors[split_index:], dveldt_n.ravel()))
+
+
+# Force kernels the user can pick between in the settings.
+FORCE_BACKENDS = ["direct", "barnes_hut", "parallel"]
+
+
+# Direct summation, compiled with Numba if it is installed (see jit_kernel.py), the NumPy version otherwise.
+def direct_sum_kernel(masses, number_dimensions, G=6.67408e-11, ensemble_size=1, dtype=np.float64, softening=0.0):
+    import jit_kernel  # Not at the top, it imports this module.
+    if jit_kernel.NUMBA_AVAILABLE:
+        return jit_kernel.JitDirectSumKernel(masses, number_dimensions, G, ensemble_size, dtype, softening)
+    return DirectSumKernel(masses, number_dimensions, G, ensemble_size, dtype, softening)
+
+
+# Builds the force kernel that the settings ask for. They all have the same accelerations() method, but the array it
+# gives back is only good until the next call: the Numba and parallel kernels hand back the same buffer every time and
+# overwrite it. Copy it if it has to outlive the next evaluation (the integrators never need to).
+# dtype only goes to direct summation, Barnes-Hut is approximate anyway and always builds its tree in float64.
+# Kernels with a close() method (the parallel one) have to be closed once finished with.
+def make_force_kernel(backend, masses, number_dimensions, G=6.67408e-11, opening_angle=0.5, dtype=np.float64,
+                      softening=0.0, processes=0):
+    if backend == "direct":
+        return direct_sum_kernel(masses, number_dimensions, G, dtype=dtype, softening=softening)
+    elif backend == "barnes_hut":
+        return barnes_hut.BarnesHutKernel(masses, number_dimensions, G, opening_angle, softening=softening)
+    elif backend == "parallel":
+        import parallel_kernel  # Only when asked for, it starts processes.
+        return parallel_kernel.SharedMemoryKernel(masses, number_dimensions, G, processes, dtype, softening)
+    else:
+        raise ValueError(f"Unknown force backend {backend}")
@@ -49,6 +49,7 @@ class EditorDialog(QDialog):
         self.vel_x_edit = self.make_number_edit("Velocity X", "vel_x")
         self.vel_y_edit = self.make_number_edit("Velocity Y", "vel_y")
         self.vel_z_edit = self.make_number_edit("Velocity Z", "vel_z")
+        self.radius_edit = self.make_number_edit("Radius (collisions)", "radius")
 
         ok_button = QPushButton(self)  # The ok button.
         ok_button.setText("Ok")
@@ -110,6 +111,7 @@ class EditorDialog(QDialog):
         self.body.vel_x = float(self.vel_x_edit.text())
         self.body.vel_y = float(self.vel_y_edit.text())
         self.body.vel_z = float(self.vel_z_edit.text())
+        self.body.radius = max(0.0, float(self.radius_edit.text()))
         self.body.color = self.colour.name(QColor.HexRgb)
 
         self.close()
@@ -0,0 +1,276 @@
+#############################################################
+#           N_BODY PROBLEM ENSEMBLE / PARAMETER SWEEP       #
+# Makes lots of slightly different copies of a scene and    #
+# simulates all of them, for stability studies.             #
+#                                                           #
+# python ensemble.py saves/planet_x_ellipse_orbit_4J.json \ #
+#     --variants 200 --perturb "Planet X:vel_y:1%"          #
+#############################################################
+
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+import diagnostics
+import differential
+import integrators
+import precision
+import scene_io
+import simulation
+from app_settings import AppSettings
+from differential import as_body_store
+
+PERTURBABLE_ATTRIBUTES = ["mass", "pos_x", "pos_y", "pos_z", "vel_x", "vel_y", "vel_z"]
+ENSEMBLE_MODES = ["pool", "batched"]
+
+
+# One thing to jitter: a body's attribute gets normal noise with standard deviation sigma added to it.
+class Perturbation:
+    def __init__(self, body_name, attribute, sigma, relative=False):
+        if attribute not in PERTURBABLE_ATTRIBUTES:
+            raise ValueError(f"Cannot perturb {attribute}, pick one of {PERTURBABLE_ATTRIBUTES}")
+
+        self.body_name = body_name  # "*" for every body
+        self.attribute = attribute
+        self.sigma = sigma
+        self.relative = relative  # If True, sigma is a fraction of the current value rather than SI units.
+
+    # "NAME:ATTRIBUTE:SIGMA", with a % on the end of SIGMA to make it relative. EG "Planet X:vel_y:1%"
+    @staticmethod
+    def parse(text):
+        body_name, attribute, sigma_text = text.rsplit(":", 2)
+        if sigma_text.endswith("%"):
+            return Perturbation(body_name, attribute, float(sigma_text[:-1]) / 100.0, relative=True)
+        return Perturbation(body_name, attribute, float(sigma_text))
+
+
+def generate_variants(bodies, perturbations, n_variants, seed=None):
+    """
+    Make perturbed copies of a scene
+
+    :param bodies: The scene to start from, not modified
+    :param perturbations: List of Perturbation
+    :param n_variants: How many copies to make
+    :param seed: Random seed, so a sweep can be repeated exactly
+    :return: List of n_variants differential.BodyStore
+    """
+
+    bodies = as_body_store(bodies)
+    random_generator = np.random.default_rng(seed)
+    body_names = np.array(bodies.names, dtype=object)
+    for perturbation in perturbations:
+        if perturbation.body_name != "*" and perturbation.body_name not in bodies.names:
+            raise ValueError(f"No body called {perturbation.body_name} in the scene")
+
+    variants = []
+    for _ in range(n_variants):
+        variant = bodies.copy()
+        for perturbation in perturbations:
+            rows = slice(None) if perturbation.body_name == "*" else body_names == perturbation.body_name
+            values = variant.column(perturbation.attribute)
+            scale = np.abs(values[rows]) if perturbation.relative else 1.0
+            values[rows] += random_generator.normal(0.0, perturbation.sigma * scale, size=len(values[rows]))
+        variants.append(variant)
+
+    return variants
+
+
+# The per-run numbers we care about for stability, worked out from one run's sampled states.
+# Bodies that merged (see collisions.py) sit on top of each other from then on, those pairs are left out of both the
+# potential energy and the closest approach.
+def summarise_run(solutions, masses, number_dimensions, softening=0.0):
+    masses = np.asarray(masses, dtype=np.float64)
+    n_bodies = len(masses)
+    split_index = n_bodies * number_dimensions
+
+    positions = np.asarray(solutions[:, :split_index]).reshape(len(solutions), n_bodies, number_dimensions)
+    velocities = np.asarray(solutions[:, split_index:]).reshape(len(solutions), n_bodies, number_dimensions)
+
+    def total_energy(sample_index):
+        kinetic = 0.5 * np.sum(masses * np.einsum("nd,nd->n", velocities[sample_index], velocities[sample_index]))
+        potential = diagnostics.potential_energy(
+            positions[sample_index][np.newaxis], masses, simulation.G, softening
+        )[0]
+        return kinetic + potential
+
+    initial_energy = total_energy(0)
+
+    # Closest any two bodies got at any sample.
+    if n_bodies > 1:
+        pair_i, pair_j = np.triu_indices(n_bodies, k=1)
+        separations = positions[:, pair_j, :] - positions[:, pair_i, :]
+        distance_tot_sq = np.einsum("tpd,tpd->tp", separations, separations)
+        min_separation = float(np.sqrt(np.min(np.where(distance_tot_sq > 0.0, distance_tot_sq, np.inf))))
+    else:
+        min_separation = float("inf")
+
+    # How far the furthest body ended up from the centre of mass, big numbers mean something got flung out.
+    centre_of_mass = np.sum(masses[:, np.newaxis] * positions[-1], axis=0) / np.sum(masses)
+    max_final_radius = float(np.max(np.linalg.norm(positions[-1] - centre_of_mass, axis=1)))
+
+    return {
+        "energy_error": float(abs((total_energy(-1) - initial_energy) / initial_energy)),
+        "min_separation": min_separation,
+        "max_final_radius": max_final_radius,
+    }
+
+
+# Runs in the pool's worker processes. Only the summary goes back, pickling whole trajectories would be slow.
+def run_variant(job):
+    variant, app_settings, number_dimensions = job
+    total_time, solutions = simulation.run_simulation(variant, app_settings, number_dimensions)
+    return summarise_run(
+        solutions, variant.masses, number_dimensions, app_settings.softening_length
+    )
+
+
+def run_ensemble_pool(variants, app_settings, number_dimensions, processes=None):
+    """
+    Simulate every variant on its own, spread over a pool of processes
+
+    :param processes: Number of worker processes, None for one per core
+    :return: List of per-run summaries, and the runs per second
+    """
+
+    if app_settings.force_backend == "parallel":  # Pool workers are daemons, they cannot start processes of their own.
+        raise ValueError("The parallel force backend cannot be used in pool mode, the pool already uses every core")
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        summaries = pool.map(run_variant, [(variant, app_settings, number_dimensions) for variant in variants])
+    return summaries, len(variants) / (time.perf_counter() - start)
+
+
+def run_ensemble_batched(variants, app_settings, number_dimensions):
+    """
+    Simulate every variant at once, stacked along an ensemble axis into one big batched RHS
+
+    Every variant takes the same steps, so this suits the fixed-step integrators best. The forces are always direct
+    summation over each variant on its own, settings that cannot work like that are refused rather than ignored.
+    :return: List of per-run summaries, and the runs per second
+    """
+
+    if app_settings.integrator == "block_hermite":
+        raise ValueError("Block time steps cannot be batched, use the pool mode instead")
+    if app_settings.integrator == "regularized":  # Its time transform would come from all the variants together.
+        raise ValueError("The regularized integrator cannot be batched, use the pool mode instead")
+    if app_settings.merge_collisions:  # A merger changes the body count of one variant, the batch needs them equal.
+        raise ValueError("Merging collisions cannot be batched, use the pool mode instead")
+    if app_settings.force_backend != "direct":
+        raise ValueError(
+            f"The batched mode always sums the forces directly, it cannot use the {app_settings.force_backend} backend"
+        )
+
+    start = time.perf_counter()
+
+    n_variants = len(variants)
+    n_bodies = len(variants[0])
+    total_time = np.linspace(0, app_settings.max_time, app_settings.time_samples)
+
+    # Shape (n_variants, 2, n_bodies * n_dimensions) for positions/velocities, then rearranged so all the
+    # positions of every variant come first, the same layout integrate() expects for one scene.
+    packing_dtype = precision.PACKING_DTYPES[app_settings.precision]
+    packed = np.array([
+        simulation.pack_initial_conditions(variant, number_dimensions, packing_dtype) for variant in variants
+    ])
+    packed = packed.reshape(n_variants, 2, n_bodies * number_dimensions)
+    initial_parameters = np.concatenate((packed[:, 0, :].ravel(), packed[:, 1, :].ravel()))
+
+    ensemble_masses = np.array([variant.masses for variant in variants])
+    force_kernel = differential.direct_sum_kernel(
+        ensemble_masses, number_dimensions, simulation.G, ensemble_size=n_variants,
+        dtype=precision.STATE_DTYPES[app_settings.precision], softening=app_settings.softening_length
+    )
+
+    solutions = integrators.integrate(
+        app_settings.integrator,
+        force_kernel,
+        initial_parameters,
+        total_time,
+        n_variants * n_bodies,
+        number_dimensions,
+        app_settings.steps_per_sample,
+        app_settings.block_eta,
+        run_precision=app_settings.precision
+    )
+
+    # Split the big solution back up into one (positions then velocities) array per variant.
+    ensemble_columns = n_variants * n_bodies * number_dimensions
+    positions = solutions[:, :ensemble_columns].reshape(len(total_time), n_variants, -1)
+    velocities = solutions[:, ensemble_columns:].reshape(len(total_time), n_variants, -1)
+
+    summaries = []
+    for variant_index in range(n_variants):
+        variant_solutions = np.concatenate((positions[:, variant_index, :], velocities[:, variant_index, :]), axis=1)
+        summaries.append(summarise_run(
+            variant_solutions, ensemble_masses[variant_index], number_dimensions, app_settings.softening_length
+        ))
+
+    return summaries, n_variants / (time.perf_counter() - start)
+
+
+# Mean, standard deviation and range of each summary value over the whole ensemble.
+def ensemble_statistics(summaries):
+    statistics = {}
+    for key in summaries[0]:
+        values = np.array([summary[key] for summary in summaries])
+        statistics[key] = {
+            "mean": float(np.mean(values)),
+            "std": float(np.std(values)),
+            "min": float(np.min(values)),
+            "max": float(np.max(values)),
+        }
+    return statistics
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Simulate many perturbed copies of a scene.")
+    parser.add_argument("scene", help="Scene JSON file to perturb")
+    parser.add_argument("--variants", type=int, default=100, help="How many perturbed copies to run")
+    parser.add_argument(
+        "--perturb", action="append", default=[],
+        help="NAME:ATTRIBUTE:SIGMA, SIGMA ending in %% is relative. NAME can be * for all bodies. Repeatable."
+    )
+    parser.add_argument("--mode", choices=ENSEMBLE_MODES, default="pool", help="Process pool or one batched RHS")
+    parser.add_argument("--processes", type=int, help="Pool mode only, defaults to one per core")
+    parser.add_argument("--dimensions", type=int, choices=[2, 3], default=3, help="Number of dimensions")
+    parser.add_argument("--integrator", choices=integrators.INTEGRATORS, help="Override the scene's integrator")
+    parser.add_argument("--seed", type=int, help="Random seed for the perturbations")
+    parser.add_argument("--output", help="Write the per-run summaries and statistics to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    app_settings = AppSettings()
+    bodies = scene_io.load_scene(args.scene, app_settings)
+    if args.integrator is not None:
+        app_settings.integrator = args.integrator
+
+    perturbations = [Perturbation.parse(text) for text in args.perturb]
+    variants = generate_variants(bodies, perturbations, args.variants, args.seed)
+
+    if args.mode == "pool":
+        summaries, runs_per_second = run_ensemble_pool(variants, app_settings, args.dimensions, args.processes)
+    else:
+        summaries, runs_per_second = run_ensemble_batched(variants, app_settings, args.dimensions)
+
+    statistics = ensemble_statistics(summaries)
+    print(f"{args.variants} runs ({args.mode}, {app_settings.integrator}): {runs_per_second:.2f} runs/s")
+    for key, values in statistics.items():
+        print(f"  {key}: mean {values['mean']:.4e}, std {values['std']:.4e}, "
+              f"min {values['min']:.4e}, max {values['max']:.4e}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"runs": summaries, "statistics": statistics, "runs_per_second": runs_per_second}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# What a run spent its time on, and what the solver got up to. Filled in by simulation.run_simulation (and the window,
+# for drawing), then printed by batch_runner.py, shown in the window and saved next to the trajectory.
+import contextlib
+import time
+
+
+# Passes everything on to the real kernel, counting how often the RHS asks for forces.
+class CountingKernel:
+    def __init__(self, force_kernel):
+        self.force_kernel = force_kernel
+        self.rhs_evaluations = 0  # Calls to the force kernel
+        self.body_evaluations = 0  # Bodies that had their force worked out, less than N per call with block steps
+
+        # Only if the real kernel has it, the block time step integrator checks for it.
+        if hasattr(force_kernel, "accelerations_and_jerks"):
+            self.accelerations_and_jerks = self.counted_accelerations_and_jerks
+
+    def accelerations(self, pos_vector_bodies):
+        self.rhs_evaluations += 1
+        self.body_evaluations += len(pos_vector_bodies)
+        return self.force_kernel.accelerations(pos_vector_bodies)
+
+    def counted_accelerations_and_jerks(self, pos_vector_bodies, vel_vector_bodies, targets):
+        self.rhs_evaluations += 1
+        self.body_evaluations += len(targets)
+        return self.force_kernel.accelerations_and_jerks(pos_vector_bodies, vel_vector_bodies, targets)
+
+    def __getattr__(self, name):  # Anything else (potential_energy and such) straight through.
+        return getattr(self.force_kernel, name)
+
+
+class RunReport:
+    def __init__(self):
+        self.settings = {}  # What was run: bodies, integrator, force backend...
+        self.phases = {}  # Phase name -> seconds, in the order they first happened
+        self.counters = {}  # RHS evaluations, frames drawn...
+        self.solver = {}  # Whatever the integrator filled in, see integrators.integrate
+
+    @contextlib.contextmanager
+    def phase(self, name):  # with report.phase("integrate"): ...  Adds up if the same phase happens again.
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def to_dict(self):
+        return {"settings": self.settings, "phases": self.phases, "counters": self.counters, "solver": self.solver}
+
+    @staticmethod
+    def from_dict(data):
+        report = RunReport()
+        report.settings = data.get("settings", {})
+        report.phases = data.get("phases", {})
+        report.counters = data.get("counters", {})
+        report.solver = data.get("solver", {})
+        return report
+
+    def summary(self):  # One line, for a label.
+        total = sum(self.phases.values())
+        rhs = self.counters.get("rhs_evaluations")
+        text = f"{total:.2f} s"
+        if rhs is not None:
+            text += f", {rhs} RHS"
+        if "steps" in self.solver:
+            text += f", {self.solver['steps']} steps"
+        if self.solver.get("method_switches"):
+            text += f", {self.solver['method_switches']} stiff/non-stiff switches"
+        return text
+
+    def format(self, indent="  "):  # A few lines of text, for the command line and the tooltip in the window.
+        lines = []
+        if len(self.settings) > 0:
+            lines.append(indent + ", ".join(f"{name} {value}" for name, value in self.settings.items()))
+        lines.append(indent + "time: " + ", ".join(f"{name} {seconds:.3f} s" for name, seconds in self.phases.items()))
+        if len(self.counters) > 0:
+            lines.append(indent + ", ".join(format_value(name, value) for name, value in self.counters.items()))
+
+        solver_parts = [format_value(name, value) for name, value in self.solver.items() if name != "warnings"]
+        if len(solver_parts) > 0:
+            lines.append(indent + "solver: " + ", ".join(solver_parts))
+        for warning in self.solver.get("warnings", []):
+            lines.append(indent + "solver warning: " + warning.strip())
+        return "\n".join(lines)
+
+
+def format_value(name, value):
+    if isinstance(value, float):
+        value = f"{value:.3e}"
+    return f"{name.replace('_', ' ')} {value}"
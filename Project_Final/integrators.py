@@ -0,0 +1,557 @@
+# Picks how the equations of motion get stepped forward in time.
+# odeint is the original adaptive LSODA solver, leapfrog and yoshida4 are fixed-step symplectic schemes which do not
+# drift in energy, and block_hermite gives every body its own power-of-two step for close encounters.
+import numpy as np
+from scipy.integrate import odeint
+
+import differential
+import precision
+from progress import ProgressObserver, SimulationCancelled
+
+
+# Integrators the user can pick between in the settings.
+INTEGRATORS = ["odeint", "leapfrog", "yoshida4", "block_hermite", "regularized"]
+
+# Yoshida's 4th order coefficients, three leapfrog sub steps of w1, w0, w1 times the full step.
+YOSHIDA_W1 = 1.0 / (2.0 - 2.0 ** (1.0 / 3.0))
+YOSHIDA_W0 = -(2.0 ** (1.0 / 3.0)) / (2.0 - 2.0 ** (1.0 / 3.0))
+
+
+# One kick-drift-kick leapfrog step. Updates pos and vel in place and hands back the new acceleration,
+# so the next step can reuse it. That way each step only costs the one force evaluation.
+# The compensations are None, or the Kahan compensation terms for extended precision (see precision.py).
+def leapfrog_step(pos_vector_bodies, vel_vector_bodies, acc_vector_bodies, dt, force_kernel,
+                  pos_compensation=None, vel_compensation=None):
+    precision.add_to(vel_vector_bodies, 0.5 * dt * acc_vector_bodies, vel_compensation)  # Kick
+    precision.add_to(pos_vector_bodies, dt * vel_vector_bodies, pos_compensation)  # Drift
+    acc_vector_bodies = force_kernel.accelerations(pos_vector_bodies)
+    precision.add_to(vel_vector_bodies, 0.5 * dt * acc_vector_bodies, vel_compensation)  # Kick
+    return acc_vector_bodies
+
+
+# Yoshida 4th order, just three leapfrog steps one after another with funny step sizes (one is negative!).
+def yoshida4_step(pos_vector_bodies, vel_vector_bodies, acc_vector_bodies, dt, force_kernel,
+                  pos_compensation=None, vel_compensation=None):
+    for weight in (YOSHIDA_W1, YOSHIDA_W0, YOSHIDA_W1):
+        acc_vector_bodies = leapfrog_step(
+            pos_vector_bodies, vel_vector_bodies, acc_vector_bodies, weight * dt, force_kernel,
+            pos_compensation, vel_compensation
+        )
+    return acc_vector_bodies
+
+
+# Working copies of the positions and velocities for the integrators that step them themselves, in the precision's
+# dtype. For compensated precisions also the Kahan terms, started off with whatever did not fit in the working copies
+# (the initial conditions are packed in np.longdouble then). None and None otherwise.
+def working_state(initial_parameters, n_bodies, number_dimensions, run_precision):
+    split_index = n_bodies * number_dimensions  # Positions first, then velocities.
+    state_dtype = precision.STATE_DTYPES[run_precision]
+    shape = (n_bodies, number_dimensions)
+
+    initial_pos = np.asarray(initial_parameters[:split_index]).reshape(shape)
+    initial_vel = np.asarray(initial_parameters[split_index:]).reshape(shape)
+    pos_vector_bodies = initial_pos.astype(state_dtype)
+    vel_vector_bodies = initial_vel.astype(state_dtype)
+
+    pos_compensation = vel_compensation = None
+    if run_precision in precision.COMPENSATED:
+        # Working copy minus the exact value, the same sign the Kahan term has.
+        pos_compensation = (pos_vector_bodies - initial_pos).astype(state_dtype)
+        vel_compensation = (vel_vector_bodies - initial_vel).astype(state_dtype)
+
+    return pos_vector_bodies, vel_vector_bodies, pos_compensation, vel_compensation
+
+
+# odeint gets restarted about this many times over a run, so progress can be reported in between.
+# The first segments are shorter (1, 2, 4... samples) so the first frames come out straight away for streaming.
+ODEINT_SEGMENTS = 100
+
+# Block time steps are the sample interval divided by 2^level, so the finest step is 2^-BLOCK_MAX_LEVEL of it.
+BLOCK_MAX_LEVEL = 30
+
+
+# Picks the power-of-two level each body wants from its own acceleration and jerk (Aarseth style dt = eta |a| / |j|).
+def block_levels(acc_vector_bodies, jerk_vector_bodies, dt_max, block_eta):
+    acc_size = np.sqrt(np.einsum("nd,nd->n", acc_vector_bodies, acc_vector_bodies))
+    jerk_size = np.sqrt(np.einsum("nd,nd->n", jerk_vector_bodies, jerk_vector_bodies))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dt_wanted = block_eta * acc_size / jerk_size
+    dt_wanted = np.where(np.isfinite(dt_wanted) & (dt_wanted > 0.0), dt_wanted, dt_max)  # No jerk, no limit.
+
+    levels = np.ceil(np.log2(dt_max / dt_wanted))
+    return np.clip(levels, 0, BLOCK_MAX_LEVEL).astype(np.int64)
+
+
+# 4th order Hermite with hierarchical block time steps. Every body steps at the sample interval / 2^level,
+# so only the bodies in a close encounter get the tiny steps, and everything meets up again at each sample.
+def block_hermite_samples(force_kernel, initial_parameters, total_time, n_bodies, number_dimensions, block_eta,
+                          solver_stats, run_precision):
+    if not hasattr(force_kernel, "accelerations_and_jerks"):
+        raise ValueError("Block time steps need a force kernel that can calculate jerks, use the direct backend")
+
+    all_bodies = np.arange(n_bodies)
+
+    pos_vector_bodies, vel_vector_bodies, pos_compensation, vel_compensation = working_state(
+        initial_parameters, n_bodies, number_dimensions, run_precision
+    )
+    acc_vector_bodies, jerk_vector_bodies = force_kernel.accelerations_and_jerks(pos_vector_bodies, vel_vector_bodies, all_bodies)
+
+    # Time is counted in integer ticks inside each sample interval, so the block times line up exactly.
+    ticks_per_sample = 2 ** BLOCK_MAX_LEVEL
+    levels = None
+
+    solver_stats.update({"block_steps": 0, "body_steps": 0, "max_level": 0, "min_step": None})
+
+    for sample_index in range(1, len(total_time)):
+        dt_max = total_time[sample_index] - total_time[sample_index - 1]
+        tick_size = dt_max / ticks_per_sample
+
+        if levels is None:
+            levels = block_levels(acc_vector_bodies, jerk_vector_bodies, dt_max, block_eta)
+
+        body_ticks = np.zeros(n_bodies, dtype=np.int64)  # Everyone starts the interval in sync.
+        now_ticks = 0
+        while now_ticks < ticks_per_sample:
+            step_ticks = ticks_per_sample >> levels
+            next_ticks = body_ticks + step_ticks
+            now_ticks = int(next_ticks.min())
+            active = np.flatnonzero(next_ticks == now_ticks)  # The block of bodies due at this time.
+
+            # Predict everyone to now, the active bodies need the others' positions at this exact time.
+            delta = ((now_ticks - body_ticks) * tick_size)[:, np.newaxis]
+            pos_predicted = pos_vector_bodies + delta * (vel_vector_bodies + delta * (
+                acc_vector_bodies / 2.0 + delta * jerk_vector_bodies / 6.0))
+            vel_predicted = vel_vector_bodies + delta * (acc_vector_bodies + delta * jerk_vector_bodies / 2.0)
+
+            acc_new, jerk_new = force_kernel.accelerations_and_jerks(pos_predicted, vel_predicted, active)
+
+            solver_stats["block_steps"] += 1
+            solver_stats["body_steps"] += len(active)
+            block_level = int(levels[active].max())
+            if block_level >= solver_stats["max_level"]:
+                solver_stats["max_level"] = block_level
+                solver_stats["min_step"] = dt_max / 2 ** block_level
+
+            # Hermite corrector, only for the active bodies.
+            dt = delta[active]
+            acc_old = acc_vector_bodies[active]
+            jerk_old = jerk_vector_bodies[active]
+            vel_old = vel_vector_bodies[active]
+            vel_new, vel_compensation_new = precision.compensated_sum(
+                vel_old,
+                dt * (acc_old + acc_new) / 2.0 + dt ** 2 * (jerk_old - jerk_new) / 12.0,
+                None if vel_compensation is None else vel_compensation[active]
+            )
+            pos_new, pos_compensation_new = precision.compensated_sum(
+                pos_vector_bodies[active],
+                dt * (vel_old + vel_new) / 2.0 + dt ** 2 * (acc_old - acc_new) / 12.0,
+                None if pos_compensation is None else pos_compensation[active]
+            )
+            pos_vector_bodies[active] = pos_new
+            vel_vector_bodies[active] = vel_new
+            if pos_compensation is not None:
+                pos_compensation[active] = pos_compensation_new
+                vel_compensation[active] = vel_compensation_new
+            acc_vector_bodies[active] = acc_new
+            jerk_vector_bodies[active] = jerk_new
+            body_ticks[active] = now_ticks
+
+            # Smaller steps can happen any time, bigger ones only when the time lines up with the bigger block.
+            wanted_levels = block_levels(acc_new, jerk_new, dt_max, block_eta)
+            active_levels = levels[active]
+            can_coarsen = (now_ticks % (2 * step_ticks[active]) == 0) & (active_levels > 0)
+            levels[active] = np.where(
+                wanted_levels > active_levels,
+                wanted_levels,
+                np.where(can_coarsen & (wanted_levels < active_levels), active_levels - 1, active_levels)
+            )
+
+        yield sample_index, np.concatenate((pos_vector_bodies.ravel(), vel_vector_bodies.ravel()))[np.newaxis, :]
+
+
+# Regularized integration gets slow for more bodies than this. Every body steps with the closest pair.
+REGULARIZED_MAX_BODIES = 10
+
+
+# One step of the time-transformed (logH) leapfrog of Mikkola & Tanikawa 1999 and Preto & Tremaine 1999, the heart of
+# algorithmic regularization. The step is ds in a made up time s, and real time goes as dt = ds / U, U being the
+# potential energy (sum of G m m / r, positive). So steps shrink by themselves as bodies get close, and close approaches
+# (even head on ones) come out right without 1/r ever blowing up. The drift uses T + B in place of U, B is minus the
+# total energy so T + B = U along the real orbit, which is what makes two body orbits come out exact apart from timing.
+# That only holds for drift-kick-drift, kick-drift-kick loses the energy of eccentric orbits at the pericentre.
+# Updates pos and vel in place, hands back the new time.
+def regularized_step(pos_vector_bodies, vel_vector_bodies, now, ds, force_kernel, masses, binding_energy,
+                     pos_compensation=None, vel_compensation=None):
+    now = regularized_drift(pos_vector_bodies, vel_vector_bodies, now, 0.5 * ds, masses, binding_energy,
+                            pos_compensation)
+
+    acc_vector_bodies = force_kernel.accelerations(pos_vector_bodies)
+    potential = -force_kernel.potential_energy(pos_vector_bodies)
+    precision.add_to(vel_vector_bodies, (ds / potential) * acc_vector_bodies, vel_compensation)  # Kick
+
+    return regularized_drift(pos_vector_bodies, vel_vector_bodies, now, 0.5 * ds, masses, binding_energy,
+                             pos_compensation)
+
+
+def regularized_drift(pos_vector_bodies, vel_vector_bodies, now, ds, masses, binding_energy, pos_compensation=None):
+    kinetic = 0.5 * np.sum(masses * np.einsum("nd,nd->n", vel_vector_bodies, vel_vector_bodies))
+    drift_dt = ds / (kinetic + binding_energy)
+    precision.add_to(pos_vector_bodies, drift_dt * vel_vector_bodies, pos_compensation)
+    return now + drift_dt
+
+
+# Cubic Hermite interpolation between two states, from their positions, velocities and accelerations.
+def hermite_interpolate(time, start, end):
+    start_time, start_pos, start_vel, start_acc = start
+    end_time, end_pos, end_vel, end_acc = end
+    step = end_time - start_time
+    tau = (time - start_time) / step
+
+    h00 = 2.0 * tau ** 3 - 3.0 * tau ** 2 + 1.0
+    h10 = tau ** 3 - 2.0 * tau ** 2 + tau
+    h01 = -2.0 * tau ** 3 + 3.0 * tau ** 2
+    h11 = tau ** 3 - tau ** 2
+    pos_vector_bodies = h00 * start_pos + h10 * step * start_vel + h01 * end_pos + h11 * step * end_vel
+    vel_vector_bodies = h00 * start_vel + h10 * step * start_acc + h01 * end_vel + h11 * step * end_acc
+    return np.concatenate((pos_vector_bodies.ravel(), vel_vector_bodies.ravel()))
+
+
+# Algorithmic regularization for few-body systems with lots of close encounters (Burrau's problem and such).
+# Every step is three logH leapfrog steps with the Yoshida weights, 4th order, and the steps land wherever they land
+# in real time, so the samples are interpolated in between. The step in s is picked so the first step is the sample
+# interval / steps_per_sample, after that it changes by itself with how close the bodies are.
+def regularized_samples(force_kernel, initial_parameters, total_time, n_bodies, number_dimensions, steps_per_sample,
+                        solver_stats, run_precision):
+    if not hasattr(force_kernel, "potential_energy"):
+        raise ValueError("Regularized integration needs the potential energy, use the direct backend")
+    if n_bodies > REGULARIZED_MAX_BODIES:
+        raise ValueError(f"Regularized integration is for few-body systems, up to {REGULARIZED_MAX_BODIES} bodies")
+
+    masses = np.asarray(force_kernel.masses, dtype=np.float64)
+    pos_vector_bodies, vel_vector_bodies, pos_compensation, vel_compensation = working_state(
+        initial_parameters, n_bodies, number_dimensions, run_precision
+    )
+
+    potential = -force_kernel.potential_energy(pos_vector_bodies)
+    if not potential > 0.0:
+        raise ValueError("Regularized integration needs at least two bodies with mass")
+    kinetic = 0.5 * np.sum(masses * np.einsum("nd,nd->n", vel_vector_bodies, vel_vector_bodies))
+    binding_energy = potential - kinetic  # Minus the total energy, which stays the same without outside forces
+
+    now = total_time[0]
+    ds = 0.0
+    if len(total_time) > 1:
+        ds = (total_time[1] - total_time[0]) / steps_per_sample * potential
+
+    solver_stats.update({"steps": 0, "min_step": None, "max_step": None})
+    sample_index = 1
+    acc_vector_bodies = None  # At the start of the step, only worked out for the steps that have samples in them.
+    while sample_index < len(total_time):
+        start_now, start_pos, start_vel = now, pos_vector_bodies.copy(), vel_vector_bodies.copy()
+        start_acc = acc_vector_bodies
+        for weight in (YOSHIDA_W1, YOSHIDA_W0, YOSHIDA_W1):
+            now = regularized_step(
+                pos_vector_bodies, vel_vector_bodies, now, weight * ds, force_kernel, masses, binding_energy,
+                pos_compensation, vel_compensation
+            )
+        acc_vector_bodies = None
+
+        step = now - start_now
+        solver_stats["steps"] += 1
+        solver_stats["min_step"] = step if solver_stats["min_step"] is None else min(solver_stats["min_step"], step)
+        solver_stats["max_step"] = step if solver_stats["max_step"] is None else max(solver_stats["max_step"], step)
+
+        # Every sample this step went past.
+        first_index = sample_index
+        while sample_index < len(total_time) and total_time[sample_index] <= now:
+            sample_index += 1
+        if sample_index > first_index:
+            if start_acc is None:
+                start_acc = np.array(force_kernel.accelerations(start_pos))
+            acc_vector_bodies = np.array(force_kernel.accelerations(pos_vector_bodies))
+            start = (start_now, start_pos, start_vel, start_acc)
+            end = (now, pos_vector_bodies, vel_vector_bodies, acc_vector_bodies)
+            yield first_index, np.array([
+                hermite_interpolate(total_time[index], start, end) for index in range(first_index, sample_index)
+            ])
+
+
+FIXED_STEP_FUNCTIONS = {
+    "leapfrog": leapfrog_step,
+    "yoshida4": yoshida4_step,
+}
+
+
+# Fixed steps, sized so we land exactly on every sample time.
+def fixed_step_samples(step_function, force_kernel, initial_parameters, total_time, n_bodies, number_dimensions, steps_per_sample,
+                       solver_stats, run_precision):
+    # Working copies, stepped in place.
+    pos_vector_bodies, vel_vector_bodies, pos_compensation, vel_compensation = working_state(
+        initial_parameters, n_bodies, number_dimensions, run_precision
+    )
+    acc_vector_bodies = force_kernel.accelerations(pos_vector_bodies)
+
+    solver_stats.update({"steps": 0, "step_size": None})
+    for sample_index in range(1, len(total_time)):
+        dt = (total_time[sample_index] - total_time[sample_index - 1]) / steps_per_sample
+        for _ in range(steps_per_sample):
+            acc_vector_bodies = step_function(
+                pos_vector_bodies, vel_vector_bodies, acc_vector_bodies, dt, force_kernel, pos_compensation, vel_compensation
+            )
+        solver_stats["steps"] += steps_per_sample
+        solver_stats["step_size"] = dt
+
+        yield sample_index, np.concatenate((pos_vector_bodies.ravel(), vel_vector_bodies.ravel()))[np.newaxis, :]
+
+
+# The odeint integration split into segments of samples, each one carrying on from where the last one stopped.
+# Gives the loop in integrate() somewhere to report progress from, without touching the RHS.
+def odeint_samples(force_kernel, initial_parameters, total_time, n_bodies, number_dimensions, solver_stats,
+                   run_precision):
+    # LSODA only works in float64. float32 still gets float32 forces and storage, extended a tighter tolerance.
+    rtol = precision.EXTENDED_ODEINT_RTOL if run_precision in precision.COMPENSATED else None
+    max_segment_samples = max(1, -(-(len(total_time) - 1) // ODEINT_SEGMENTS))  # Rounded up.
+    segment_samples = 1
+    current_state = np.asarray(initial_parameters, dtype=np.float64)  # Packed in np.longdouble for extended
+
+    # What LSODA got up to, from full_output. Its counters start again at every segment, so they are added up here.
+    solver_stats.update({
+        "segments": 0,
+        "steps": 0,
+        "function_evaluations": 0,
+        "jacobian_evaluations": 0,
+        "nonstiff_samples": 0,  # Samples reached with Adams (non-stiff)
+        "stiff_samples": 0,  # and with BDF (stiff)
+        "method_switches": 0,
+        "min_step": None,
+        "max_step": None,
+        "warnings": [],
+    })
+    last_method = None
+
+    first_index = 1
+    while first_index < len(total_time):
+        last_index = min(first_index + segment_samples, len(total_time))
+        segment, info = odeint(
+            differential.newton_vectorized_ODE_solver,
+            current_state,
+            total_time[first_index - 1:last_index],  # Starts at the last sample we already have.
+            args=(
+                n_bodies,
+                number_dimensions,
+                force_kernel
+            ),
+            tfirst=True,
+            full_output=True,
+            rtol=rtol
+        )
+        add_odeint_stats(solver_stats, info, last_method)
+        last_method = int(info["mused"][-1])
+        current_state = segment[-1]
+        yield first_index, segment[1:]
+
+        first_index = last_index
+        segment_samples = min(2 * segment_samples, max_segment_samples)
+
+
+def add_odeint_stats(solver_stats, info, last_method):
+    methods = info["mused"]  # 1 for Adams, 2 for BDF, for each sample in the segment
+    steps_used = info["hu"][info["hu"] > 0.0]
+
+    solver_stats["segments"] += 1
+    solver_stats["steps"] += int(info["nst"][-1])
+    solver_stats["function_evaluations"] += int(info["nfe"][-1])
+    solver_stats["jacobian_evaluations"] += int(info["nje"][-1])
+    solver_stats["nonstiff_samples"] += int(np.count_nonzero(methods == 1))
+    solver_stats["stiff_samples"] += int(np.count_nonzero(methods == 2))
+    solver_stats["method_switches"] += int(np.count_nonzero(np.diff(methods) != 0))
+    if last_method is not None and methods[0] != last_method:
+        solver_stats["method_switches"] += 1
+    if len(steps_used) > 0:
+        smallest, biggest = float(steps_used.min()), float(steps_used.max())
+        solver_stats["min_step"] = smallest if solver_stats["min_step"] is None else min(solver_stats["min_step"], smallest)
+        solver_stats["max_step"] = biggest if solver_stats["max_step"] is None else max(solver_stats["max_step"], biggest)
+    if info["message"] != "Integration successful.":
+        solver_stats["warnings"].append(info["message"])
+
+
+# Default place for the samples to go, one big array in RAM. trajectory_store.TrajectoryWriter is the on-disk one.
+class MemorySamples:
+    def __init__(self, n_samples, n_columns, dtype=np.float64):
+        self.solutions = np.zeros((n_samples, n_columns), dtype=dtype)
+
+    def write(self, first_index, sample_rows):
+        self.solutions[first_index:first_index + len(sample_rows), :] = sample_rows
+
+    def result(self):
+        return self.solutions
+
+
+# Starts the integrator going, as a generator of (first_index, sample_rows) with indices counted from total_time[0].
+def sample_blocks_for(integrator, force_kernel, initial_parameters, total_time, n_bodies, number_dimensions,
+                      steps_per_sample, block_eta, solver_stats, run_precision):
+    if integrator == "odeint":
+        return odeint_samples(
+            force_kernel, initial_parameters, total_time, n_bodies, number_dimensions, solver_stats, run_precision
+        )
+    elif integrator == "block_hermite":
+        return block_hermite_samples(
+            force_kernel, initial_parameters, total_time, n_bodies, number_dimensions, block_eta, solver_stats,
+            run_precision
+        )
+    elif integrator == "regularized":
+        return regularized_samples(
+            force_kernel, initial_parameters, total_time, n_bodies, number_dimensions, steps_per_sample, solver_stats,
+            run_precision
+        )
+    elif integrator in FIXED_STEP_FUNCTIONS:
+        return fixed_step_samples(
+            FIXED_STEP_FUNCTIONS[integrator], force_kernel, initial_parameters, total_time, n_bodies, number_dimensions,
+            steps_per_sample, solver_stats, run_precision
+        )
+    else:
+        raise ValueError(f"Unknown integrator {integrator}")
+
+
+# Adds the statistics of a restarted integrator onto the ones from before. Counters add up, the smallest and biggest
+# steps and levels keep the extremes, and anything else (EG the fixed step size) is just the latest.
+def add_solver_stats(solver_stats, segment_stats):
+    for name, value in segment_stats.items():
+        previous = solver_stats.get(name)
+        if previous is None or value is None:
+            solver_stats[name] = value if previous is None else previous
+        elif name.startswith("min_"):
+            solver_stats[name] = min(previous, value)
+        elif name.startswith("max_"):
+            solver_stats[name] = max(previous, value)
+        elif isinstance(value, list):
+            solver_stats[name] = previous + value
+        elif isinstance(value, int):
+            solver_stats[name] = previous + value
+        else:
+            solver_stats[name] = value
+
+
+def integrate(
+        integrator,
+        force_kernel,
+        initial_parameters,
+        total_time,
+        n_bodies,
+        number_dimensions,
+        steps_per_sample=4,
+        block_eta=0.02,
+        progress=None,
+        samples=None,
+        on_samples=None,
+        solver_stats=None,
+        run_precision="float64",
+        mergers=None
+):
+    """
+    Integrate the bodies and sample the state at every time in total_time
+
+    :param integrator: One of INTEGRATORS
+    :param force_kernel: Anything with an accelerations(pos) method, see differential.make_force_kernel. What it gives
+        back may be overwritten by its next call.
+    :param initial_parameters: Flat positions followed by flat velocities
+    :param total_time: Times to output the state at, starting at the initial time
+    :param steps_per_sample: Fixed-step integrators only, how many steps to take between two samples. For the
+        regularized one, how many to start off with
+    :param block_eta: Block time steps only, accuracy parameter for each body's step size
+    :param progress: A progress.ProgressObserver, or None for silence
+    :param samples: Where the samples get written as they come in, defaults to a MemorySamples
+    :param on_samples: Called as on_samples(first_index, sample_rows) for every block of samples once it is written
+    :param solver_stats: Dictionary the integrator fills in with what it got up to (steps, step sizes, for odeint
+        the LSODA counters and stiff/non-stiff method switches). See instrumentation.RunReport.
+    :param run_precision: One of precision.PRECISIONS, the dtype of the state and the default samples
+    :param mergers: A collisions.MergeTracker to merge bodies that touch, or None. The integrator is stopped at the
+        first sample where anything touches, and started again from there with the merged bodies.
+    :raises progress.SimulationCancelled: If the progress observer asked to stop
+    :return: Array of shape (len(total_time), len(initial_parameters)), same layout as odeint gives back.
+        Whatever samples.result() gives, so memory-mapped when writing to a trajectory file.
+    """
+
+    if progress is None:
+        progress = ProgressObserver()
+    if solver_stats is None:
+        solver_stats = {}
+    precision.check_precision(run_precision)
+
+    if integrator not in INTEGRATORS:
+        raise ValueError(f"Unknown integrator {integrator}")
+
+    if samples is None:
+        samples = MemorySamples(len(total_time), len(initial_parameters), precision.STORAGE_DTYPES[run_precision])
+
+    # Bodies touching right at the start are merged before anything else happens.
+    check_mergers = mergers is not None and mergers.has_mergers()
+    active_parameters = initial_parameters
+    initial_row = np.asarray(initial_parameters)[np.newaxis, :]
+    if check_mergers:
+        collision = mergers.first_collision(initial_row)
+        if collision is not None:
+            active_parameters = mergers.merge_all(initial_row[0], collision[1])
+            initial_row = mergers.expand(active_parameters[np.newaxis, :])
+            force_kernel = mergers.make_kernel(mergers.active_masses)
+
+    samples.write(0, initial_row)
+    if on_samples is not None:
+        on_samples(0, initial_row)
+
+    time_span = total_time[-1] - total_time[0]
+    restart_index = 0  # Sample the integrator was last (re)started from
+    segment_stats = solver_stats  # The first run of the integrator fills them in directly
+    while True:
+        n_active = n_bodies if mergers is None else len(mergers.active)
+        sample_blocks = sample_blocks_for(
+            integrator, force_kernel, active_parameters, total_time[restart_index:], n_active, number_dimensions,
+            steps_per_sample, block_eta, segment_stats, run_precision
+        )
+
+        collision = None
+        for first_index, sample_rows in sample_blocks:
+            first_index += restart_index
+            if check_mergers:
+                collision = mergers.first_collision(sample_rows)
+            if collision is not None:
+                # Everything up to the collision as it was, then the merged bodies at the collision itself.
+                row_index, pairs = collision
+                sample_blocks.close()
+                rows_before = mergers.expand(sample_rows[:row_index])
+                active_parameters = mergers.merge_all(sample_rows[row_index], pairs)
+                sample_rows = np.concatenate((rows_before, mergers.expand(active_parameters[np.newaxis, :])))
+            elif mergers is not None:
+                sample_rows = mergers.expand(sample_rows)
+
+            last_index = first_index + len(sample_rows)
+            samples.write(first_index, sample_rows)
+            if on_samples is not None:
+                on_samples(first_index, sample_rows)
+
+            if time_span > 0:
+                progress.update((total_time[last_index - 1] - total_time[0]) / time_span)
+
+            if progress.is_cancelled():
+                sample_blocks.close()  # Lets the integrator clean up before we bail out.
+                raise SimulationCancelled()
+
+            if collision is not None:
+                break
+
+        if segment_stats is not solver_stats:
+            add_solver_stats(solver_stats, segment_stats)
+        if collision is None:
+            break
+
+        # Start again from the merger, with a force kernel for the bodies that are left.
+        restart_index = last_index - 1
+        force_kernel = mergers.make_kernel(mergers.active_masses)
+        segment_stats = {}
+
+    if mergers is not None:
+        solver_stats["mergers"] = len(mergers.merges)
+    progress.finish()
+
+    return samples.result()
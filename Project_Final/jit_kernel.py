@@ -0,0 +1,91 @@
+# Direct summation compiled with Numba, for when it is installed. The NumPy kernel in differential.py makes a few
+# (pairs x dimensions) temporaries on every call, which is what hurts from a hundred or so bodies up. This one just
+# loops over the pairs, with the bodies split between all the cores, and writes into the same buffer every time.
+#
+# Numba is optional, differential.make_force_kernel only picks this when it could be imported.
+import numpy as np
+
+import differential
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+prange = numba.prange if NUMBA_AVAILABLE else range
+
+
+def direct_sum_accelerations(positions, source_strengths, softening_sq, scene_size, scene_sources, dveldt_n):
+    """
+    Add up the pull of every other massive body in the same scene, writing the accelerations into dveldt_n
+
+    :param positions: (n_bodies, n_dimensions)
+    :param source_strengths: G times the mass of each body
+    :param softening_sq: Plummer softening length squared, added to every distance squared
+    :param scene_size: Bodies per scene, only bodies in the same scene feel each other (see ensemble.py)
+    :param scene_sources: Indices within a scene of the bodies that have mass, the rest are test particles
+    :param dveldt_n: Output, same shape as the positions
+    """
+
+    n_bodies, number_dimensions = positions.shape
+    for object_affected_i in prange(n_bodies):  # Every row belongs to one thread, so no locking needed.
+        scene_start = (object_affected_i // scene_size) * scene_size
+        for dimension in range(number_dimensions):
+            dveldt_n[object_affected_i, dimension] = 0.0
+
+        for scene_source in scene_sources:
+            object_transmitting_j = scene_start + scene_source
+            if object_transmitting_j == object_affected_i:
+                continue  # Ignore itself, as it were.
+
+            distance_tot_sq = softening_sq
+            for dimension in range(number_dimensions):
+                distance = positions[object_transmitting_j, dimension] - positions[object_affected_i, dimension]
+                distance_tot_sq += distance * distance
+            # The sums are float64 even for float32 positions, so distance cubed cannot overflow here.
+            strength = source_strengths[object_transmitting_j] / (distance_tot_sq * np.sqrt(distance_tot_sq))
+
+            for dimension in range(number_dimensions):
+                dveldt_n[object_affected_i, dimension] += strength * (
+                    positions[object_transmitting_j, dimension] - positions[object_affected_i, dimension]
+                )
+
+
+if NUMBA_AVAILABLE:
+    # Compiled the first time it is called, and cached on disk so the next run does not have to.
+    direct_sum_accelerations = numba.njit(parallel=True, cache=True)(direct_sum_accelerations)
+
+
+# Drop-in for differential.DirectSumKernel with a compiled accelerations(). Jerks and the potential energy are not
+# needed every step, so those still come from the NumPy version.
+class JitDirectSumKernel(differential.DirectSumKernel):
+    def __init__(self, masses, number_dimensions, G=6.67408e-11, ensemble_size=1, dtype=np.float64, softening=0.0):
+        super().__init__(masses, number_dimensions, G, ensemble_size, dtype, softening)
+        self.scene_size = self.n_bodies // ensemble_size
+        self.dveldt_n = np.empty((self.n_bodies, self.number_dimensions), dtype=self.dtype)  # Reused by every call
+
+        # Compile now rather than inside the first step, so it counts as setup time. Once per dtype.
+        direct_sum_accelerations(
+            np.arange(2 * number_dimensions, dtype=self.dtype).reshape(2, number_dimensions),
+            np.zeros(2, dtype=self.dtype),
+            self.softening_sq,
+            2,
+            np.arange(2),
+            np.empty((2, number_dimensions), dtype=self.dtype)
+        )
+
+    def accelerations(self, pos_vector_bodies):
+        """
+        Calculate the gravitational acceleration on every body
+
+        :param pos_vector_bodies: Positions, shape (n_bodies, n_dimensions)
+        :return: Accelerations, same shape as the positions. The same array every time, so it is overwritten by the
+            next call, copy it if it needs to be kept.
+        """
+
+        direct_sum_accelerations(
+            np.ascontiguousarray(pos_vector_bodies, dtype=self.dtype), self.source_strengths, self.softening_sq,
+            self.scene_size, self.scene_sources, self.dveldt_n
+        )
+        return self.dveldt_n
@@ -7,26 +7,35 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 
-from scipy.integrate import odeint
-
-import differential
+import body_renderers
+import diagnostics
+import instrumentation
+import precision
+import result_cache
+import scene_io
+import simulation_worker
+import trail_decimation
+import trajectory_store
 from app_settings import AppSettings
 from differential import Ball
 from bodies_model import BodiesModel
+import copy
 import os
-import json
+import queue
+import time
 
+from diagnostics_dialog import DiagnosticsDialog
 from editor_dialog import EditorDialog
 from settings_dialog import SettingsDialog
 
-# Easter egg!
-SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+# Blocks of frames the simulation can get ahead of the animation by when streaming, before it has to wait.
+STREAM_QUEUE_BLOCKS = 64
 
+# Trails get about one point per pixel across the graph, more when zoomed in, up to this many times more.
+MAX_TRAIL_ZOOM = 64.0
 
-class BodyLines:  # Stores the matplotlib lines on the graph. This keeps track of them for the animation.
-    def __init__(self, trail_lines, ball_lines):
-        self.trail_lines = trail_lines
-        self.ball_lines = ball_lines
+# Easter egg!
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 
 
 class MainWindow(QWidget):
@@ -36,14 +45,31 @@ class MainWindow(QWidget):
 
         # SETTING VALS TO BE USED FOR FUNCTIONS ######################################
         self.ball_n_position = None
+        self.solutions = None  # Positions and velocities of the last run, kept so it can be saved as a trajectory.
+        self.simulated_bodies = None  # The bodies and settings the last run was done with.
+        self.simulated_settings = None
+        self.run_report = None  # instrumentation.RunReport of the last run, timings and solver statistics.
         self.is_current_data_3d = True  # Is it 3D? We want to know if we want to draw in 3d or 2d regardless of radio button.
         self.app_settings = AppSettings()
         self.total_time = None
         self.current_plot = None
 
-        self.min_extent = -1.0
-        self.max_extent = 1.0
         self.zoom_multiplier = 1.0
+        self.plotted_limits = None  # Graph bounds currently set on the axes.
+        self.background = None  # Saved copy of the figure without the bodies, for blitting.
+        self.trail_pyramid = None  # Decimated trails (trail_decimation.TrailPyramid) for the current results.
+        self.trail_zoom = 1.0  # How zoomed in the graph was when the trails were last picked out.
+
+        self.simulation_worker = None  # Only set while a simulation is running.
+        self.prog_dialog = None
+
+        # Streaming mode, frames come in from the simulation thread through this queue while it runs.
+        self.frame_queue = None
+        self.frames_ready = 0  # How many rows of ball_n_position are filled in so far.
+
+        # Smallest and biggest position reached on each axis, for the graph bounds. Worked out once per run.
+        self.extent_min = np.zeros(3)
+        self.extent_max = np.zeros(3)
         ##############################################################################
 
         self.body_storage = BodiesModel()  # List of bodies and when bodies change, update in UI too!
@@ -61,13 +87,14 @@ class MainWindow(QWidget):
         h_layout.addWidget(canvas_container_widget)  # Adds the container on top of the horizontal widget.
 
         self.fig = Figure()  # Create figure
-        self.line_data = []
+        self.body_renderer = None  # body_renderers.LineRenderer or CollectionRenderer, made once per run.
         self.canvas = FigureCanvas(self.fig)  # Canvas to display fig
         self.canvas.setSizePolicy(QSizePolicy(  # Take up as much space as possible JUST for canvas.
             QSizePolicy.Expanding,
             QSizePolicy.Expanding
         ))
         self.canvas.installEventFilter(self)
+        self.canvas.mpl_connect("draw_event", self.on_canvas_draw)
         canvas_v_layout.addWidget(self.canvas)  # Adds the canvas to the window.
 
         toolbar = NavigationToolbar(self.canvas, self)  # This should add a toolbar.
@@ -94,9 +121,9 @@ class MainWindow(QWidget):
         dimension_change_label.setText("Num of dimensions")  # Set text
         v_layout.addWidget(dimension_change_label)
 
-        dimension_change_2d = QRadioButton(self)  # Creating radio button 2D.
-        dimension_change_2d.setText("2D")
-        v_layout.addWidget(dimension_change_2d)
+        self.dimension_change_2d = QRadioButton(self)  # Creating radio button 2D.
+        self.dimension_change_2d.setText("2D")
+        v_layout.addWidget(self.dimension_change_2d)
 
         self.dimension_change_3d = QRadioButton(self)  # Creating radio button 3D.
         self.dimension_change_3d.setText("3D")
@@ -137,6 +164,21 @@ class MainWindow(QWidget):
         load_button.clicked.connect(self.load)  # Once button clicked
         v_layout.addWidget(load_button)  # This is to load a b
 
+        save_trajectory_button = QPushButton(self)  # Creating a button!
+        save_trajectory_button.setText("Save trajectory")  # Button text
+        save_trajectory_button.clicked.connect(self.save_trajectory)  # Once button clicked
+        v_layout.addWidget(save_trajectory_button)  # This is to save the last simulation results
+
+        load_trajectory_button = QPushButton(self)  # Creating a button!
+        load_trajectory_button.setText("Load trajectory")  # Button text
+        load_trajectory_button.clicked.connect(self.load_trajectory)  # Once button clicked
+        v_layout.addWidget(load_trajectory_button)  # This is to replay a saved simulation without simulating
+
+        diagnostics_button = QPushButton(self)  # Creating a button!
+        diagnostics_button.setText("Conservation diagnostics")  # Button text
+        diagnostics_button.clicked.connect(self.show_diagnostics)  # Once button clicked
+        v_layout.addWidget(diagnostics_button)  # This is to see how accurate the last simulation was
+
         edit_settings_button = QPushButton(self)  # Creating a button!
         edit_settings_button.setText("Settings")  # Button text
         edit_settings_button.clicked.connect(self.edit_settings)  # Once button clicked
@@ -146,6 +188,12 @@ class MainWindow(QWidget):
         self.time_elapsed_label = QLabel(self)  # This label will show the time elapsed when animating.
         v_layout.addWidget(self.time_elapsed_label)
 
+        self.energy_error_label = QLabel(self)  # How far the energy drifted by the end of the last run.
+        v_layout.addWidget(self.energy_error_label)
+
+        self.run_report_label = QLabel(self)  # Where the time went in the last run, the full report is in the tooltip.
+        v_layout.addWidget(self.run_report_label)
+
         self.setWindowTitle('N-Body figurator')  # Sets title
 
         self.time_samples_to_draw = 0  # How many rows of the array we want to draw
@@ -198,270 +246,372 @@ class MainWindow(QWidget):
             message_box.exec_()
             return
 
-        # Creating a progress bar to see how much of the tasks are done.
-        prog_dialog = QProgressDialog("Simulating...", None, 0, 100, self)
-        prog_dialog.setWindowModality(Qt.WindowModal)  # Cannot interact with window behind.
-        prog_dialog.show()
-
-        self.line_data = []
-        self.zoom_multiplier = 1.0  # For the graph, reset graph zoom.
+        if self.simulation_worker is not None:  # Already simulating, one at a time please.
+            return
 
-        #######################################################################
-        # CONSTANTS
-        G = 6.67408e-11
         number_dimensions = 2
         if self.dimension_change_3d.isChecked():
             number_dimensions = 3
 
-        self.is_current_data_3d = number_dimensions == 3
+        cache = None
+        if self.app_settings.cache_size_mb > 0:
+            cache = result_cache.ResultCache(result_cache.DEFAULT_CACHE_DIR, self.app_settings.cache_size_mb)
+
+            # Already simulated this exact scene? Then show it straight away, no thread or progress bar needed.
+            cached = cache.lookup(cache.key_for(self.body_storage, self.app_settings, number_dimensions))
+            if cached is not None:
+                self.is_current_data_3d = number_dimensions == 3
+                self.simulated_bodies = cached.bodies()
+                self.simulated_settings = copy.copy(self.app_settings)
+                self.run_report = cached.report if cached.report is not None else instrumentation.RunReport()
+                self.show_solutions(cached.times, cached.solutions)
+                return
+
+        if self.app_settings.stream_animation:
+            self.start_streaming(number_dimensions)
+
+        # The simulation runs on its own thread, so the window keeps drawing while it goes.
+        thread, self.simulation_worker = simulation_worker.start_simulation_thread(
+            self,
+            self.body_storage,
+            self.app_settings,
+            number_dimensions,
+            cache,
+            self.frame_queue
+        )
 
-        #######################################################################
+        # Creating a progress bar to see how much of the tasks are done, this one can be cancelled.
+        self.prog_dialog = QProgressDialog("Simulating...", "Cancel", 0, 100, self)
+        self.prog_dialog.setWindowModality(Qt.WindowModal)  # Cannot interact with window behind.
+        self.prog_dialog.setAutoClose(False)  # We close it ourselves once the results are in.
+        self.prog_dialog.setAutoReset(False)
+        # A lambda rather than the worker's method, so Qt calls it right here on the GUI thread instead of queueing it
+        # for the worker's thread, which is busy simulating until the run is over.
+        worker = self.simulation_worker
+        self.prog_dialog.canceled.connect(lambda: worker.cancel())
 
-        # ADJUST LAST ARRAY ELEMENT TO ADJUST AMOUNT OF SAMPLES, IMPORTANT FOR CLOSE ENCOUNTERS.
-        self.total_time = np.linspace(0, self.app_settings.max_time, self.app_settings.time_samples)
+        self.run_report = self.simulation_worker.report  # Filled in by the worker, drawing times get added here.
+
+        self.simulation_worker.progress_changed.connect(self.prog_dialog.setValue)
+        self.simulation_worker.finished.connect(self.on_simulation_finished)
+        self.simulation_worker.failed.connect(self.on_simulation_failed)
+        self.simulation_worker.stopped.connect(self.on_simulation_stopped)
 
-        for body in self.body_storage:
-            body.clear_results(number_dimensions)  # Sets number dimensions once all of the arrays have been set.
+        self.prog_dialog.show()
+        thread.start()
 
-        body_storage_length = len(self.body_storage)  # Gets body storage length.
+    # Gets the animation going before there is anything to show, it fills in as the frames arrive.
+    def start_streaming(self, number_dimensions):
+        n_samples = self.app_settings.time_samples
+        self.frame_queue = queue.Queue(maxsize=STREAM_QUEUE_BLOCKS)
 
-        n_bodies = body_storage_length  # Useful in below. For now this is 3. Keep body storage len because readability.
+        self.body_renderer = None
+        self.zoom_multiplier = 1.0
+        self.is_current_data_3d = number_dimensions == 3
+        self.solutions = None
+        self.simulated_bodies = None  # Not known until it finishes, the list being simulated is in body_storage.
 
-        # AUTO-INITIAL CONDITION FITTER
-        if number_dimensions == 2:  # If 2D
+        self.total_time = np.linspace(0, self.app_settings.max_time, n_samples)
+        self.ball_n_position = np.zeros(
+            (n_samples, len(self.body_storage) * number_dimensions),
+            dtype=precision.STORAGE_DTYPES[self.app_settings.precision]  # Same as the finished run will be
+        )
+        self.frames_ready = 0
+        self.trail_pyramid = None  # Not until the whole run is in.
+        self.reset_extents(number_dimensions)
 
-            # Body storage length is x2 to account for velocity as well.
-            size_initial_conditions = np.zeros(
-                [body_storage_length * 2, number_dimensions])  # Sets how long the n_body maker will be.
+        self.time_samples_to_draw = 0
+        self.redraw_timer.start()
 
-            size_index = 0  # To be used for importing all ball data.
-            while size_index < n_bodies:  # Also figures out the number of dimensions.
-                size_initial_conditions[size_index, :] = self.body_storage[size_index].pos_vector
-                size_initial_conditions[size_index + n_bodies, :] = self.body_storage[
-                    size_index].vel_vector  # Dynamically uses the amount of n_bodies to find an appropriate initial parameter.
-                size_index += 1  # So it properly increments.
-        elif number_dimensions == 3:  # If 3D
+    # Copies whatever frames the simulation has finished into ball_n_position. Never waits.
+    def drain_frame_queue(self):
+        while self.frame_queue is not None:
+            try:
+                first_index, position_rows = self.frame_queue.get_nowait()
+            except queue.Empty:
+                return
 
-            # Body storage length is x2 to account for velocity as well.
-            size_initial_conditions = np.zeros([body_storage_length * 2, number_dimensions])
+            self.ball_n_position[first_index:first_index + len(position_rows), :] = position_rows
+            self.frames_ready = max(self.frames_ready, first_index + len(position_rows))
+            self.grow_extents(position_rows)
 
-            size_index = 0
-            while size_index < n_bodies:  # Also figures out the number of dimensions.
-                size_initial_conditions[size_index, :] = self.body_storage[size_index].pos_vector
-                size_initial_conditions[size_index + n_bodies, :] = self.body_storage[
-                    size_index].vel_vector  # Dynamically uses the amount of n_bodies to find an appropriate initial parameter.
-                size_index += 1  # So it properly increments.
-        else:
-            raise ValueError("Bad number of dimensions")  # One dimension option coming soon!
-
-        initial_parameters = size_initial_conditions  # This is so it is flattened later.
-
-        size_of_parameters = np.shape(initial_parameters)
-        initial_parameters = initial_parameters.flatten()  # Turns to 1D
-
-        # Odeint go.
-        solutions_1 = odeint(
-            differential.newton_newODE_solver_2,
-            initial_parameters,
-            self.total_time,
-            args=(
-                G,
-                size_of_parameters,
-                n_bodies,
-                number_dimensions,
-                self.body_storage,
-                prog_dialog,
-                self.app_settings.max_time
-            ),
-            tfirst=True
-        )
+    def on_simulation_finished(self, total_time, solutions_1):  # Worker is done, results come in by reference.
+        self.is_current_data_3d = self.simulation_worker.number_dimensions == 3
+
+        self.simulated_bodies = self.simulation_worker.bodies
+        self.simulated_settings = self.simulation_worker.app_settings
+        self.update_run_report_label()
+
+        if self.frame_queue is None:
+            self.show_solutions(total_time, solutions_1)
+            return
+
+        # Streaming, so the animation is already going. Swap in the full results under it and let it carry on.
+        self.frame_queue = None
+        self.total_time = total_time
+        self.solutions = solutions_1
+        self.ball_n_position = solutions_1[:, 0:int(np.size(solutions_1, axis=1) / 2)]
+        self.frames_ready = len(self.ball_n_position)
+        self.reset_extents(self.simulation_worker.number_dimensions)
+        self.grow_extents(self.ball_n_position)
+        self.trail_pyramid = trail_decimation.TrailPyramid(self.ball_n_position, self.simulation_worker.number_dimensions)
+        self.update_energy_error_label()
+        if not self.redraw_timer.isActive():
+            self.redraw_timer.start()  # It had caught up and stopped, start it again for the last bit.
+
+    def show_solutions(self, total_time, solutions_1):  # Shows a run, whether it was just simulated or loaded.
+        self.body_renderer = None
+        self.zoom_multiplier = 1.0  # For the graph, reset graph zoom.
+
+        self.total_time = total_time
+        self.solutions = solutions_1
 
         # Initial array resize for each ball (ease of use).
         size_solutions_1 = int(np.size(solutions_1, axis=1))
         half_size_solutions_1 = int(size_solutions_1 / 2)
 
-        # Splits up the position and velocity appropriately.
+        # Splits up the position and velocity appropriately. This is a view, not a copy.
         self.ball_n_position = solutions_1[:, 0:half_size_solutions_1]
+        self.frames_ready = len(self.ball_n_position)
 
-        # Close the progress dialog.
-        prog_dialog.close()
+        self.reset_extents(self.get_num_dimensions())
+        self.grow_extents(self.ball_n_position)
+        self.trail_pyramid = trail_decimation.TrailPyramid(self.ball_n_position, self.get_num_dimensions())
+        self.update_energy_error_label()
 
         # Redraw everything at once.
-        self.time_samples_to_draw = self.app_settings.time_samples
+        self.time_samples_to_draw = len(self.total_time)
         self.redraw_plot()
 
+    # Only the first and last samples are needed for this, the full curves are in the diagnostics dialog.
+    def update_energy_error_label(self):
+        if self.simulated_bodies is None:
+            self.energy_error_label.setText("")
+            return
+
+        end_errors = diagnostics.compute_diagnostics(
+            self.total_time[[0, -1]],
+            self.solutions[[0, -1]],
+            [body.mass for body in self.simulated_bodies],
+            self.get_num_dimensions(),
+            softening=self.run_softening()
+        ).final_errors()
+        self.energy_error_label.setText(f"Energy error: {end_errors['energy']:.2e}")
+
+    def run_softening(self):  # What the shown run used, the settings may have changed since.
+        if self.run_report is None:
+            return 0.0
+        return self.run_report.settings.get("softening_length", 0.0)
+
+    def update_run_report_label(self):
+        if self.run_report is None:
+            self.run_report_label.setText("")
+            self.run_report_label.setToolTip("")
+            return
+
+        self.run_report_label.setText(f"Last run: {self.run_report.summary()}")
+        self.run_report_label.setToolTip(self.run_report.format(indent=""))
+
+    def show_diagnostics(self):
+        if self.solutions is None or self.simulated_bodies is None:
+            QMessageBox.information(self, "Nothing to check", "Simulate a problem first, then look at its diagnostics.")
+            return
+
+        dialog = DiagnosticsDialog(
+            self.total_time, self.solutions, self.simulated_bodies, self.get_num_dimensions(), self.run_softening(), self
+        )
+        dialog.exec_()
+
+    def on_simulation_failed(self, message):
+        QMessageBox.warning(self, "Simulation failed", message)
+
+    def on_simulation_stopped(self):  # Called however the simulation ended, finished, failed or cancelled.
+        self.prog_dialog.close()  # Close the progress dialog.
+        self.prog_dialog = None
+        self.simulation_worker = None
+
+        if self.frame_queue is not None:  # Streaming run that never finished, keep the part that did get done.
+            self.drain_frame_queue()
+            self.frame_queue = None
+            self.ball_n_position = self.ball_n_position[:self.frames_ready]
+            self.total_time = self.total_time[:self.frames_ready]
+            if self.frames_ready == 0:
+                self.ball_n_position = None
+                self.redraw_timer.stop()
+
+    def reset_extents(self, number_dimensions):
+        self.extent_min = np.zeros(number_dimensions)  # Start at 0 so the origin is always on the graph.
+        self.extent_max = np.zeros(number_dimensions)
+
+    # Widens the graph bounds to fit some more rows of positions.
+    def grow_extents(self, position_rows):
+        if len(position_rows) == 0:
+            return
+        number_dimensions = len(self.extent_min)
+        points = np.reshape(position_rows, (len(position_rows), -1, number_dimensions))
+        self.extent_min = np.minimum(self.extent_min, points.min(axis=(0, 1)))
+        self.extent_max = np.maximum(self.extent_max, points.max(axis=(0, 1)))
+
+    # Makes the axes and the artists for the bodies (see body_renderers.py). Only done once per run, after that
+    # redraw_plot just moves the data around inside them.
+    def create_artists(self):
+        self.fig.clear()
+        self.plotted_limits = None  # Forces the graph bounds to be set on the next frame.
+        self.background = None
+
+        number_dimensions = self.get_num_dimensions()
+        if number_dimensions == 2:
+            ball_motion = self.fig.add_subplot(111)
+        else:
+            ball_motion = self.fig.add_subplot(111, projection="3d")
+
+        # Colours of the bodies that were actually simulated, the list may have been edited since.
+        bodies = self.body_storage if self.simulated_bodies is None else self.simulated_bodies
+        colors = [bodies[i_ball].color for i_ball in range(len(bodies))]
+        self.body_renderer = body_renderers.make_renderer(
+            self.app_settings.renderer, ball_motion, colors, number_dimensions
+        )
+
+        # Set labels
+        ball_motion.set_xlabel("x distance")
+        ball_motion.set_ylabel("y distance")
+        if number_dimensions == 2:
+            ball_motion.set_aspect("equal", adjustable="datalim")
+        else:
+            ball_motion.set_zlabel("z distance")
+            self.fig.tight_layout()
+
+        self.current_plot = ball_motion
+
+    # Sets the graph bounds from the tracked extents. Only touches the axes if they actually changed, which is
+    # once per run, or while streaming or zooming. Returns True if they did (so a full redraw is needed).
+    def update_limits(self):
+        if self.get_num_dimensions() == 2:
+            (min_extent_x, min_extent_y), (max_extent_x, max_extent_y) = self.extent_min, self.extent_max
+            limits = (
+                min_extent_x - abs(min_extent_x * 0.2), max_extent_x + abs(max_extent_x * 0.2),
+                min_extent_y - abs(min_extent_y * 0.2), max_extent_y + abs(max_extent_y * 0.2)
+            )
+        else:
+            # Same for all axes, we do this such that we can have a 1:1:1 scale between x y z
+            limits = (np.min(self.extent_min) * self.zoom_multiplier, np.max(self.extent_max) * self.zoom_multiplier)
+
+        if limits == self.plotted_limits:
+            return False
+
+        if self.get_num_dimensions() == 2:
+            self.current_plot.set_xlim(limits[0], limits[1])
+            self.current_plot.set_ylim(limits[2], limits[3])
+        else:
+            self.current_plot.set_xlim3d(limits)
+            self.current_plot.set_ylim3d(limits)
+            self.current_plot.set_zlim3d(limits)
+        self.plotted_limits = limits
+        return True
+
+    # While animating, the body lines are "animated" artists. They are left out of full redraws and blitted on
+    # top of a saved background instead. Once the animation stops they go back to normal, so saving the
+    # figure from the toolbar still has them in.
+    def set_artists_animated(self, animated):
+        for artist in self.body_renderer.artists():
+            artist.set_animated(animated)
+
+    def draw_animated_artists(self):
+        if self.body_renderer is None:
+            return
+        for artist in self.body_renderer.artists():
+            if artist.get_animated():
+                self.current_plot.draw_artist(artist)
+
+    # Matplotlib did a full redraw (first frame, resize, rotate, zoom, ...), save the new background for blitting.
+    def on_canvas_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_animated_artists()
+
+        # Zoomed a fair bit since the trails were picked out? Pick them again at the new detail once this draw is done.
+        # While animating the next frame does that anyway.
+        zoom_change = self.view_zoom() / self.trail_zoom
+        if self.ball_n_position is not None and not self.redraw_timer.isActive() and not 0.5 < zoom_change < 2.0:
+            QTimer.singleShot(0, self.redraw_plot)
+
+    # How many times bigger the graph is drawn than when it shows the whole run, from the toolbar zoom in 2D or the
+    # scroll wheel zoom in 3D.
+    def view_zoom(self):
+        if self.current_plot is None or self.plotted_limits is None:
+            return 1.0
+        if self.get_num_dimensions() == 3:
+            return max(1.0, 1.0 / self.zoom_multiplier)
+
+        x_min, x_max = self.current_plot.get_xlim()
+        if x_max <= x_min:
+            return 1.0
+        return max(1.0, (self.plotted_limits[1] - self.plotted_limits[0]) / (x_max - x_min))
+
+    # One body's trail as one array per axis, only as detailed as the screen can show.
+    def trail_data(self, i_ball, begin, end, max_points):
+        if self.trail_pyramid is not None:
+            return self.trail_pyramid.trail(i_ball, begin, end, max_points)
+        return trail_decimation.strided_trail(
+            self.ball_n_position, i_ball, self.get_num_dimensions(), begin, end, max_points
+        )
+
     # Draws the plot which is either 2D or 3D.
     def redraw_plot(self):
-        if self.ball_n_position is None:  # If no data, do not do anything.
+        self.drain_frame_queue()  # Streaming frames, if there are any.
+
+        if self.ball_n_position is None or self.frames_ready == 0:  # If no data, do not do anything.
             return
 
-        # Always replot 2D graphs
-        needs_replot = len(self.line_data) == 0 or not self.is_current_data_3d
+        draw_start = time.perf_counter()  # Drawing time goes in the run report.
 
-        # Getting the dimensions and storage length.
-        number_dimensions = self.get_num_dimensions()
-        body_storage_length = len(self.body_storage)
+        if self.body_renderer is None:  # New results, make the artists for them.
+            self.create_artists()
+
+        # Samples in the results, which can differ from the settings if those were changed after simulating.
+        time_samples = len(self.ball_n_position)
 
-        is_at_end = self.time_samples_to_draw == self.app_settings.time_samples  # Determines if ball reaches end
+        # Each frame we want to draw x more timesteps. When streaming, never past what has been simulated so far.
+        self.time_samples_to_draw += max(1, int(time_samples * 0.01 * self.app_settings.anim_speed))
+        self.time_samples_to_draw = min(self.time_samples_to_draw, time_samples, self.frames_ready)
 
-        # Each frame we want to draw x more timesteps.
-        self.time_samples_to_draw += int(self.app_settings.time_samples * 0.01 * self.app_settings.anim_speed)
-        self.time_samples_to_draw = min(self.time_samples_to_draw, self.app_settings.time_samples)
+        is_at_end = self.time_samples_to_draw == time_samples  # Determines if ball reaches end
 
         if is_at_end:  # If ending animation reached, show entire trail.
             trail_begin = 0
         else:
             # Determines the length of the tail.
-            trail_length_samples = min(int(self.app_settings.time_samples * 0.05), self.time_samples_to_draw - 1)
+            trail_length_samples = min(int(time_samples * 0.05), self.time_samples_to_draw - 1)
             trail_begin = self.time_samples_to_draw - trail_length_samples
+        last_sample = self.time_samples_to_draw - 1
 
-        if needs_replot:  # To replot
-            self.fig.clear()
+        # About one trail point per pixel, more when zoomed in. Long runs get decimated down to that.
+        self.trail_zoom = self.view_zoom()
+        max_points = int(max(self.canvas.width(), 200) * min(self.trail_zoom, MAX_TRAIL_ZOOM))
 
-        # If 2 dimensions, now draw the graph in 2D.
-        if number_dimensions == 2:
-            min_extent_x = 0
-            max_extent_x = 0
-
-            min_extent_y = 0
-            max_extent_y = 0
-
-            if needs_replot:
-                ball_motion = self.fig.add_subplot(111)  # Replots as required.
-                self.current_plot = ball_motion
-            else:
-                ball_motion = self.current_plot  # Reuse current plot.
-
-            for i_ball in range(body_storage_length):
-                trail_lines, = ball_motion.plot(
-                    self.ball_n_position[trail_begin:self.time_samples_to_draw - 1, 0 + (i_ball * 2)],
-                    self.ball_n_position[trail_begin:self.time_samples_to_draw - 1, 1 + (i_ball * 2)],
-                    color=self.body_storage[i_ball].color
-                )  # Selects all the balls.
-
-                ball_lines, = ball_motion.plot(
-                    self.ball_n_position[self.time_samples_to_draw - 1, 0 + (i_ball * 2)],
-                    self.ball_n_position[self.time_samples_to_draw - 1, 1 + (i_ball * 2)],
-                    "o",
-                    color=self.body_storage[i_ball].color  # This one is for the end sphere!
-                )
-
-                self.line_data.append(BodyLines(trail_lines, ball_lines))  # Keep track of line data.
-
-                # See if we need to expand the graph bounds
-                ball_max_x = np.max(self.ball_n_position[:, 0 + (i_ball * 2)])
-                ball_min_x = np.min(self.ball_n_position[:, 0 + (i_ball * 2)])
-                ball_max_y = np.max(self.ball_n_position[:, 1 + (i_ball * 2)])
-                ball_min_y = np.min(self.ball_n_position[:, 1 + (i_ball * 2)])
-
-                max_extent_x = max(max_extent_x, ball_max_x)
-                min_extent_x = min(min_extent_x, ball_min_x)
-                max_extent_y = max(max_extent_y, ball_max_y)
-                min_extent_y = min(min_extent_y, ball_min_y)
-
-            # Kinda ugly hack to prevent it scaling during animation for 2D
-            ball_motion.plot(
-                min_extent_x - (abs(min_extent_x * 0.2)),
-                min_extent_y - (abs(min_extent_y * 0.2)),
-                color=(0.0, 0.0, 0.0, 0.0)
-            )
-            ball_motion.plot(
-                max_extent_x + (abs(max_extent_x * 0.2)),
-                max_extent_y + (abs(max_extent_y * 0.2)),
-                color=(0.0, 0.0, 0.0, 0.0)
-            )
+        # Just point the existing artists at the new data. Short trails are slices (views), nothing gets copied.
+        self.body_renderer.update(self.ball_n_position, trail_begin, last_sample, max_points, self.trail_data)
+
+        # Blit while animating, full redraw for the last frame so it ends up as an ordinary (saveable) figure.
+        needs_full_draw = self.update_limits() or self.background is None or is_at_end
+        self.set_artists_animated(not is_at_end)
 
-            # Set labels
-            ball_motion.set_xlabel("x distance")
-            ball_motion.set_ylabel("y distance")
-            ball_motion.axis("equal")
-
-        # The 3D case now.
-        elif number_dimensions == 3:
-            min_extent = 0
-            max_extent = 0
-
-            if needs_replot:
-                ball_motion = self.fig.add_subplot(111, projection="3d")
-                self.current_plot = ball_motion  # Replots if needed.
-            else:
-                ball_motion = self.current_plot
-
-            for i_ball in range(body_storage_length):  # Takes over entire i_ball range.
-
-                # For the trail
-                trail_x_data = self.ball_n_position[trail_begin:self.time_samples_to_draw - 1, 0 + (i_ball * 3)]
-                trail_y_data = self.ball_n_position[trail_begin:self.time_samples_to_draw - 1, 1 + (i_ball * 3)]
-                trail_z_data = self.ball_n_position[trail_begin:self.time_samples_to_draw - 1, 2 + (i_ball * 3)]
-
-                # For the end ball.
-                ball_x = self.ball_n_position[self.time_samples_to_draw - 1, 0 + (i_ball * 3)]
-                ball_y = self.ball_n_position[self.time_samples_to_draw - 1, 1 + (i_ball * 3)]
-                ball_z = self.ball_n_position[self.time_samples_to_draw - 1, 2 + (i_ball * 3)]
-
-                # Figure if we need to replot data or update existing line data.
-                if needs_replot:
-                    trail_lines, = ball_motion.plot3D(
-                        trail_x_data,
-                        trail_y_data,
-                        trail_z_data,
-                        color=self.body_storage[i_ball].color
-                    )  # Selects all the balls.
-
-                    ball_lines, = ball_motion.plot3D(
-                        ball_x,
-                        ball_y,
-                        ball_z,
-                        "o",
-                        color=self.body_storage[i_ball].color
-                    )
-
-                    self.line_data.append(BodyLines(trail_lines, ball_lines))  # Keep track of line data for animation.
-
-                    # See if we need to expand the graph bounds
-                    ball_max_x = np.max(self.ball_n_position[:, 0 + (i_ball * 3)])
-                    ball_min_x = np.min(self.ball_n_position[:, 0 + (i_ball * 3)])
-                    ball_max_y = np.max(self.ball_n_position[:, 1 + (i_ball * 3)])
-                    ball_min_y = np.min(self.ball_n_position[:, 1 + (i_ball * 3)])
-                    ball_max_z = np.max(self.ball_n_position[:, 2 + (i_ball * 3)])
-                    ball_min_z = np.min(self.ball_n_position[:, 2 + (i_ball * 3)])
-
-                    max_extent = max(max_extent, ball_max_x)
-                    min_extent = min(min_extent, ball_min_x)
-                    max_extent = max(max_extent, ball_max_y)
-                    min_extent = min(min_extent, ball_min_y)
-                    max_extent = max(max_extent, ball_max_z)
-                    min_extent = min(min_extent, ball_min_z)
-
-                else:
-                    ball_lines = self.line_data[i_ball]  # Or update existing line data.
-                    ball_lines.trail_lines.set_data_3d(trail_x_data, trail_y_data, trail_z_data)
-                    ball_lines.ball_lines.set_data_3d(ball_x, ball_y, ball_z)
-
-            if needs_replot:
-                ball_motion.set_xlabel("x distance")
-                ball_motion.set_ylabel("y distance")
-                ball_motion.set_zlabel("z distance")
-
-                # Sets the limits for the graph dynamically.
-                # We do this such that we can have a 1:1:1 scale between x y z
-                ball_motion.set_xlim3d([min_extent, max_extent])
-                ball_motion.set_ylim3d([min_extent, max_extent])
-                ball_motion.set_zlim3d([min_extent, max_extent])
-
-                self.fig.tight_layout()
-
-                self.min_extent = min_extent
-                self.max_extent = max_extent
-
-        # Draw the canvas
-        self.canvas.draw()
-
-        seconds_elapsed = self.total_time[self.time_samples_to_draw - 1]  # Record time.
+        if needs_full_draw:
+            self.canvas.draw()  # on_canvas_draw grabs the new background.
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_animated_artists()
+            self.canvas.blit(self.fig.bbox)
+
+        seconds_elapsed = self.total_time[last_sample]  # Record time.
         self.time_elapsed_label.setText(f"Elapsed: {prettify_elapsed_seconds(seconds_elapsed)}")  # Updates the time.
 
+        if self.run_report is not None:
+            self.run_report.add_time("render", time.perf_counter() - draw_start)
+            self.run_report.counters["frames_drawn"] = self.run_report.counters.get("frames_drawn", 0) + 1
+
         if is_at_end:  # Once it went through all the time samples
             self.redraw_timer.stop()  # Stop animating.
+            self.update_run_report_label()
 
     def start_plot_anim(self):  # Begins the animation.
         self.time_samples_to_draw = 0
@@ -469,42 +619,67 @@ class MainWindow(QWidget):
 
     def save(self):  # The function to save a body configuration
         # Saving as a json file
-        file_path, file_type = QFileDialog.getSaveFileName(self, "Save config JSON", "", "JSON files (*.json)")
+        file_path, file_type = QFileDialog.getSaveFileName(
+            self, "Save config", "", "JSON files (*.json);;Binary scenes (*.nbscene)"
+        )
         if len(file_path) != 0:  # If file path provided.
-            data = {
-                "bodies": [body.serialize() for body in self.body_storage],  # Runs the save function.
-                "settings": {
-                    "time_samples": self.app_settings.time_samples,
-                    "max_time": self.app_settings.max_time,
-                    "anim_speed": self.app_settings.anim_speed,
-                },
-            }
-            json_str = json.dumps(data)  # Outputs as a json.
-
-            with open(file_path, "w") as f:
-                f.write(json_str)  # Write the sets of file into the destination.
+            if file_type.startswith("Binary") and not scene_io.is_binary_scene(file_path):
+                file_path += scene_io.BINARY_SCENE_EXTENSION  # For big scenes, see scene_io.py
+            try:
+                scene_io.save_scene(file_path, self.body_storage, self.app_settings)
+            except OSError as error:  # EG the file is open in another program.
+                QMessageBox.warning(self, "Could not save", f"{file_path} could not be written:\n{error}")
 
     def load(self):  # The function to load a set of bodies.
         # Gets the file path.
-        file_path, file_type = QFileDialog.getOpenFileName(self, "Load config JSON", "", "JSON files (*.json)")
+        file_path, file_type = QFileDialog.getOpenFileName(
+            self, "Load config", "", "Scene files (*.json *.nbscene);;JSON files (*.json);;Binary scenes (*.nbscene)"
+        )
         if len(file_path) != 0:  # If a file path is specified.
-            with open(file_path, "r") as f:
-                content = f.read()  # To read the loaded contents
+            bodies = scene_io.load_scene(file_path, self.app_settings)
 
-            data = json.loads(content)  # Loads
+            self.body_storage.set_bodies(bodies)  # Replaces the initial body storage.
 
-            self.body_storage.clear()  # Clears initial body storage.
-            for body_info in data["bodies"]:
-                body = Ball("")
-                body.deserialize(body_info)  # Thus puts it into the program.
+    def save_trajectory(self):  # Saves the last simulation, positions, velocities and all.
+        if self.solutions is None or self.simulated_bodies is None:
+            QMessageBox.information(self, "Nothing to save", "Simulate a problem first, then save its trajectory.")
+            return
+
+        file_path, file_type = QFileDialog.getSaveFileName(
+            self, "Save trajectory", "", "Trajectory files (*.nbtraj)"
+        )
+        if len(file_path) != 0:  # If file path provided.
+            trajectory_store.save_trajectory(
+                file_path,
+                self.simulated_bodies,
+                self.simulated_settings,
+                self.get_num_dimensions(),
+                self.total_time,
+                self.solutions
+            )
+            if self.run_report is not None:
+                trajectory_store.save_report(file_path, self.run_report)
 
-                self.body_storage.append(body)
+    def load_trajectory(self):  # Loads a saved simulation so it can be animated straight away.
+        file_path, file_type = QFileDialog.getOpenFileName(
+            self, "Load trajectory", "", "Trajectory files (*.nbtraj)"
+        )
+        if len(file_path) != 0:  # If a file path is specified.
+            trajectory = trajectory_store.open_trajectory(file_path)  # Memory-mapped, nothing big is read yet.
+
+            # The bodies and settings have to match the run, otherwise the colours and timings are off.
+            self.simulated_bodies = trajectory.bodies()
+            self.body_storage.set_bodies(self.simulated_bodies.copy())  # A copy, so editing them leaves the run alone.
+            for name, value in trajectory.settings.items():
+                setattr(self.app_settings, name, value)
+            self.simulated_settings = copy.copy(self.app_settings)
+            self.run_report = trajectory.report  # None for files saved without one.
 
-            if "settings" in data:
-                settings = data["settings"]
-                self.app_settings.time_samples = settings["time_samples"]
-                self.app_settings.max_time = settings["max_time"]
-                self.app_settings.anim_speed = settings["anim_speed"]
+            self.is_current_data_3d = trajectory.number_dimensions == 3
+            self.dimension_change_3d.setChecked(self.is_current_data_3d)
+            self.dimension_change_2d.setChecked(not self.is_current_data_3d)
+
+            self.show_solutions(trajectory.times, trajectory.solutions)
 
     # This is to intercept mouse wheel event for a custom zoom in.
     # Thus our own zoom on the graph to center onto the 0,0,0 axis.
@@ -515,10 +690,7 @@ class MainWindow(QWidget):
                 self.zoom_multiplier += adjust
                 self.zoom_multiplier = max(self.zoom_multiplier, 0.0001)
 
-                self.current_plot.set_xlim3d([self.min_extent * self.zoom_multiplier, self.max_extent * self.zoom_multiplier])
-                self.current_plot.set_ylim3d([self.min_extent * self.zoom_multiplier, self.max_extent * self.zoom_multiplier])
-                self.current_plot.set_zlim3d([self.min_extent * self.zoom_multiplier, self.max_extent * self.zoom_multiplier])
-
+                self.update_limits()
                 self.canvas.draw()
 
             # Prevent the default behaviour
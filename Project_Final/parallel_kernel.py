@@ -0,0 +1,207 @@
+# Direct summation split over several processes, for big scenes on machines with lots of cores. The positions, G m of
+# every body and the accelerations live in multiprocessing.shared_memory blocks that every worker has mapped, so a force
+# evaluation is just: copy the positions in, every process fills in its own block of rows, wait for them all. Nothing
+# gets pickled per call. The workers are started once with the kernel and kept until close(), also when bodies merge
+# (see with_masses).
+#
+# The calling process does the first block of rows itself, so processes=4 means 3 workers plus the caller.
+#
+# Every evaluation costs two barrier waits on top of the arithmetic, about 0.1 ms per evaluation on the single core
+# machine this was written on, where adding processes never made it quicker. Run benchmark.py with
+# --backends direct parallel on the machine in question to find where it starts paying off there.
+import multiprocessing
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+CHUNK_ELEMENTS = 2000000  # Max (rows x bodies) pair temporaries worked out at once, per process.
+
+
+# The acceleration of rows row_begin to row_end from every massive body (sources), written into dveldt_n.
+def block_accelerations(positions, source_strengths, sources, softening_sq, row_begin, row_end, dveldt_n):
+    chunk_rows = max(1, CHUNK_ELEMENTS // max(1, len(sources)))
+    source_positions = positions[sources]
+    for chunk_begin in range(row_begin, row_end, chunk_rows):
+        chunk_end = min(chunk_begin + chunk_rows, row_end)
+        distance_direction = source_positions[np.newaxis, :, :] - positions[chunk_begin:chunk_end, np.newaxis, :]
+        distance_tot_sq = np.einsum("tnd,tnd->tn", distance_direction, distance_direction) + softening_sq
+        distance_tot_sq[np.arange(chunk_begin, chunk_end)[:, np.newaxis] == sources[np.newaxis, :]] = np.inf  # Itself
+
+        # Same order as differential.DirectSumKernel, so float32 does not overflow.
+        inv_distance = 1.0 / np.sqrt(distance_tot_sq)
+        strength = source_strengths[np.newaxis, sources] * inv_distance * inv_distance * inv_distance
+        dveldt_n[chunk_begin:chunk_end] = np.einsum("tn,tnd->td", strength, distance_direction)
+
+
+# Which rows process number process_index (0 is the caller) works out, out of n_bodies.
+def process_rows(n_bodies, processes, process_index):
+    row_bounds = np.linspace(0, n_bodies, processes + 1).astype(int)
+    return int(row_bounds[process_index]), int(row_bounds[process_index + 1])
+
+
+# The arrays in the shared memory blocks, room for `capacity` bodies. Works the same in the kernel and in the workers.
+# layout holds how many bodies and how many sources there are right now, both shrink when bodies merge.
+def shared_arrays(blocks, capacity, number_dimensions, dtype):
+    positions = np.ndarray((capacity, number_dimensions), dtype=dtype, buffer=blocks[0].buf)
+    source_strengths = np.ndarray((capacity,), dtype=dtype, buffer=blocks[1].buf)
+    sources = np.ndarray((capacity,), dtype=np.int64, buffer=blocks[2].buf)
+    dveldt_n = np.ndarray((capacity, number_dimensions), dtype=dtype, buffer=blocks[3].buf)
+    layout = np.ndarray((2,), dtype=np.int64, buffer=blocks[4].buf)
+    return positions, source_strengths, sources, dveldt_n, layout
+
+
+# What each worker process runs. Waits for the go, does its rows, waits for everyone else, and again.
+def worker_main(block_names, capacity, number_dimensions, dtype, softening_sq, processes, process_index,
+                start_barrier, done_barrier, stop):
+    blocks = [shared_memory.SharedMemory(name=name) for name in block_names]
+    arrays = shared_arrays(blocks, capacity, number_dimensions, dtype)
+    try:
+        while True:
+            start_barrier.wait()
+            if stop.value:
+                break
+            try:
+                positions, source_strengths, sources, dveldt_n, layout = arrays
+                n_bodies, n_sources = int(layout[0]), int(layout[1])
+                row_begin, row_end = process_rows(n_bodies, processes, process_index)
+                block_accelerations(
+                    positions[:n_bodies], source_strengths, sources[:n_sources], softening_sq, row_begin, row_end,
+                    dveldt_n
+                )
+                del positions, source_strengths, sources, dveldt_n, layout
+            except Exception:
+                done_barrier.abort()  # Otherwise the kernel would wait for us forever.
+                raise
+            done_barrier.wait()
+    finally:
+        del arrays  # The blocks cannot be closed while arrays still point into them.
+        for block in blocks:
+            block.close()
+
+
+# Stops the workers and frees the shared memory. Called by close(), or when the kernel is garbage collected.
+def shut_down(workers, start_barrier, stop, blocks):
+    stop.value = 1
+    try:
+        start_barrier.wait(timeout=10.0)  # Wakes the workers up to see the stop flag.
+    except threading.BrokenBarrierError:
+        pass
+    for worker in workers:
+        worker.join(timeout=10.0)
+        if worker.is_alive():
+            worker.terminate()
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            pass  # Someone still holds the last accelerations, the memory goes when they let go of it.
+        block.unlink()
+
+
+# Same accelerations() as differential.DirectSumKernel, massless bodies are test particles there as well. No jerks or
+# potential energy, the block time step and regularized integrators need the direct backend.
+class SharedMemoryKernel:
+    def __init__(self, masses, number_dimensions, G=6.67408e-11, processes=0, dtype=np.float64, softening=0.0):
+        """
+        :param processes: How many processes share the work, including this one. 0 for one per core.
+        """
+
+        if number_dimensions != 2 and number_dimensions != 3:
+            raise ValueError("Bad n_dimensions")
+        if multiprocessing.current_process().daemon:
+            raise ValueError(
+                "The parallel force backend cannot start its processes from inside a process pool worker "
+                "(EG ensemble.py's pool mode), use the direct backend there"
+            )
+
+        self.G = G
+        self.number_dimensions = number_dimensions
+        self.dtype = np.dtype(dtype)
+        self.softening_sq = softening ** 2
+        self.capacity = len(np.ravel(masses))  # Bodies only ever get fewer (mergers), so this is enough room.
+
+        if processes <= 0:
+            processes = multiprocessing.cpu_count()
+        self.processes = max(1, min(processes, self.capacity))
+
+        array_bytes = max(1, self.capacity * number_dimensions * self.dtype.itemsize)
+        self.blocks = [
+            shared_memory.SharedMemory(create=True, size=array_bytes),  # Positions
+            shared_memory.SharedMemory(create=True, size=max(1, self.capacity * self.dtype.itemsize)),  # G m
+            shared_memory.SharedMemory(create=True, size=max(1, self.capacity * 8)),  # Sources
+            shared_memory.SharedMemory(create=True, size=array_bytes),  # Accelerations
+            shared_memory.SharedMemory(create=True, size=16),  # Layout
+        ]
+        self.positions, self.source_strengths, self.sources, self.dveldt_n, self.layout = shared_arrays(
+            self.blocks, self.capacity, number_dimensions, self.dtype
+        )
+        self.with_masses(masses)
+
+        # Spawned rather than forked, the window runs simulations on a thread and forking those is asking for trouble.
+        context = multiprocessing.get_context("spawn")
+        self.start_barrier = context.Barrier(self.processes)
+        self.done_barrier = context.Barrier(self.processes)
+        self.stop = context.Value("i", 0)
+        self.workers = []
+        for process_index in range(1, self.processes):
+            worker = context.Process(
+                target=worker_main,
+                args=(
+                    [block.name for block in self.blocks], self.capacity, number_dimensions, self.dtype.str,
+                    self.softening_sq, self.processes, process_index, self.start_barrier, self.done_barrier, self.stop
+                ),
+                daemon=True
+            )
+            worker.start()
+            self.workers.append(worker)
+
+        self.finalizer = weakref.finalize(self, shut_down, self.workers, self.start_barrier, self.stop, self.blocks)
+
+    def with_masses(self, masses):
+        """
+        Switch to a new set of bodies, EG the ones left after a merger, keeping the same worker processes
+
+        :param masses: At most as many bodies as the kernel was made with
+        :return: The kernel itself
+        """
+
+        masses = np.asarray(masses, dtype=np.float64).ravel()
+        if len(masses) > self.capacity:
+            raise ValueError(f"The parallel kernel was made for {self.capacity} bodies, not {len(masses)}")
+
+        sources = np.flatnonzero(masses != 0.0)  # Only bodies with mass pull, see differential.py
+        self.masses = masses
+        self.n_bodies = len(masses)
+        self.source_strengths[:self.n_bodies] = self.G * masses
+        self.sources[:len(sources)] = sources
+        self.layout[:] = (self.n_bodies, len(sources))
+        self.own_rows = process_rows(self.n_bodies, self.processes, 0)
+        return self
+
+    def accelerations(self, pos_vector_bodies):
+        """
+        Calculate the gravitational acceleration on every body
+
+        :param pos_vector_bodies: Positions, shape (n_bodies, n_dimensions)
+        :return: Accelerations, same shape as the positions. The same (shared) array every time, so it is overwritten
+            by the next call, copy it if it needs to be kept.
+        """
+
+        positions = self.positions[:self.n_bodies]
+        positions[...] = pos_vector_bodies
+        self.start_barrier.wait()  # Go!
+        block_accelerations(
+            positions, self.source_strengths, self.sources[:self.layout[1]], self.softening_sq, self.own_rows[0],
+            self.own_rows[1], self.dveldt_n
+        )
+        try:
+            self.done_barrier.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError("A force worker process failed") from None
+        return self.dveldt_n[:self.n_bodies]
+
+    def close(self):  # Stops the workers. Safe to call more than once.
+        self.positions = self.source_strengths = self.sources = self.dveldt_n = self.layout = None
+        self.finalizer()
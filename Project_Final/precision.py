@@ -0,0 +1,53 @@
+# Which number type the simulation works in, picked with AppSettings.precision. Used the same way for packing the
+# initial conditions, the force kernel, the integrator state and the samples that get stored.
+#
+#   float32   Quick previews. Half the memory (and memory traffic) of float64, and twice as many numbers per SIMD
+#             register. Good for a look at big scenes, not for anything you want the energy error of.
+#   float64   The default.
+#   extended  For long runs with very small steps. The initial conditions are packed in np.longdouble, and the
+#             integrators that step the state themselves keep a compensation term (Kahan summation) next to the
+#             float64 positions and velocities, so the rounding errors of millions of small steps do not pile up. That
+#             only shows once the steps are small enough for rounding to be bigger than the integrator's own error
+#             (10 Kepler orbits, 10^4 steps each: yoshida4 5e-14 -> 7e-16 in energy), at the usual step sizes
+#             (Burrau's problem) the energy error is the same as float64. odeint cannot do that from the outside, so
+#             it gets a much tighter tolerance instead. The state is not simply kept in np.longdouble because that
+#             is just float64 on Windows, and nothing (odeint, Numba, bincount) computes in it anyway.
+import numpy as np
+
+PRECISIONS = ["float32", "float64", "extended"]
+
+PACKING_DTYPES = {"float32": np.float32, "float64": np.float64, "extended": np.longdouble}
+STATE_DTYPES = {"float32": np.float32, "float64": np.float64, "extended": np.float64}  # Also what the forces use
+STORAGE_DTYPES = {"float32": np.dtype("<f4"), "float64": np.dtype("<f8"), "extended": np.dtype("<f8")}
+COMPENSATED = {"extended"}  # Precisions that carry a Kahan compensation term along with the state.
+
+# odeint's relative tolerance for extended precision. Its default is about 1.5e-8, much below 1e-13 LSODA starts
+# complaining that it cannot reach the accuracy with float64.
+EXTENDED_ODEINT_RTOL = 1e-13
+
+
+def check_precision(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}")
+
+
+# values + increment, and the new compensation to go with it. With a compensation array (same shape as values), the low
+# bits that got rounded off are kept in it and taken back off next time round (Kahan summation). With None it is plain
+# addition, and the compensation stays None.
+def compensated_sum(values, increment, compensation=None):
+    if compensation is None:
+        return values + increment, None
+
+    corrected = increment - compensation
+    total = values + corrected
+    return total, (total - values) - corrected
+
+
+# Same, but values (and the compensation) are updated in place.
+def add_to(values, increment, compensation=None):
+    if compensation is None:
+        values += increment
+        return
+
+    total, compensation[...] = compensated_sum(values, increment, compensation)
+    values[...] = total
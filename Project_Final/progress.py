@@ -0,0 +1,45 @@
+# Progress reporting for the integrators. The integration loop calls update() between samples (never the RHS),
+# and the observers decide for themselves how often it is worth actually showing anything.
+import time
+
+
+class SimulationCancelled(Exception):  # Raised out of the integration loop when the observer asks to stop.
+    pass
+
+
+class ProgressObserver:  # Does nothing, which is exactly what silent mode wants. Also the base for the others.
+    def update(self, fraction):  # fraction goes from 0.0 to 1.0
+        pass
+
+    def finish(self):
+        pass
+
+    def is_cancelled(self):  # Checked by the integration loop between samples.
+        return False
+
+
+# Only passes progress on every min_interval seconds of wall clock time, however often update() is called.
+class RateLimitedProgress(ProgressObserver):
+    def __init__(self, callback, min_interval=0.1):
+        self.callback = callback
+        self.min_interval = min_interval
+        self.last_report = None
+
+    def update(self, fraction):
+        now = time.perf_counter()
+        if self.last_report is None or now - self.last_report >= self.min_interval:
+            self.last_report = now
+            self.callback(fraction)
+
+    def finish(self):
+        self.callback(1.0)  # Always show the end, even if it came in too soon after the last one.
+
+
+# For the command line, prints a percentage every couple of seconds.
+class ConsoleProgress(RateLimitedProgress):
+    def __init__(self, label, min_interval=2.0):
+        super().__init__(self.print_fraction, min_interval)
+        self.label = label
+
+    def print_fraction(self, fraction):
+        print(f"  {self.label}: {fraction * 100:.0f}%", flush=True)
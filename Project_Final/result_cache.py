@@ -0,0 +1,110 @@
+# Cache of finished simulations on disk, so simulating the same scene with the same settings twice is instant.
+# Each result is a trajectory file (see trajectory_store.py) named after a hash of everything that affects the physics.
+# The least recently used results get deleted once the cache grows past its size limit.
+import hashlib
+import json
+import os
+
+import differential
+import instrumentation
+import simulation
+import trajectory_store
+from scene_io import SAVED_SETTINGS
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".n_body_cache")
+CACHE_FILE_EXTENSION = ".nbtraj"
+CACHE_KEY_VERSION = 1  # Bump if the physics change, so old results are not mistaken for new ones.
+
+# Animation speed only changes how the results are shown, not the results themselves.
+CACHE_KEY_SETTINGS = [name for name in SAVED_SETTINGS if name != "anim_speed"]
+
+
+class ResultCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=1024.0):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Hash of the serialized bodies, the settings, the dimension count and the integrator (which is in the settings).
+    def key_for(self, bodies, app_settings, number_dimensions):
+        key_data = {
+            "version": CACHE_KEY_VERSION,
+            "bodies": differential.as_body_store(bodies).serialize(),
+            "settings": {name: getattr(app_settings, name) for name in CACHE_KEY_SETTINGS},
+            "number_dimensions": number_dimensions,
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_FILE_EXTENSION)
+
+    def lookup(self, key):  # Gives the memory-mapped trajectory, or None if it has not been simulated yet.
+        file_path = self.path_for(key)
+        if not os.path.exists(file_path):
+            return None
+
+        os.utime(file_path)  # Marks it as recently used.
+        return trajectory_store.open_trajectory(file_path)
+
+    def simulate(self, bodies, app_settings, number_dimensions, progress=None, on_samples=None, report=None):
+        """
+        Same as simulation.run_simulation, but takes the results from the cache if they are there
+
+        :param report: instrumentation.RunReport to fill in. On a hit it gets the report of the original run.
+        :return: The sample times, the (memory-mapped) solutions, and whether it was a cache hit
+        """
+
+        if report is None:
+            report = instrumentation.RunReport()
+
+        with report.phase("cache_lookup"):
+            key = self.key_for(bodies, app_settings, number_dimensions)
+            cached = self.lookup(key)
+        if cached is not None:
+            if cached.report is not None:  # What the original run got up to. The only time spent now is the lookup.
+                report.settings = cached.report.settings
+                report.counters = dict(cached.report.counters, cached_run_seconds=sum(cached.report.phases.values()))
+                report.solver = cached.report.solver
+            return cached.times, cached.solutions, True
+
+        # Written straight into the cache as it runs, and only renamed into place once it finished.
+        final_path = self.path_for(key)
+        partial_path = final_path + ".partial"
+        try:
+            total_time, solutions = simulation.run_simulation(
+                bodies, app_settings, number_dimensions, progress, partial_path, on_samples, report
+            )
+            del solutions  # Let go of the memory map, so the file can be renamed (Windows is picky about this).
+            os.replace(partial_path, final_path)
+            trajectory_store.save_report(final_path, report)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)  # Cancelled or failed, do not leave half a result lying around.
+
+        self.evict(keep=final_path)
+
+        trajectory = trajectory_store.open_trajectory(final_path)
+        return trajectory.times, trajectory.solutions, False
+
+    # Deletes the least recently used results until the cache fits in max_bytes again. Never deletes `keep`.
+    def evict(self, keep=None):
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            file_path = os.path.join(self.cache_dir, file_name)
+            if file_name.endswith(CACHE_FILE_EXTENSION) and file_path != keep:
+                file_stat = os.stat(file_path)
+                entries.append((file_stat.st_mtime, file_stat.st_size, file_path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        if keep is not None and os.path.exists(keep):
+            total_bytes += os.path.getsize(keep)
+        for _, size, file_path in sorted(entries):  # Oldest first.
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(file_path)
+                total_bytes -= size
+                if os.path.exists(trajectory_store.report_path_for(file_path)):
+                    os.remove(trajectory_store.report_path_for(file_path))
+            except OSError:
+                pass  # Probably still open somewhere (Windows), it can go next time.
@@ -0,0 +1,218 @@
+# Reading and writing the scene files in saves/. No Qt in here, the file dialogs stay in main_window.py.
+#
+# Two formats, picked by the file extension:
+#   .json     One dict per body, easy to read and edit by hand. What the presets are in.
+#   .nbscene  Binary and column by column, for big scenes (10^5 bodies and up) where parsing the JSON takes ages.
+#
+# .nbscene layout:
+#   8 bytes   magic, b"NBSCENE1"
+#   8 bytes   length of the JSON header in bytes (uint64, little endian)
+#   JSON      header with the body count, settings and where each column is, padded with spaces to a multiple of 64
+#   columns   masses (n), positions (n x 3), velocities (n x 3) and radii (n), little endian float64, each starting
+#             on a multiple of 64 bytes
+#   side      names and colors, as a small JSON table at the end
+#
+# Opening one only reads the header. The columns are memory-mapped, so they are only read from disk as the bodies get
+# used, and the names and colors are read when the bodies are asked for.
+import glob
+import json
+import os
+import struct
+
+import numpy as np
+
+from app_settings import AppSettings
+from differential import BodyStore, as_body_store
+
+# Every setting that gets written to a save. Older saves may be missing some, those keep their current value.
+SAVED_SETTINGS = [
+    "time_samples",
+    "max_time",
+    "anim_speed",
+    "force_backend",
+    "opening_angle",
+    "integrator",
+    "steps_per_sample",
+    "block_eta",
+    "precision",
+    "softening_length",
+    "merge_collisions",
+]
+
+BINARY_SCENE_EXTENSION = ".nbscene"
+BINARY_MAGIC = b"NBSCENE1"
+BINARY_PREAMBLE_SIZE = len(BINARY_MAGIC) + 8
+BINARY_ALIGNMENT = 64
+BINARY_DTYPE = np.dtype("<f8")
+BINARY_COLUMNS = ["masses", "positions", "velocities", "radii"]  # In file order, all BodyStore arrays.
+
+
+def is_binary_scene(file_path):
+    return file_path.lower().endswith(BINARY_SCENE_EXTENSION)
+
+
+# Scene paths from the command line (batch_runner.py, convert_scenes.py). Globs are expanded here, since Windows shells
+# do not do it for us.
+def expand_scene_paths(patterns):
+    scene_paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        scene_paths.extend(matches if len(matches) > 0 else [pattern])
+    return scene_paths
+
+
+def save_scene(file_path, bodies, app_settings):
+    if is_binary_scene(file_path):
+        save_binary_scene(file_path, bodies, app_settings)
+        return
+
+    data = {
+        "bodies": as_body_store(bodies).serialize(),  # Runs the save function.
+        "settings": {name: getattr(app_settings, name) for name in SAVED_SETTINGS},
+    }
+    json_str = json.dumps(data)  # Outputs as a json.
+
+    with open(file_path, "w") as f:
+        f.write(json_str)  # Write the sets of file into the destination.
+
+
+# Gives back the bodies (a differential.BodyStore), and puts any saved settings into app_settings.
+def load_scene(file_path, app_settings):
+    if is_binary_scene(file_path):
+        scene = open_binary_scene(file_path)
+        scene.apply_settings(app_settings)
+        return scene.bodies()
+
+    with open(file_path, "r") as f:
+        content = f.read()  # To read the loaded contents
+
+    data = json.loads(content)  # Loads
+
+    bodies = BodyStore.deserialize(data["bodies"])  # Thus puts it into the program.
+
+    if "settings" in data:
+        apply_settings(data["settings"], app_settings)
+
+    return bodies
+
+
+def apply_settings(settings, app_settings):
+    for name in SAVED_SETTINGS:
+        if name in settings:
+            setattr(app_settings, name, settings[name])
+
+
+def aligned(size):  # Rounded up to a multiple of BINARY_ALIGNMENT.
+    return -(-size // BINARY_ALIGNMENT) * BINARY_ALIGNMENT
+
+
+# Whether any of the store's columns are memory-mapped from this file, EG it was loaded from the file being saved over.
+def maps_file(store, file_path):
+    for array in [store.masses, store.positions, store.velocities, store.radii]:
+        mapped_path = getattr(array, "filename", None)
+        if mapped_path is not None and os.path.exists(file_path) and os.path.samefile(mapped_path, file_path):
+            return True
+    return False
+
+
+def save_binary_scene(file_path, bodies, app_settings):
+    store = as_body_store(bodies)
+    if maps_file(store, file_path):
+        store.load_into_memory()  # Windows refuses to replace a file that is still mapped.
+    side_table = json.dumps({"names": store.names, "colors": store.colors}).encode("utf-8")
+
+    # Offsets are from the end of the header, so they do not depend on how long the header turns out.
+    columns = {}
+    offset = 0
+    for name in BINARY_COLUMNS:
+        array = getattr(store, name)
+        columns[name] = {"shape": list(array.shape), "offset": offset}
+        offset = aligned(offset + array.size * BINARY_DTYPE.itemsize)
+
+    header = {
+        "n_bodies": len(store),
+        "dtype": BINARY_DTYPE.str,
+        "columns": columns,
+        "side_table": {"offset": offset, "size": len(side_table)},
+        "settings": {name: getattr(app_settings, name) for name in SAVED_SETTINGS},
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    padded_size = aligned(BINARY_PREAMBLE_SIZE + len(header_bytes))
+    header_bytes += b" " * (padded_size - BINARY_PREAMBLE_SIZE - len(header_bytes))
+
+    # Written next to it and then swapped in, so a failed save does not leave half a scene behind.
+    temporary_path = file_path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(BINARY_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        data_start = f.tell()
+        for name in BINARY_COLUMNS:
+            f.seek(data_start + columns[name]["offset"])
+            f.write(np.ascontiguousarray(getattr(store, name), dtype=BINARY_DTYPE).tobytes())
+        f.seek(data_start + offset)
+        f.write(side_table)
+    try:
+        os.replace(temporary_path, file_path)
+    except OSError:  # EG the file is open (or mapped) in another program on Windows. The old file is still there.
+        os.remove(temporary_path)
+        raise
+
+
+class BinaryScene:  # A .nbscene file opened for reading. Only the header has been read so far.
+    def __init__(self, file_path, header, data_start):
+        self.file_path = file_path
+        self.header = header
+        self.data_start = data_start
+        self.n_bodies = header["n_bodies"]
+        self.settings = header["settings"]
+
+    def apply_settings(self, app_settings):
+        apply_settings(self.settings, app_settings)
+
+    def column(self, name):  # One of BINARY_COLUMNS, memory-mapped. Copy on write, so editing it leaves the file alone.
+        column = self.header["columns"][name]
+        if self.n_bodies == 0:
+            return np.zeros(column["shape"], dtype=self.header["dtype"])  # np.memmap does not do empty arrays.
+        return np.memmap(
+            self.file_path,
+            dtype=self.header["dtype"],
+            mode="c",
+            offset=self.data_start + column["offset"],
+            shape=tuple(column["shape"])
+        )
+
+    def side_table(self):  # {"names": [...], "colors": [...]}
+        with open(self.file_path, "rb") as f:
+            f.seek(self.data_start + self.header["side_table"]["offset"])
+            return json.loads(f.read(self.header["side_table"]["size"]).decode("utf-8"))
+
+    def bodies(self):  # As a differential.BodyStore, straight on top of the memory-mapped columns.
+        side_table = self.side_table()
+        return BodyStore.from_columns(
+            side_table["names"], side_table["colors"], *(self.column(name) for name in BINARY_COLUMNS)
+        )
+
+
+def open_binary_scene(file_path):
+    with open(file_path, "rb") as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError(f"{file_path} is not a binary scene file")
+        header_size, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size).decode("utf-8"))
+
+    return BinaryScene(file_path, header, BINARY_PREAMBLE_SIZE + header_size)
+
+
+# Same scene in the other format, EG a JSON preset -> .nbscene. The format is picked from destination's extension.
+def convert_scene(source_path, destination_path):
+    app_settings = AppSettings()
+    save_scene(destination_path, load_scene(source_path, app_settings), app_settings)
+
+
+def converted_path(source_path, output_dir=None):  # Where convert_scenes.py puts a converted scene.
+    root = os.path.splitext(source_path)[0]
+    new_extension = ".json" if is_binary_scene(source_path) else BINARY_SCENE_EXTENSION
+    if output_dir is not None:
+        root = os.path.join(output_dir, os.path.basename(root))
+    return root + new_extension
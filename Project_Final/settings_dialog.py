@@ -1,7 +1,12 @@
 from PySide2.QtCore import Qt
-from PySide2.QtWidgets import QDialog, QPushButton, QFormLayout, QVBoxLayout, QWidget, QLabel, QLineEdit, QColorDialog
+from PySide2.QtWidgets import QDialog, QPushButton, QFormLayout, QVBoxLayout, QWidget, QLabel, QLineEdit, QColorDialog, QComboBox, QCheckBox
 import math
 
+from differential import FORCE_BACKENDS
+from integrators import INTEGRATORS
+from body_renderers import RENDERERS
+from precision import PRECISIONS
+
 
 class SettingsDialog(QDialog):
     def __init__(self, settings, parent=None):  # Creating another window...
@@ -21,6 +26,18 @@ class SettingsDialog(QDialog):
         self.time_samples_edit = self.make_number_edit("# of time samples", "time_samples", "%d")
         self.max_time_edit = self.make_number_edit("Max time", "max_time", "%.9f")
         self.anim_speed_edit = self.make_number_edit("Animation speed", "anim_speed", "%.9f")
+        self.force_backend_edit = self.make_choice_edit("Force backend", "force_backend", FORCE_BACKENDS)
+        self.opening_angle_edit = self.make_number_edit("Barnes-Hut opening angle", "opening_angle", "%.9f")
+        self.force_processes_edit = self.make_number_edit("Parallel processes (0 = all cores)", "force_processes", "%d")
+        self.integrator_edit = self.make_choice_edit("Integrator", "integrator", INTEGRATORS)
+        self.steps_per_sample_edit = self.make_number_edit("Steps per sample (fixed-step)", "steps_per_sample", "%d")
+        self.block_eta_edit = self.make_number_edit("Block time step accuracy (eta)", "block_eta", "%.9f")
+        self.softening_length_edit = self.make_number_edit("Softening length", "softening_length", "%.9f")
+        self.merge_collisions_edit = self.make_check_edit("Merge bodies that touch at a sample", "merge_collisions")
+        self.precision_edit = self.make_choice_edit("Precision", "precision", PRECISIONS)
+        self.cache_size_mb_edit = self.make_number_edit("Result cache size (MB, 0 = off)", "cache_size_mb", "%.9f")
+        self.stream_animation_edit = self.make_check_edit("Animate while simulating", "stream_animation")
+        self.renderer_edit = self.make_choice_edit("Renderer", "renderer", RENDERERS)
 
         ok_button = QPushButton(self)  # The ok button.
         ok_button.setText("Ok")
@@ -62,9 +79,48 @@ class SettingsDialog(QDialog):
 
         return line_edit
 
+    # Makes a label and a drop down box for settings that can only be one of a few strings.
+    def make_choice_edit(self, text, attribute_name, choices):
+        label = QLabel(self)
+        label.setText(text)
+        label.setMinimumWidth(200)
+
+        combo_box = QComboBox(self)
+        combo_box.addItems(choices)
+        combo_box.setCurrentText(getattr(self.settings, attribute_name))  # Same getattr magic as above.
+
+        self.form_layout.addRow(label, combo_box)
+
+        return combo_box
+
+    # Makes a label and a tick box for on/off settings.
+    def make_check_edit(self, text, attribute_name):
+        label = QLabel(self)
+        label.setText(text)
+        label.setMinimumWidth(200)
+
+        check_box = QCheckBox(self)
+        check_box.setChecked(getattr(self.settings, attribute_name))
+
+        self.form_layout.addRow(label, check_box)
+
+        return check_box
+
     def confirm(self):  # This will update all the values on the ball
         self.settings.time_samples = int(self.time_samples_edit.text())
         self.settings.max_time = float(self.max_time_edit.text())
         self.settings.anim_speed = float(self.anim_speed_edit.text())
+        self.settings.force_backend = self.force_backend_edit.currentText()
+        self.settings.opening_angle = float(self.opening_angle_edit.text())
+        self.settings.force_processes = max(0, int(self.force_processes_edit.text()))
+        self.settings.integrator = self.integrator_edit.currentText()
+        self.settings.steps_per_sample = max(1, int(self.steps_per_sample_edit.text()))
+        self.settings.block_eta = float(self.block_eta_edit.text())
+        self.settings.softening_length = max(0.0, float(self.softening_length_edit.text()))
+        self.settings.merge_collisions = self.merge_collisions_edit.isChecked()
+        self.settings.precision = self.precision_edit.currentText()
+        self.settings.cache_size_mb = max(0.0, float(self.cache_size_mb_edit.text()))
+        self.settings.stream_animation = self.stream_animation_edit.isChecked()
+        self.settings.renderer = self.renderer_edit.currentText()
 
         self.close()
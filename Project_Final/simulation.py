@@ -0,0 +1,120 @@
+# Runs a simulation from a list of bodies and the settings. No Qt or matplotlib in here,
+# so the same code is used by the window (main_window.py) and by the headless runner (batch_runner.py).
+import numpy as np
+
+import collisions
+import differential
+import instrumentation
+import integrators
+import precision
+import trajectory_store
+
+G = 6.67408e-11  # Gravitational constant
+
+
+# AUTO-INITIAL CONDITION FITTER. Positions of all bodies first, then all the velocities, flattened to 1D.
+# dtype comes from precision.PACKING_DTYPES. One array copy, see differential.BodyStore.pack.
+def pack_initial_conditions(bodies, number_dimensions, dtype=np.float64):
+    return differential.as_body_store(bodies).pack(number_dimensions, dtype)
+
+
+def close_kernel(force_kernel):  # Stops the worker processes of the parallel backend, nothing to do for the others.
+    if hasattr(force_kernel, "close"):
+        force_kernel.close()
+
+
+def run_simulation(bodies, app_settings, number_dimensions, progress=None, trajectory_path=None, on_samples=None,
+                   report=None):
+    """
+    Simulate the bodies with the given settings
+
+    :param bodies: differential.BodyStore, or a list (or BodiesModel) of differential.Ball
+    :param app_settings: AppSettings to take the time span, force backend and integrator from
+    :param number_dimensions: 2 or 3
+    :param progress: A progress.ProgressObserver, or None for silence
+    :param trajectory_path: If given, samples are written to this trajectory file as the run goes (see
+        trajectory_store.py), and the solutions given back are memory-mapped from it instead of held in RAM
+    :param on_samples: Called as on_samples(first_index, sample_rows) for every block of samples as the run goes
+    :param report: An instrumentation.RunReport to fill in with timings and solver statistics, or None
+    :return: The sample times, and the solutions with one row per sample (positions then velocities)
+    """
+
+    if report is None:
+        report = instrumentation.RunReport()
+    bodies = differential.as_body_store(bodies)
+    report.settings.update({
+        "bodies": len(bodies),
+        "dimensions": number_dimensions,
+        "samples": app_settings.time_samples,
+        "integrator": app_settings.integrator,
+        "force_backend": app_settings.force_backend,
+        "precision": app_settings.precision,
+        "softening_length": app_settings.softening_length,
+        "merge_collisions": app_settings.merge_collisions,
+    })
+    precision.check_precision(app_settings.precision)
+
+    with report.phase("setup"):
+        # ADJUST LAST ARRAY ELEMENT TO ADJUST AMOUNT OF SAMPLES, IMPORTANT FOR CLOSE ENCOUNTERS.
+        total_time = np.linspace(0, app_settings.max_time, app_settings.time_samples)
+
+        initial_parameters = bodies.pack(number_dimensions, precision.PACKING_DTYPES[app_settings.precision])
+
+        def make_kernel(masses):
+            return differential.make_force_kernel(
+                app_settings.force_backend,
+                masses,
+                number_dimensions,
+                G,
+                app_settings.opening_angle,
+                precision.STATE_DTYPES[app_settings.precision],
+                app_settings.softening_length,
+                app_settings.force_processes
+            )
+
+        # Force kernel prepared once, so the RHS never has to go back through the bodies. Counted for the report.
+        force_kernel = instrumentation.CountingKernel(make_kernel(bodies.masses))
+        report.settings["force_kernel"] = type(force_kernel.force_kernel).__name__  # Which one "direct" ended up as
+
+        mergers = None
+        if app_settings.merge_collisions:
+            def restart_kernel(masses):  # After a merger. Same counter, so the report still covers the whole run.
+                if hasattr(force_kernel.force_kernel, "with_masses"):
+                    force_kernel.force_kernel = force_kernel.force_kernel.with_masses(masses)  # Keeps its processes.
+                else:
+                    force_kernel.force_kernel = make_kernel(masses)
+                return force_kernel
+
+            mergers = collisions.MergeTracker(bodies.masses, bodies.radii, number_dimensions, restart_kernel)
+
+        samples = None
+        if trajectory_path is not None:
+            samples = trajectory_store.TrajectoryWriter(trajectory_path, bodies, app_settings, number_dimensions, total_time)
+
+    # Integrator go.
+    try:
+        with report.phase("integrate"):
+            solutions = integrators.integrate(
+                app_settings.integrator,
+                force_kernel,
+                initial_parameters,
+                total_time,
+                len(bodies),
+                number_dimensions,
+                app_settings.steps_per_sample,
+                app_settings.block_eta,
+                progress,
+                samples,
+                on_samples,
+                report.solver,
+                app_settings.precision,
+                mergers
+            )
+    finally:
+        close_kernel(force_kernel.force_kernel)
+        if samples is not None:
+            samples.close()  # Also when cancelled, what got written so far is still a readable file.
+        report.counters["rhs_evaluations"] = force_kernel.rhs_evaluations
+        report.counters["body_evaluations"] = force_kernel.body_evaluations
+
+    return total_time, solutions
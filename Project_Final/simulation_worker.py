@@ -0,0 +1,103 @@
+# Runs simulation.run_simulation on a background QThread, so the window keeps redrawing and the run can be cancelled.
+# Everything the worker needs is copied up front, editing bodies in the meantime does not change the run.
+import copy
+import queue
+import threading
+
+import numpy as np
+from PySide2.QtCore import QObject, QThread, Signal
+
+import instrumentation
+import simulation
+from differential import as_body_store
+from progress import RateLimitedProgress, SimulationCancelled
+
+
+# Progress that goes out through a signal (thread safe), and reports cancelling back to the integration loop.
+class WorkerProgress(RateLimitedProgress):
+    def __init__(self, worker):
+        super().__init__(lambda fraction: worker.progress_changed.emit(int(fraction * 100)))
+        self.worker = worker
+
+    def is_cancelled(self):
+        return self.worker.cancel_event.is_set()
+
+
+class SimulationWorker(QObject):
+    progress_changed = Signal(int)  # Percent done
+    finished = Signal(object, object)  # total_time, solutions. Passed by reference, the arrays are never copied.
+    failed = Signal(str)  # Error message
+    cancelled = Signal()
+    stopped = Signal()  # Always emitted last, whichever way the run ended.
+
+    def __init__(self, bodies, app_settings, number_dimensions, cache=None, frame_queue=None):
+        super().__init__()
+
+        # Snapshot of the scene, so the GUI is free to carry on editing the real ones.
+        self.bodies = as_body_store(bodies).copy()
+        self.app_settings = copy.copy(app_settings)
+        self.number_dimensions = number_dimensions
+        self.cache = cache  # result_cache.ResultCache, or None to always simulate.
+        self.frame_queue = frame_queue  # Bounded queue.Queue for streaming frames to the animation, or None.
+        self.report = instrumentation.RunReport()  # Timings and solver statistics, read once it has finished.
+
+        self.cancel_event = threading.Event()  # Set from the GUI thread, checked by the integration loop.
+
+    def run(self):  # Runs on the worker thread.
+        try:
+            if self.cache is not None:
+                total_time, solutions, _ = self.cache.simulate(
+                    self.bodies,
+                    self.app_settings,
+                    self.number_dimensions,
+                    WorkerProgress(self),
+                    on_samples=self.put_frames if self.frame_queue is not None else None,
+                    report=self.report
+                )
+            else:
+                total_time, solutions = simulation.run_simulation(
+                    self.bodies,
+                    self.app_settings,
+                    self.number_dimensions,
+                    WorkerProgress(self),
+                    on_samples=self.put_frames if self.frame_queue is not None else None,
+                    report=self.report
+                )
+            self.finished.emit(total_time, solutions)
+        except SimulationCancelled:
+            self.cancelled.emit()
+        except Exception as error:  # Bad settings and such, show it rather than killing the thread silently.
+            self.failed.emit(str(error))
+        finally:
+            self.stopped.emit()
+
+    # Hands finished frames over to the animation. If the queue is full the simulation waits here for it to catch up.
+    def put_frames(self, first_index, sample_rows):
+        # Only the positions get drawn. Copied, since the integrator may reuse its buffers.
+        position_rows = np.array(sample_rows[:, :len(self.bodies) * self.number_dimensions])
+        while True:
+            try:
+                self.frame_queue.put((first_index, position_rows), timeout=0.1)
+                return
+            except queue.Full:
+                if self.cancel_event.is_set():  # Nobody is going to empty the queue, so stop waiting.
+                    raise SimulationCancelled()
+
+    # Called straight from the GUI thread. Not as a slot through a signal: the worker lives on its own thread, so a
+    # queued call would only get through once run() had finished.
+    def cancel(self):
+        self.cancel_event.set()
+
+
+# Makes a worker on its own thread and starts it. The thread and worker clean themselves up when done.
+def start_simulation_thread(parent, bodies, app_settings, number_dimensions, cache=None, frame_queue=None):
+    thread = QThread(parent)
+    worker = SimulationWorker(bodies, app_settings, number_dimensions, cache, frame_queue)
+    worker.moveToThread(thread)
+
+    thread.started.connect(worker.run)
+    worker.stopped.connect(thread.quit)
+    thread.finished.connect(worker.deleteLater)
+    thread.finished.connect(thread.deleteLater)
+
+    return thread, worker
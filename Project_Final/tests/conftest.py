@@ -0,0 +1,5 @@
+# The modules sit flat in Project_Final/ and import each other by name, so the tests need it on the path.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
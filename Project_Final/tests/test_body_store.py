@@ -0,0 +1,94 @@
+# BodyStore packing and saving round trips, and Balls staying views of the right row.
+import numpy as np
+import pytest
+
+import scene_io
+from app_settings import AppSettings
+from differential import Ball, BodyStore, as_body_store
+
+
+def small_scene():
+    return BodyStore.from_arrays(
+        ["Sun", "Earth", "Rock"],
+        [2e30, 6e24, 0.0],
+        [[0.0, 0.0, 0.0], [1.5e11, 0.0, 1e9], [-4e11, 2e11, 0.0]],
+        [[0.0, 0.0, 0.0], [0.0, 3e4, 0.0], [1e3, -2e3, 5e2]],
+        ["#ffff00", "#0000ff", "#888888"],
+        [7e8, 6.4e6, 0.0]
+    )
+
+
+def assert_same_scene(first, second):
+    assert first.names == second.names
+    assert first.colors == second.colors
+    for attribute in ["masses", "radii", "positions", "velocities"]:
+        np.testing.assert_array_equal(getattr(first, attribute), getattr(second, attribute))
+
+
+@pytest.mark.parametrize("number_dimensions", [2, 3])
+def test_pack_is_positions_then_velocities(number_dimensions):
+    store = small_scene()
+    packed = store.pack(number_dimensions)
+    split_index = len(store) * number_dimensions
+    np.testing.assert_array_equal(packed[:split_index], store.positions[:, :number_dimensions].ravel())
+    np.testing.assert_array_equal(packed[split_index:], store.velocities[:, :number_dimensions].ravel())
+
+
+def test_serialize_round_trip_matches_balls():
+    store = small_scene()
+    body_infos = store.serialize()
+    assert body_infos == [ball.serialize() for ball in store]
+    assert_same_scene(BodyStore.deserialize(body_infos), store)
+
+
+@pytest.mark.parametrize("extension", [".json", ".nbscene"])
+def test_scene_file_round_trip(tmp_path, extension):
+    store = small_scene()
+    app_settings = AppSettings()
+    app_settings.integrator = "yoshida4"
+    file_path = str(tmp_path / ("scene" + extension))
+    scene_io.save_scene(file_path, store, app_settings)
+
+    loaded_settings = AppSettings()
+    assert_same_scene(scene_io.load_scene(file_path, loaded_settings), store)
+    assert loaded_settings.integrator == "yoshida4"
+
+
+def test_saving_over_the_loaded_binary_scene(tmp_path):
+    file_path = str(tmp_path / "scene.nbscene")
+    scene_io.save_scene(file_path, small_scene(), AppSettings())
+
+    loaded = scene_io.load_scene(file_path, AppSettings())
+    loaded[1].mass = 1.0
+    scene_io.save_scene(file_path, loaded, AppSettings())
+    assert scene_io.load_scene(file_path, AppSettings()).masses[1] == 1.0
+
+
+def test_append_moves_the_ball():
+    first, second = BodyStore(), BodyStore()
+    ball = Ball("Moon", mass=7e22)
+    first.append(ball)
+    assert first[0] is ball
+
+    second.append(ball)
+    ball.mass = 1.0
+    assert second.masses[0] == 1.0
+    assert first.masses[0] == 7e22  # The first store keeps its own copy, with a new Ball for it.
+    assert first[0] is not ball and first[0].mass == 7e22
+
+
+def test_as_body_store_copies_rows_of_another_scene():
+    scene = small_scene()
+    earth = scene[1]
+    copy = as_body_store([Ball("Comet", mass=1.0), earth])
+    assert earth.store is scene
+    assert copy.names == ["Comet", "Earth"]
+
+
+def test_deleted_ball_keeps_its_values():
+    store = small_scene()
+    earth, rock = store[1], store[2]
+    del store[1]
+    assert earth.mass == 6e24 and earth.name == "Earth"
+    assert rock.row == 1 and rock is store[1]
+    assert len(store) == 2
@@ -0,0 +1,102 @@
+# The spatial hash against a plain all-pairs check, and mergers keeping what they should.
+import numpy as np
+import pytest
+
+import collisions
+import differential
+import integrators
+
+G = 6.67408e-11
+
+
+def brute_force_collisions(positions, radii):
+    pairs = []
+    for first in range(len(positions)):
+        for second in range(first + 1, len(positions)):
+            if radii[first] > 0.0 and radii[second] > 0.0:
+                if np.linalg.norm(positions[second] - positions[first]) < radii[first] + radii[second]:
+                    pairs.append((first, second))
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+
+@pytest.mark.parametrize("number_dimensions", [2, 3])
+def test_find_collisions_matches_all_pairs(number_dimensions):
+    rng = np.random.default_rng(4)
+    positions = rng.uniform(-10.0, 10.0, (300, number_dimensions))
+    radii = rng.uniform(0.0, 0.6, 300)
+    radii[::7] = 0.0  # Some that never collide
+
+    found = collisions.find_collisions(positions, radii)
+    expected = brute_force_collisions(positions, radii)
+    assert len(expected) > 0
+    np.testing.assert_array_equal(found[np.lexsort(found.T[::-1])], expected)
+
+
+def test_find_collisions_needs_two_with_a_radius():
+    positions = np.zeros((3, 3))
+    assert len(collisions.find_collisions(positions, np.array([1.0, 0.0, 0.0]))) == 0
+
+
+def test_merge_groups_joins_chains():
+    groups = collisions.merge_groups(np.array([[0, 1], [1, 2], [4, 5]]), 7)
+    assert sorted(sorted(int(body) for body in group) for group in groups) == [[0, 1, 2], [4, 5]]
+
+
+def state(positions, velocities):
+    return np.concatenate((np.ravel(positions), np.ravel(velocities))).astype(np.float64)
+
+
+def test_merge_conserves_mass_momentum_and_centre():
+    masses = np.array([1.0, 3.0, 2.0])
+    positions = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [10.0, 0.0, 0.0]])
+    velocities = np.array([[0.0, 4.0, 0.0], [0.0, 0.0, 0.0], [1.0, 0.0, 0.0]])
+    tracker = collisions.MergeTracker(masses, [1.0, 1.0, 1.0], 3, None)
+
+    row = state(positions, velocities)
+    row_index, pairs = tracker.first_collision(row[np.newaxis, :])
+    merged = tracker.merge(row, pairs)
+
+    np.testing.assert_array_equal(tracker.active, [1, 2])  # The heaviest survives.
+    np.testing.assert_allclose(tracker.active_masses, [4.0, 2.0])
+    np.testing.assert_allclose(tracker.active_radii[0], np.cbrt(2.0))  # Same volume
+    merged_positions, merged_velocities = merged[:6].reshape(2, 3), merged[6:].reshape(2, 3)
+    np.testing.assert_allclose(merged_positions[0], [0.75, 0.0, 0.0])
+    np.testing.assert_allclose(tracker.active_masses @ merged_velocities, masses @ velocities)
+
+    # Expanded back to every body of the scene, the absorbed one follows the survivor.
+    expanded = tracker.expand(merged[np.newaxis, :])[0]
+    np.testing.assert_allclose(expanded[0:3], expanded[3:6])
+
+
+def test_merge_all_catches_the_merged_body_touching_another():
+    # 0 and 1 touch. The merged body is bigger and sits in between, where it reaches 2 as well.
+    positions = np.array([[0.0, 0.0, 0.0], [1.5, 0.0, 0.0], [0.75, 1.6, 0.0]])
+    tracker = collisions.MergeTracker([1.0, 1.0, 1.0], [1.0, 1.0, 0.5], 3, None)
+
+    row = state(positions, np.zeros((3, 3)))
+    row_index, pairs = tracker.first_collision(row[np.newaxis, :])
+    np.testing.assert_array_equal(pairs, [[0, 1]])
+
+    tracker.merge_all(row, pairs)
+    assert len(tracker.active) == 1
+    assert tracker.active_masses[0] == 3.0
+
+
+def test_head_on_collision_merges_during_a_run():
+    masses = np.array([1e30, 5e29])
+    positions = np.array([[-1e9, 0.0], [1e9, 0.0]])
+    velocities = np.array([[1e4, 0.0], [-2e4, 0.0]])
+    tracker = collisions.MergeTracker(
+        masses, [3e8, 3e8], 2, lambda active_masses: differential.DirectSumKernel(active_masses, 2, G)
+    )
+    total_time = np.linspace(0.0, 2e5, 2001)  # Often enough to see them touch, see collisions.py
+    solver_stats = {}
+    solutions = integrators.integrate(
+        "leapfrog", differential.DirectSumKernel(masses, 2, G), state(positions, velocities), total_time, 2, 2,
+        steps_per_sample=10, solver_stats=solver_stats, mergers=tracker
+    )
+
+    assert solver_stats["mergers"] == 1
+    np.testing.assert_allclose(solutions[-1, 0:2], solutions[-1, 2:4])  # One body from then on
+    momentum = masses @ solutions[:, 4:].reshape(len(total_time), 2, 2)
+    np.testing.assert_allclose(momentum[-1], momentum[0], atol=1e-9 * np.sum(masses * np.abs(velocities[:, 0])))
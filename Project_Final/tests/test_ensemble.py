@@ -0,0 +1,30 @@
+# Ensemble summaries, which have to stay usable when bodies merge partway through a run.
+import numpy as np
+
+import ensemble
+from app_settings import AppSettings
+from differential import BodyStore
+
+
+def test_summary_after_a_merger_is_finite():
+    # Two stars falling straight into each other, and a planet well out of the way.
+    variant = BodyStore.from_arrays(
+        ["Star A", "Star B", "Planet"],
+        [1e30, 5e29, 1e24],
+        [[-1e9, 0.0, 0.0], [1e9, 0.0, 0.0], [0.0, 5e10, 0.0]],
+        [[1e4, 0.0, 0.0], [-2e4, 0.0, 0.0], [5e4, 0.0, 0.0]],
+        radii=[3e8, 3e8, 0.0]
+    )
+    app_settings = AppSettings()
+    app_settings.integrator = "leapfrog"
+    app_settings.steps_per_sample = 10
+    app_settings.time_samples = 2001
+    app_settings.max_time = 2e5
+    app_settings.merge_collisions = True
+    app_settings.cache_size_mb = 0.0
+
+    summary = ensemble.run_variant((variant, app_settings, 3))
+
+    assert all(np.isfinite(value) for value in summary.values())
+    # The merged stars sit on top of each other afterwards, that does not count as a separation of 0.
+    assert 0.0 < summary["min_separation"] < 2e9
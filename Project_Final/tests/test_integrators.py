@@ -0,0 +1,89 @@
+# Energy errors of the integrators that step the state themselves (fixed-step, block time step and regularized), on
+# Kepler orbits where the answer is known.
+import numpy as np
+import pytest
+
+import diagnostics
+import differential
+import integrators
+
+G = 6.67408e-11
+
+
+# A sun and a planet starting at the far end of an orbit with eccentricity e, in 2D.
+# Gives the masses, the initial parameters and the period.
+def kepler_orbit(eccentricity, semi_major_axis=1.5e11, sun_mass=2e30):
+    distance = semi_major_axis * (1.0 + eccentricity)
+    speed = np.sqrt(G * sun_mass * (1.0 - eccentricity) / distance)
+    masses = np.array([sun_mass, 1e24])
+    positions = np.array([[0.0, 0.0], [distance, 0.0]])
+    velocities = np.array([[0.0, 0.0], [0.0, speed]])
+    period = 2.0 * np.pi * np.sqrt(semi_major_axis ** 3 / (G * sun_mass))
+    return masses, np.concatenate((positions.ravel(), velocities.ravel())), period
+
+
+def run_kepler(integrator, eccentricity, orbits=3, samples_per_orbit=20, **settings):
+    masses, initial_parameters, period = kepler_orbit(eccentricity)
+    total_time = np.linspace(0.0, orbits * period, orbits * samples_per_orbit + 1)
+    kernel = differential.DirectSumKernel(masses, 2, G)
+    solutions = integrators.integrate(integrator, kernel, initial_parameters, total_time, 2, 2, **settings)
+    return solutions, diagnostics.compute_diagnostics(total_time, solutions, masses, 2, G)
+
+
+def max_energy_error(integrator, eccentricity, orbits, steps_per_sample):
+    solutions, run_diagnostics = run_kepler(integrator, eccentricity, orbits, steps_per_sample=steps_per_sample)
+    return np.max(run_diagnostics.errors["energy"])
+
+
+@pytest.mark.parametrize("integrator, bound", [("leapfrog", 1e-3), ("yoshida4", 1e-5)])
+def test_fixed_step_energy_stays_bounded(integrator, bound):
+    # Symplectic, so the energy error goes up and down over each orbit but does not drift.
+    one_orbit = max_energy_error(integrator, 0.3, 1, 10)
+    ten_orbits = max_energy_error(integrator, 0.3, 10, 10)
+    assert one_orbit < bound
+    assert ten_orbits < 1.1 * one_orbit
+
+
+@pytest.mark.parametrize("integrator, order", [("leapfrog", 2), ("yoshida4", 4)])
+def test_fixed_step_order(integrator, order):
+    # Halving the step takes the energy error down by 2^order.
+    coarse = max_energy_error(integrator, 0.3, 1, 10)
+    fine = max_energy_error(integrator, 0.3, 1, 20)
+    assert coarse / fine == pytest.approx(2 ** order, rel=0.1)
+
+
+@pytest.mark.parametrize("eccentricity", [0.5, 0.9])
+def test_block_hermite_energy(eccentricity):
+    solutions, run_diagnostics = run_kepler("block_hermite", eccentricity, block_eta=0.02)
+    assert np.max(run_diagnostics.errors["energy"]) < 1e-6
+    assert np.max(run_diagnostics.errors["angular_momentum"]) < 1e-6
+
+    # Back where it started after every whole orbit.
+    np.testing.assert_allclose(solutions[-1, :4], solutions[0, :4], atol=1e-4 * 1.5e11)
+
+
+def test_regularized_energy():
+    solutions, run_diagnostics = run_kepler("regularized", 0.9, steps_per_sample=4)
+    assert np.max(run_diagnostics.errors["energy"]) < 1e-5
+    assert np.max(run_diagnostics.errors["angular_momentum"]) < 1e-5
+
+
+def test_regularized_steps_keep_kepler_orbits_exact():
+    # The time transformed leapfrog follows a two body orbit exactly apart from timing, however big the steps. Only
+    # the samples in between steps are interpolated, so this looks at the steps themselves.
+    masses, initial_parameters, period = kepler_orbit(0.99)
+    kernel = differential.DirectSumKernel(masses, 2, G)
+    positions = initial_parameters[:4].reshape(2, 2).copy()
+    velocities = initial_parameters[4:].reshape(2, 2).copy()
+
+    def energy():
+        return 0.5 * np.sum(masses * np.sum(velocities ** 2, axis=1)) + kernel.potential_energy(positions)
+
+    initial_energy = energy()
+    ds = period * -initial_energy / 40  # About 40 steps per orbit
+    now = 0.0
+    worst = 0.0
+    while now < 2.0 * period:
+        now = integrators.regularized_step(positions, velocities, now, ds, kernel, masses, -initial_energy)
+        worst = max(worst, abs(energy() / initial_energy - 1.0))
+    assert worst < 1e-10
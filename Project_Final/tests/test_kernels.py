@@ -0,0 +1,126 @@
+# Every force backend against the original per-pair loop (newton_newODE_solver_2).
+import numpy as np
+import pytest
+
+import barnes_hut
+import differential
+import integrators
+import jit_kernel
+import parallel_kernel
+from differential import BodyStore
+
+G = 6.67408e-11
+
+
+# A small made up cluster, masses and distances about solar system sized. Some massless test particles if asked.
+def random_scene(n_bodies, number_dimensions, n_massless=0, seed=1):
+    rng = np.random.default_rng(seed)
+    masses = rng.uniform(1e24, 1e30, n_bodies)
+    masses[n_bodies - n_massless:] = 0.0
+    positions = rng.normal(0.0, 1e11, (n_bodies, number_dimensions))
+    velocities = rng.normal(0.0, 1e4, (n_bodies, number_dimensions))
+    return BodyStore.from_arrays([f"body_{i}" for i in range(n_bodies)], masses, positions, velocities)
+
+
+def legacy_accelerations(store, number_dimensions):
+    n_bodies = len(store)
+    derivatives = differential.newton_newODE_solver_2(
+        0.0, store.pack(number_dimensions), G, (2 * n_bodies, number_dimensions), n_bodies, number_dimensions, store
+    )
+    return derivatives[n_bodies * number_dimensions:].reshape(n_bodies, number_dimensions)
+
+
+def positions_of(store, number_dimensions):
+    return store.pack(number_dimensions)[:len(store) * number_dimensions].reshape(len(store), number_dimensions)
+
+
+@pytest.mark.parametrize("number_dimensions", [2, 3])
+@pytest.mark.parametrize("n_massless", [0, 4])
+def test_direct_matches_legacy(number_dimensions, n_massless):
+    store = random_scene(12, number_dimensions, n_massless)
+    kernel = differential.DirectSumKernel(store.masses, number_dimensions, G)
+    np.testing.assert_allclose(
+        kernel.accelerations(positions_of(store, number_dimensions)), legacy_accelerations(store, number_dimensions),
+        rtol=1e-12
+    )
+
+
+@pytest.mark.parametrize("number_dimensions", [2, 3])
+def test_jit_matches_legacy(number_dimensions):
+    if not jit_kernel.NUMBA_AVAILABLE:
+        pytest.skip("Numba is not installed")
+
+    store = random_scene(12, number_dimensions, n_massless=3)
+    kernel = jit_kernel.JitDirectSumKernel(store.masses, number_dimensions, G)
+    np.testing.assert_allclose(
+        kernel.accelerations(positions_of(store, number_dimensions)), legacy_accelerations(store, number_dimensions),
+        rtol=1e-12
+    )
+
+
+@pytest.mark.parametrize("number_dimensions", [2, 3])
+def test_barnes_hut_without_opening_matches_legacy(number_dimensions):  # Opening angle 0 opens every cell.
+    store = random_scene(40, number_dimensions, n_massless=5)
+    kernel = barnes_hut.BarnesHutKernel(store.masses, number_dimensions, G, opening_angle=0.0)
+    np.testing.assert_allclose(
+        kernel.accelerations(positions_of(store, number_dimensions)), legacy_accelerations(store, number_dimensions),
+        rtol=1e-10
+    )
+
+
+def test_barnes_hut_is_close_at_the_default_opening_angle():
+    store = random_scene(200, 3)
+    kernel = barnes_hut.BarnesHutKernel(store.masses, 3, G, opening_angle=0.5)
+    exact = differential.DirectSumKernel(store.masses, 3, G).accelerations(positions_of(store, 3))
+    error = np.linalg.norm(kernel.accelerations(positions_of(store, 3)) - exact, axis=1) / np.linalg.norm(exact, axis=1)
+    assert np.median(error) < 1e-2
+
+
+def test_parallel_matches_legacy_and_survives_a_merger():
+    store = random_scene(12, 3, n_massless=3)
+    kernel = parallel_kernel.SharedMemoryKernel(store.masses, 3, G, processes=2)
+    try:
+        np.testing.assert_allclose(
+            kernel.accelerations(positions_of(store, 3)), legacy_accelerations(store, 3), rtol=1e-12
+        )
+
+        # Fewer bodies, same processes (what a merger restart does).
+        fewer = store.take(np.arange(8))
+        assert kernel.with_masses(fewer.masses) is kernel
+        np.testing.assert_allclose(
+            kernel.accelerations(positions_of(fewer, 3)), legacy_accelerations(fewer, 3), rtol=1e-12
+        )
+    finally:
+        kernel.close()
+
+
+# Every other backend there is here, Barnes-Hut opening every cell so it should be exact.
+def make_backend_kernel(name, masses):
+    if name == "barnes_hut":
+        return barnes_hut.BarnesHutKernel(masses, 3, G, opening_angle=0.0)
+    elif name == "jit":
+        return jit_kernel.JitDirectSumKernel(masses, 3, G)
+    return parallel_kernel.SharedMemoryKernel(masses, 3, G, processes=2)
+
+
+# Some kernels hand back the same buffer every call. Running them through whole integrations shows none of the
+# integrators hang on to an acceleration past the next evaluation.
+@pytest.mark.parametrize("backend", ["barnes_hut", "jit", "parallel"])
+@pytest.mark.parametrize("integrator", ["odeint", "leapfrog", "yoshida4"])
+def test_every_backend_integrates_like_direct(integrator, backend):
+    if backend == "jit" and not jit_kernel.NUMBA_AVAILABLE:
+        pytest.skip("Numba is not installed")
+
+    store = random_scene(6, 3, n_massless=2)
+    total_time = np.linspace(0.0, 3e6, 31)
+    expected = integrators.integrate(
+        integrator, differential.DirectSumKernel(store.masses, 3, G), store.pack(3), total_time, len(store), 3
+    )
+
+    kernel = make_backend_kernel(backend, store.masses)
+    try:
+        solutions = integrators.integrate(integrator, kernel, store.pack(3), total_time, len(store), 3)
+    finally:
+        if hasattr(kernel, "close"):
+            kernel.close()
+    np.testing.assert_allclose(solutions, expected, rtol=1e-8, atol=1e-8 * np.abs(expected).max())
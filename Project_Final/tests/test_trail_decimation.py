@@ -0,0 +1,23 @@
+# The decimated trails have to keep the extremes of whatever window is drawn, that is what keeps close passes visible.
+import numpy as np
+import pytest
+
+import trail_decimation
+
+
+@pytest.mark.parametrize("n_samples", [4096 + 15, 16 * 1001, 50003])
+def test_trail_keeps_the_extremes_of_any_window(n_samples):
+    rng = np.random.default_rng(n_samples)
+    positions = np.cumsum(rng.normal(size=(n_samples, 6)), axis=0)  # Two bodies in 3D
+    pyramid = trail_decimation.TrailPyramid(positions, 3)
+
+    for _ in range(100):
+        begin, end = np.sort(rng.integers(0, n_samples, 2))
+        end += 1
+        for i_ball in range(2):
+            trail = pyramid.trail(i_ball, begin, end, 300)
+            window = positions[begin:end, 3 * i_ball:3 * i_ball + 3]
+            for axis in range(3):
+                assert trail[axis].min() == window[:, axis].min()
+                assert trail[axis].max() == window[:, axis].max()
+                assert trail[axis][0] == window[0, axis] and trail[axis][-1] == window[-1, axis]
@@ -0,0 +1,119 @@
+# Level of detail for drawing the trails of long runs. A million samples per body is far more than the ~1000
+# pixels the trail gets drawn across, so this picks out only the samples that actually change the picture.
+#
+# Built once per run: the samples are split into buckets, and each bucket keeps the samples where each axis is at its
+# smallest and biggest (min/max decimation). Keeping the extremes, rather than every nth sample, means sharp turns and
+# close passes never get cut off. Each level up merges pairs of buckets, so there is a level for every zoom.
+import numpy as np
+
+BASE_BUCKET_SIZE = 16  # Samples per bucket on the finest level.
+MIN_DECIMATED_SAMPLES = 4096  # Runs shorter than this are always drawn as they are.
+BODY_CHUNK = 256  # Bodies done at once when building, keeps the temporary arrays small for big scenes.
+
+
+class TrailPyramid:
+    def __init__(self, ball_n_position, number_dimensions):
+        self.positions = ball_n_position  # Can be memory-mapped, it is only read through once here.
+        self.number_dimensions = number_dimensions
+        self.n_samples = len(ball_n_position)
+        self.n_bodies = np.size(ball_n_position, axis=1) // number_dimensions
+
+        # levels[k] has shape (buckets, bodies, 2 * dimensions), the sample indices kept for each bucket in time
+        # order. Buckets on level k are BASE_BUCKET_SIZE * 2**k samples long.
+        self.levels = []
+        if self.n_samples >= MIN_DECIMATED_SAMPLES:
+            self.build()
+
+    def build(self):
+        number_dimensions = self.number_dimensions
+        n_buckets = self.n_samples // BASE_BUCKET_SIZE
+        bucket_starts = (np.arange(n_buckets) * BASE_BUCKET_SIZE)[:, np.newaxis, np.newaxis]
+
+        # Finest level straight from the samples, a few bodies at a time.
+        level = np.empty((n_buckets, self.n_bodies, 2 * number_dimensions), dtype=np.int64)
+        for first_body in range(0, self.n_bodies, BODY_CHUNK):
+            last_body = min(first_body + BODY_CHUNK, self.n_bodies)
+            block = np.asarray(self.positions[
+                :n_buckets * BASE_BUCKET_SIZE, first_body * number_dimensions:last_body * number_dimensions
+            ]).reshape(n_buckets, BASE_BUCKET_SIZE, last_body - first_body, number_dimensions)
+            level[:, first_body:last_body, :] = bucket_starts + np.concatenate(
+                (np.argmin(block, axis=1), np.argmax(block, axis=1)), axis=2
+            )
+        level.sort(axis=2)
+        self.levels.append(level)
+
+        # Each level up keeps the extremes of pairs of buckets from the level below.
+        axis_columns = np.arange(self.n_bodies)[np.newaxis, :, np.newaxis] * number_dimensions
+        while len(level) >= 2:
+            n_pairs = len(level) // 2
+            candidates = level[:n_pairs * 2].reshape(n_pairs, 2, self.n_bodies, -1).transpose(0, 2, 1, 3)
+            candidates = candidates.reshape(n_pairs, self.n_bodies, -1)
+
+            kept = []
+            for axis in range(number_dimensions):
+                values = self.positions[candidates, axis_columns + axis]
+                kept.append(np.take_along_axis(candidates, np.argmin(values, axis=2)[..., np.newaxis], axis=2))
+                kept.append(np.take_along_axis(candidates, np.argmax(values, axis=2)[..., np.newaxis], axis=2))
+            level = np.concatenate(kept, axis=2)
+            level.sort(axis=2)
+            self.levels.append(level)
+
+    def trail_indices(self, i_ball, begin, end, max_points):
+        """
+        Which samples to draw for one body's trail between samples begin and end
+
+        :param max_points: Roughly how many points are worth drawing, about the width of the graph in pixels
+        :return: A slice if no decimation is needed, otherwise an array of sample indices in time order
+        """
+
+        if end - begin <= max_points or len(self.levels) == 0:
+            return slice(begin, end)
+
+        # Coarsest level that still gives about max_points points over the window.
+        points_per_bucket = 2 * self.number_dimensions
+        level_index = 0
+        while (level_index + 1 < len(self.levels)
+               and (end - begin) * points_per_bucket // (BASE_BUCKET_SIZE << (level_index + 1)) >= max_points):
+            level_index += 1
+        level = self.levels[level_index]
+        bucket_size = BASE_BUCKET_SIZE << level_index
+
+        # Only the buckets that are wholly inside the window. One that sticks out of it may have its extremes outside,
+        # so the bits of the window before the first and after the last whole bucket (including any samples after the
+        # last bucket of the run) come from the finer levels instead, down to the samples themselves.
+        first_bucket = -(-begin // bucket_size)
+        last_bucket = min(end // bucket_size, len(level))
+        if last_bucket <= first_bucket:
+            return slice(begin, end)
+
+        head = self.trail_indices(i_ball, begin, first_bucket * bucket_size, max_points)
+        tail = self.trail_indices(i_ball, last_bucket * bucket_size, end, max_points)
+        indices = np.concatenate((
+            as_indices(head), level[first_bucket:last_bucket, i_ball, :].ravel(), as_indices(tail)
+        ))
+
+        # The ends of the trail must be exact, and a sample can be the extreme of more than one axis.
+        return np.unique(np.concatenate(([begin], indices, [end - 1])))
+
+    # The trail as one array per axis, ready for set_data / set_data_3d.
+    def trail(self, i_ball, begin, end, max_points):
+        if end <= begin:
+            return [self.positions[begin:end, i_ball * self.number_dimensions + axis]
+                    for axis in range(self.number_dimensions)]
+
+        rows = self.trail_indices(i_ball, begin, end, max_points)
+        first_column = i_ball * self.number_dimensions
+        return [self.positions[rows, first_column + axis] for axis in range(self.number_dimensions)]
+
+
+def as_indices(rows):  # What trail_indices gave, as an array of sample indices.
+    if isinstance(rows, slice):
+        return np.arange(rows.start, rows.stop)
+    return rows
+
+
+# For runs that are still streaming in (no pyramid yet), every nth sample so it stays around max_points. Views only.
+def strided_trail(ball_n_position, i_ball, number_dimensions, begin, end, max_points):
+    step = max(1, -(-(end - begin) // max(max_points, 1)))
+    first_column = i_ball * number_dimensions
+    return [ball_n_position[begin:end:step, first_column + axis] for axis in range(number_dimensions)]
@@ -0,0 +1,148 @@
+# Binary trajectory files (.nbtraj), so finished runs can be archived and replayed without simulating again.
+#
+# Layout:
+#   8 bytes   magic, b"NBTRAJ01"
+#   8 bytes   number of rows written so far (uint64, little endian), updated after every chunk
+#   8 bytes   length of the JSON header in bytes (uint64, little endian)
+#   JSON      header with the bodies, settings and column layout, padded with spaces to a multiple of 64 bytes
+#   rows      rows of [time, positions..., velocities...], same order as the solutions array. float64, or float32
+#             for runs with float32 precision (precision.STORAGE_DTYPES), the header says which
+#
+# Rows are appended chunk by chunk as the run goes, and the file is memory-mapped when read,
+# so a run never has to fit in RAM all at once.
+#
+# The run report (instrumentation.RunReport, timings and solver statistics) is only known once the run is over,
+# so it goes in a small JSON file next to it, <trajectory>.report.json.
+import json
+import struct
+
+import numpy as np
+
+import instrumentation
+import precision
+from differential import BodyStore, as_body_store
+from scene_io import SAVED_SETTINGS
+
+MAGIC = b"NBTRAJ01"
+PREAMBLE_SIZE = len(MAGIC) + 16
+ROW_COUNT_OFFSET = len(MAGIC)
+HEADER_ALIGNMENT = 64
+REPORT_SUFFIX = ".report.json"
+
+
+class TrajectoryWriter:
+    def __init__(self, file_path, bodies, app_settings, number_dimensions, total_time):
+        self.file_path = file_path
+        self.total_time = total_time
+        self.n_bodies = len(bodies)
+        self.number_dimensions = number_dimensions
+        self.n_rows = 0
+        self.dtype = precision.STORAGE_DTYPES[app_settings.precision]
+
+        header = {
+            "n_bodies": self.n_bodies,
+            "number_dimensions": number_dimensions,
+            "columns": ["time", "positions", "velocities"],
+            "dtype": self.dtype.str,
+            "bodies": as_body_store(bodies).serialize(),
+            "settings": {name: getattr(app_settings, name) for name in SAVED_SETTINGS},
+        }
+        header_bytes = json.dumps(header).encode("utf-8")
+        padded_size = -(-(PREAMBLE_SIZE + len(header_bytes)) // HEADER_ALIGNMENT) * HEADER_ALIGNMENT
+        header_bytes += b" " * (padded_size - PREAMBLE_SIZE - len(header_bytes))
+
+        self.file = open(file_path, "wb")
+        self.file.write(MAGIC)
+        self.file.write(struct.pack("<QQ", 0, len(header_bytes)))
+        self.file.write(header_bytes)
+
+    def write(self, first_index, sample_rows):  # Same interface as integrators.MemorySamples.
+        if first_index != self.n_rows:
+            raise ValueError("Trajectory rows have to be written in order")
+
+        times = self.total_time[first_index:first_index + len(sample_rows)]
+        rows = np.column_stack((times, sample_rows)).astype(self.dtype, copy=False)
+        self.file.write(rows.tobytes())
+        self.n_rows += len(rows)
+
+        # Bump the row count only once the data is there, so a half written file still reads fine.
+        self.file.flush()
+        self.file.seek(ROW_COUNT_OFFSET)
+        self.file.write(struct.pack("<Q", self.n_rows))
+        self.file.seek(0, 2)  # Back to the end for the next chunk.
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def result(self):  # Closes the file and hands back the (memory-mapped) solutions, like MemorySamples.
+        self.close()
+        return open_trajectory(self.file_path).solutions
+
+
+# Writes a finished run out in one go (well, in chunks, so memory-mapped solutions are never all loaded).
+def save_trajectory(file_path, bodies, app_settings, number_dimensions, total_time, solutions, chunk_rows=65536):
+    writer = TrajectoryWriter(file_path, bodies, app_settings, number_dimensions, total_time)
+    try:
+        for first_index in range(0, len(solutions), chunk_rows):
+            writer.write(first_index, solutions[first_index:first_index + chunk_rows])
+    finally:
+        writer.close()
+
+
+def report_path_for(file_path):
+    return file_path + REPORT_SUFFIX
+
+
+def save_report(file_path, report):  # report is an instrumentation.RunReport, file_path the trajectory it belongs to.
+    with open(report_path_for(file_path), "w") as f:
+        json.dump(report.to_dict(), f, indent=2)
+
+
+def load_report(file_path):  # The report saved with a trajectory, or None for older files without one.
+    try:
+        with open(report_path_for(file_path), "r") as f:
+            return instrumentation.RunReport.from_dict(json.load(f))
+    except FileNotFoundError:
+        return None
+
+
+class Trajectory:  # A trajectory file opened for reading. Only the header is read, the rest is memory-mapped.
+    def __init__(self, header, rows, report=None):
+        self.header = header
+        self.report = report  # instrumentation.RunReport of the run, if one was saved
+        self.n_bodies = header["n_bodies"]
+        self.number_dimensions = header["number_dimensions"]
+        self.settings = header["settings"]
+
+        split_index = 1 + self.n_bodies * self.number_dimensions
+        self.rows = rows
+        self.times = rows[:, 0]
+        self.solutions = rows[:, 1:]  # Positions then velocities, same as integrators.integrate gives back.
+        self.positions = rows[:, 1:split_index]  # Same layout as MainWindow.ball_n_position.
+        self.velocities = rows[:, split_index:]
+
+    def bodies(self):  # The bodies as they were at the start of the run, as a differential.BodyStore.
+        return BodyStore.deserialize(self.header["bodies"])
+
+
+def open_trajectory(file_path):
+    with open(file_path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{file_path} is not a trajectory file")
+        n_rows, header_size = struct.unpack("<QQ", f.read(16))
+        header = json.loads(f.read(header_size).decode("utf-8"))
+
+    n_columns = 1 + 2 * header["n_bodies"] * header["number_dimensions"]
+    if n_rows == 0:
+        rows = np.zeros((0, n_columns), dtype=header["dtype"])  # np.memmap does not do empty files.
+    else:
+        rows = np.memmap(
+            file_path,
+            dtype=header["dtype"],
+            mode="r",
+            offset=PREAMBLE_SIZE + header_size,
+            shape=(n_rows, n_columns)
+        )
+
+    return Trajectory(header, rows, load_report(file_path))